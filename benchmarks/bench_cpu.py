@@ -0,0 +1,14 @@
+import pytest
+import synthetic
+from components.cpu import cpu_modes
+
+
+@pytest.mark.parametrize("cpus", [8, 64, 256, 1024])
+def bench_cpu_update(benchmark, components, tree, usage, cpus):
+    synthetic.cpu_tree(tree, cpus)
+    cpu = components["cpu"]
+    cpu.setup()
+    benchmark.group = "cpu"
+    output = benchmark(cpu.update)
+    assert output.count(b"cpu_seconds_total{") == cpus * len(cpu_modes)
+    benchmark.extra_info.update(usage(cpu.update))
@@ -0,0 +1,14 @@
+import pytest
+import synthetic
+from components.disk import diskstat_fields
+
+
+@pytest.mark.parametrize("disks", [4, 32, 128, 512])
+def bench_disk_update(benchmark, components, tree, usage, disks):
+    synthetic.disk_tree(tree, disks)
+    disk = components["disk"]
+    disk.setup()
+    benchmark.group = "disk"
+    output = benchmark(disk.update)
+    assert output.count(b"disk_diskstat{") == disks * len(diskstat_fields)
+    benchmark.extra_info.update(usage(disk.update))
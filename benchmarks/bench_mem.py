@@ -0,0 +1,11 @@
+import synthetic
+
+
+def bench_mem_update(benchmark, components, tree, usage):
+    synthetic.meminfo_tree(tree)
+    mem = components["mem"]
+    mem.setup()
+    benchmark.group = "mem"
+    output = benchmark(mem.update)
+    assert b"mem_bytes{" in output
+    benchmark.extra_info.update(usage(mem.update))
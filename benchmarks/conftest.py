@@ -0,0 +1,82 @@
+"""
+Microbenchmarks of component updates on synthetic trees
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks --benchmark-json=out.json
+
+CPU time and allocations of one update are in extra_info of each
+benchmark, benchmarks/gate.py compares them against stored baselines.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "powerall"))
+
+from opts import argsopt, pathopt  # noqa: E402
+from components.cpu import CPU  # noqa: E402
+from components.disk import DISK  # noqa: E402
+from components.mem import MEM  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def components():
+    """Components with their options parsed once, call setup() per tree"""
+    entered = {"cpu": CPU(), "mem": MEM(), "disk": DISK()}
+    for c in entered.values():
+        c.__enter__()
+    argv, sys.argv = sys.argv, ["benchmarks"]
+    try:
+        argsopt.parse_args()
+    finally:
+        sys.argv = argv
+    yield entered
+    for c in entered.values():
+        c.__exit__(None, None, None)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Point procfs, sysfs and udev data at an empty tree under tmp_path"""
+    old = (pathopt.procfs, pathopt.sysfs, pathopt.udev_data)
+    pathopt.set_paths(
+        str(tmp_path / "proc"), str(tmp_path / "sys"), str(tmp_path / "run/udev/data")
+    )
+    yield tmp_path
+    pathopt.set_paths(*old)
+
+
+@pytest.fixture
+def usage():
+    """Measure the CPU time and allocations of one call, for benchmark.extra_info"""
+
+    def measure(fn, rounds: int = 5, cpu_rounds: int = 20) -> dict:
+        fn()
+        cpu = []
+        for _ in range(cpu_rounds):
+            start = time.process_time()
+            fn()
+            cpu.append(time.process_time() - start)
+        tracemalloc.start()
+        try:
+            peak, retained = 0, 0
+            for _ in range(rounds):
+                tracemalloc.reset_peak()
+                start, _ = tracemalloc.get_traced_memory()
+                fn()
+                current, high = tracemalloc.get_traced_memory()
+                peak = max(peak, high - start)
+                retained = max(retained, current - start)
+        finally:
+            tracemalloc.stop()
+        return {
+            "cpu_seconds": min(cpu),
+            "peak_alloc_bytes": peak,
+            "retained_bytes": retained,
+        }
+
+    return measure
@@ -0,0 +1,225 @@
+#!/bin/env python3
+
+"""
+Performance regression gate against stored baselines
+
+Runs the update microbenchmarks and a short end-to-end scrape, then
+either stores the results as a baseline or compares them with one:
+
+    python benchmarks/gate.py save                  # baselines/<commit>.json
+    python benchmarks/gate.py check                 # against the newest baseline
+    python benchmarks/gate.py check --baseline benchmarks/baselines/1a2b3c4.json
+
+check prints every compared value and exits 1 if update time, update CPU
+time, allocations or scrape latency got worse than the threshold.
+Baselines only compare meaningfully on the machine that stored them.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from load import fixture_args, step  # noqa: E402
+from serving import MAIN, wait_ready  # noqa: E402
+
+SCHEMA = 1
+BENCHMARKS = Path(__file__).parent
+BASELINES = BENCHMARKS / "baselines"
+
+# metric -> (kind, changes smaller than this are noise whatever the ratio)
+METRICS = {
+    "min_seconds": ("time", 20e-6),
+    "cpu_seconds": ("time", 20e-6),
+    "peak_alloc_bytes": ("alloc", 4096),
+    "scrape_p50_ms": ("time", 0.05),
+    "scrape_p99_ms": ("time", 0.2),
+    "scrape_cpu_ms": ("time", 0.05),
+}
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_updates(pytest_args: List[str]) -> Dict[str, dict]:
+    """Time, CPU time and peak allocations of each update benchmark
+
+    Times are minimums, which vary the least between runs on one machine.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "bench.json")
+        subprocess.run(
+            [sys.executable, "-m", "pytest", str(BENCHMARKS), "-q", f"--benchmark-json={out}"]
+            + pytest_args,
+            check=True,
+        )
+        with open(out, "r") as f:
+            report = json.load(f)
+    return {
+        b["name"]: {
+            "min_seconds": b["stats"]["min"],
+            "cpu_seconds": b["extra_info"]["cpu_seconds"],
+            "peak_alloc_bytes": b["extra_info"]["peak_alloc_bytes"],
+        }
+        for b in report["benchmarks"]
+    }
+
+
+def run_scrape(seconds: float, cpus: int, disks: int, port: int) -> Dict[str, dict]:
+    """/metrics latency and CPU per scrape of one client, without reuse of collections"""
+    args = Namespace(
+        cpus=cpus,
+        disks=disks,
+        duration=seconds,
+        paths="/metrics",
+        port=port,
+        sample_interval=seconds,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        cmd = [sys.executable, MAIN, f"--port={port}", "--singleflight-ttl=0"]
+        proc = subprocess.Popen(
+            cmd + fixture_args(Path(tmp), args),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(port, 60.0)
+            r = step(proc.pid, 1, 0, args)
+        finally:
+            proc.terminate()
+            proc.wait()
+    return {
+        f"scrape[cpus={cpus},disks={disks}]": {
+            "scrape_p50_ms": r["paths"]["/metrics"]["p50"],
+            "scrape_p99_ms": r["paths"]["/metrics"]["p99"],
+            "scrape_cpu_ms": r["cpu_ms_per_scrape"],
+        }
+    }
+
+
+def run(args) -> dict:
+    results = run_updates(args.pytest_args)
+    if args.scrape_seconds > 0:
+        results.update(run_scrape(args.scrape_seconds, args.cpus, args.disks, args.port))
+    return {
+        "schema": SCHEMA,
+        "commit": commit(),
+        "created": time.time(),
+        "machine": {
+            "node": platform.node(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+
+def newest_baseline() -> Optional[str]:
+    baselines = []
+    for path in glob.glob(str(BASELINES / "*.json")):
+        with open(path, "r") as f:
+            baselines.append((json.load(f).get("created", 0), path))
+    return max(baselines)[1] if baselines else None
+
+
+def compare(baseline: dict, current: dict, thresholds: Dict[str, float]) -> Tuple[List[str], int]:
+    """Lines of a readable diff and the number of regressions"""
+    lines = [
+        f"{'benchmark':<36}{'metric':<20}{'baseline':>14}{'current':>14}{'change':>10}"
+    ]
+    regressions = 0
+    for name, metrics in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            lines.append(f"{name:<36}{'':<20}{'':>14}{'':>14}{'new':>10}")
+            continue
+        for metric, value in metrics.items():
+            if metric not in base:
+                continue
+            kind, floor = METRICS[metric]
+            old = base[metric]
+            change = (value - old) / old if old else 0.0
+            regressed = value - old > floor and change > thresholds[kind]
+            regressions += regressed
+            lines.append(
+                f"{name:<36}{metric:<20}{old:>14.6g}{value:>14.6g}{change:>+10.1%}"
+                + ("  REGRESSED" if regressed else "")
+            )
+    for name in sorted(set(baseline["results"]) - set(current["results"])):
+        lines.append(f"{name:<36}{'':<20}{'':>14}{'':>14}{'missing':>10}")
+    return lines, regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Store or check PowerAll performance baselines")
+    parser.add_argument("command", choices=["save", "check"])
+    parser.add_argument("--name", help="Baseline to save, defaults to the current commit")
+    parser.add_argument("--baseline", help="Baseline to check against, defaults to the newest")
+    parser.add_argument(
+        "--time-threshold",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown of update time, update CPU time and scrape latency",
+    )
+    parser.add_argument(
+        "--alloc-threshold", type=float, default=0.05, help="Allowed growth of peak allocations"
+    )
+    parser.add_argument(
+        "--scrape-seconds", type=float, default=5.0, help="Seconds of the end-to-end scrape, 0 skips it"
+    )
+    parser.add_argument("--cpus", type=int, default=256, help="CPUs of the scrape fixture")
+    parser.add_argument("--disks", type=int, default=32, help="Disks of the scrape fixture")
+    parser.add_argument("--port", type=int, default=18092)
+    parser.add_argument("pytest_args", nargs="*", help="Extra arguments passed to pytest")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        path = args.baseline or newest_baseline()
+        if path is None:
+            sys.exit(f"No baseline in {BASELINES}, run: {sys.argv[0]} save")
+        with open(path, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("schema") != SCHEMA:
+            sys.exit(f"{path} has schema {baseline.get('schema')}, expected {SCHEMA}")
+
+    current = run(args)
+
+    if args.command == "save":
+        BASELINES.mkdir(exist_ok=True)
+        path = BASELINES / f"{args.name or current['commit']}.json"
+        with open(path, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f"Saved baseline {path}")
+        sys.exit(0)
+
+    if baseline["machine"] != current["machine"]:
+        print(f"warning: {path} was stored on {baseline['machine']}, this is {current['machine']}")
+    lines, regressions = compare(
+        baseline,
+        current,
+        {"time": args.time_threshold, "alloc": args.alloc_threshold},
+    )
+    print(f"Compared with {path} (commit {baseline['commit']})")
+    print("\n".join(lines))
+    if regressions:
+        sys.exit(f"{regressions} regression(s) beyond the thresholds")
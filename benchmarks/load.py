@@ -0,0 +1,220 @@
+#!/bin/env python3
+
+"""
+End-to-end scrape load against fixture data
+
+Starts powerall/main.py on a synthetic procfs/sysfs tree, or replaying a
+capture, and drives it from concurrent clients for each step of a
+clients x rate sweep, e.g.
+
+    python benchmarks/load.py --clients 1,4,16 --rates 0.1,1,10 --cpus 256 -- --collect-mode parallel
+
+For every step it reports throughput and p50/p95/p99 latency per path,
+and the CPU time and RSS of the exporter process. With a rate, clients
+send on a fixed schedule and latency counts from the scheduled time, so
+a server falling behind shows up as latency rather than fewer requests.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List, Tuple
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from serving import MAIN, percentile, wait_ready  # noqa: E402
+import synthetic  # noqa: E402
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def fixture_args(root: Path, args) -> List[str]:
+    """Build a synthetic tree under root, main.py arguments to read it"""
+    synthetic.cpu_tree(root, args.cpus)
+    synthetic.meminfo_tree(root)
+    synthetic.disk_tree(root, args.disks)
+    return [
+        f"--path-procfs={root / 'proc'}",
+        f"--path-sysfs={root / 'sys'}",
+        f"--path-udev-data={root / 'run/udev/data'}",
+        "--nvgpu-enable=",
+        "--bmc-enable=",
+    ]
+
+
+def process_usage(pid: int) -> Tuple[float, int]:
+    """CPU seconds (user + system) and RSS bytes of a process"""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        # the command may contain spaces, fields start after its ")"
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open(f"/proc/{pid}/statm", "r") as f:
+        rss = int(f.read().split()[1]) * PAGE_SIZE
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK, rss
+
+
+class Sampler(threading.Thread):
+    """Sample CPU time and RSS of the exporter every interval seconds"""
+
+    def __init__(self, pid: int, interval: float) -> None:
+        super().__init__(daemon=True)
+        self._pid = pid
+        self._interval = interval
+        self._done = threading.Event()
+        self.samples: List[Tuple[float, float, int]] = []
+
+    def run(self):
+        start = time.monotonic()
+        while not self._done.is_set():
+            cpu, rss = process_usage(self._pid)
+            self.samples.append((time.monotonic() - start, cpu, rss))
+            self._done.wait(self._interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def client(
+    port: int,
+    paths: List[str],
+    rate: float,
+    until: float,
+    latencies: Dict[str, List[float]],
+    errors: List[int],
+):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    i = 0
+    start = time.perf_counter()
+    while True:
+        scheduled = start + i / rate if rate > 0 else time.perf_counter()
+        if scheduled >= until:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+            if resp.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            conn.close()
+            continue
+        latencies[path].append(time.perf_counter() - scheduled)
+    conn.close()
+
+
+def step(pid: int, clients: int, rate: float, args) -> dict:
+    paths = args.paths.split(",")
+    latencies: Dict[str, List[float]] = {p: [] for p in paths}
+    errors: List[int] = []
+    sampler = Sampler(pid, args.sample_interval)
+    cpu_start, _ = process_usage(pid)
+    sampler.start()
+    start = time.perf_counter()
+    until = start + args.duration
+    threads = [
+        threading.Thread(
+            target=client, args=(args.port, paths, rate, until, latencies, errors)
+        )
+        for _ in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    cpu_end, _ = process_usage(pid)
+    requests = sum(len(v) for v in latencies.values())
+    scrapes = len(latencies.get("/metrics", [])) or requests
+    rss = [s[2] for s in sampler.samples]
+    return {
+        "clients": clients,
+        "rate": rate,
+        "seconds": elapsed,
+        "errors": len(errors),
+        "paths": {
+            p: {
+                "rps": len(v) / elapsed,
+                "p50": percentile(v, 0.5) * 1000 if v else float("nan"),
+                "p95": percentile(v, 0.95) * 1000 if v else float("nan"),
+                "p99": percentile(v, 0.99) * 1000 if v else float("nan"),
+            }
+            for p, v in latencies.items()
+        },
+        "cpu_percent": (cpu_end - cpu_start) / elapsed * 100,
+        "cpu_ms_per_scrape": (cpu_end - cpu_start) / scrapes * 1000 if scrapes else float("nan"),
+        "rss_max_mb": max(rss) / 2**20 if rss else float("nan"),
+        "rss_end_mb": rss[-1] / 2**20 if rss else float("nan"),
+        "samples": sampler.samples,
+    }
+
+
+def report(r: dict):
+    print(
+        f"clients={r['clients']} rate={r['rate']:g}/s per client: "
+        f"cpu {r['cpu_percent']:.1f}% of a core, {r['cpu_ms_per_scrape']:.2f} ms cpu/scrape, "
+        f"rss max {r['rss_max_mb']:.1f} MB end {r['rss_end_mb']:.1f} MB, errors {r['errors']}"
+    )
+    for p, s in r["paths"].items():
+        print(
+            f"  {p:<32}{s['rps']:>10.1f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load PowerAll scrapes and report latency and overhead")
+    parser.add_argument("--clients", default="1,4,16", help="Concurrent clients of each step")
+    parser.add_argument(
+        "--rates", default="1,0", help="Requests/s of each client per step, 0 for as fast as possible"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of each step")
+    parser.add_argument("--paths", default="/metrics,/api/get/cpu?arg=cpufreqs")
+    parser.add_argument("--cpus", type=int, default=64, help="CPUs of the synthetic tree")
+    parser.add_argument("--disks", type=int, default=8, help="Disks of the synthetic tree")
+    parser.add_argument("--capture", help="Replay this capture instead of a synthetic tree")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=18091)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write every step, with RSS over time, here")
+    parser.add_argument("--main", default=MAIN, help="Entry point to start")
+    parser.add_argument("extra", nargs="*", help="Extra arguments passed to main.py")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.capture:
+            fixture = ["--capture-mode=replay", f"--capture-file={args.capture}"]
+        else:
+            fixture = fixture_args(Path(tmp), args)
+        cmd = [sys.executable, args.main, f"--port={args.port}"] + fixture + args.extra
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        results = []
+        try:
+            wait_ready(args.port, args.startup_timeout)
+            print(f"  {'path':<32}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            for clients in map(int, args.clients.split(",")):
+                for rate in map(float, args.rates.split(",")):
+                    results.append(step(proc.pid, clients, rate, args))
+                    report(results[-1])
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"command": cmd, "steps": results}, f, indent=2)
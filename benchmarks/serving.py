@@ -0,0 +1,120 @@
+#!/bin/env python3
+
+"""
+Compare requests/s and latency of the serving modes
+
+Starts powerall/main.py once per --serve-mode and hits it from
+concurrent keep-alive clients, e.g.
+
+    python benchmarks/serving.py --modes dev,threaded --clients 32 -- --collect-mode background
+"""
+
+from argparse import ArgumentParser
+from typing import List
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "powerall", "main.py")
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def wait_ready(port: int, timeout: float, interval: float = 0.2, path: str = "/ready"):
+    """Wait until path answers 200, or 404 for servers without it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            if resp.status in (200, 404):
+                return
+        except OSError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def client(port: int, paths: List[str], count: int, latencies: List[float], errors: List[int]):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for i in range(count):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+            if resp.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(mode: str, args) -> dict:
+    cmd = [sys.executable, args.main, f"--port={args.port}", f"--serve-mode={mode}"]
+    proc = subprocess.Popen(
+        cmd + args.extra, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_ready(args.port, args.startup_timeout)
+        latencies: List[float] = []
+        errors: List[int] = []
+        per_client = args.requests // args.clients
+        threads = [
+            threading.Thread(
+                target=client,
+                args=(args.port, args.paths.split(","), per_client, latencies, errors),
+            )
+            for _ in range(args.clients)
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {
+        "mode": mode,
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5) * 1000 if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) * 1000 if latencies else float("nan"),
+        "errors": len(errors),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark PowerAll serving modes")
+    parser.add_argument("--modes", default="dev,threaded,waitress")
+    parser.add_argument("--paths", default="/metrics,/api/components")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--main", default=MAIN, help="Entry point to start")
+    parser.add_argument("extra", nargs="*", help="Extra arguments passed to main.py")
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode in args.modes.split(","):
+        r = run(mode, args)
+        print(
+            f"{r['mode']:<10}{r['rps']:>10.1f}{r['p50']:>10.2f}{r['p99']:>10.2f}{r['errors']:>8}"
+        )
@@ -0,0 +1,75 @@
+#!/bin/env python3
+
+"""
+Cold start time of powerall/main.py
+
+Starts main.py on a synthetic tree repeatedly for each configuration and
+reports the median time until it serves, until every component is set up
+(/ready), and its RSS then, e.g.
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --config cpu-only= --config nvgpu=--nvgpu-enable=True
+
+NVGPU and BMC are disabled unless a configuration enables them.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Tuple
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from load import fixture_args, process_usage  # noqa: E402
+from serving import MAIN, wait_ready  # noqa: E402
+
+
+def start(cmd: List[str], port: int, timeout: float) -> Tuple[float, float, int]:
+    """Seconds until the server answers and until it is ready, its RSS bytes then"""
+    begin = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port, timeout, interval=0.005, path="/api/components")
+        serving = time.perf_counter() - begin
+        wait_ready(port, timeout, interval=0.005)
+        ready = time.perf_counter() - begin
+        _, rss = process_usage(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return serving, ready, rss
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark PowerAll cold start")
+    parser.add_argument(
+        "--config",
+        action="append",
+        help="name=arguments of a configuration, repeatable",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cpus", type=int, default=64, help="CPUs of the synthetic tree")
+    parser.add_argument("--disks", type=int, default=8, help="Disks of the synthetic tree")
+    parser.add_argument("--port", type=int, default=18093)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--main", default=MAIN, help="Entry point to start")
+    args = parser.parse_args()
+
+    configs = args.config or ["cpu-only=", "nvgpu=--nvgpu-enable=True"]
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = fixture_args(Path(tmp), args)
+        print(f"{'config':<16}{'serving ms':>12}{'ready ms':>10}{'rss MB':>10}")
+        for config in configs:
+            name, _, extra = config.partition("=")
+            cmd = [sys.executable, args.main, f"--port={args.port}"] + fixture + extra.split()
+            runs = [start(cmd, args.port, args.startup_timeout) for _ in range(args.runs)]
+            print(
+                f"{name:<16}{statistics.median(r[0] for r in runs) * 1000:>12.1f}"
+                f"{statistics.median(r[1] for r in runs) * 1000:>10.1f}"
+                f"{statistics.median(r[2] for r in runs) / 2**20:>10.1f}"
+            )
@@ -0,0 +1,108 @@
+"""
+Synthetic procfs, sysfs and udev data trees at large node scales
+"""
+
+from pathlib import Path
+import random
+
+# /proc/stat cpu columns: user nice system idle iowait irq softirq steal guest guest_nice
+CPU_COLUMNS = 10
+
+MEMINFO_FIELDS = [
+    "MemTotal", "MemFree", "MemAvailable", "Buffers", "Cached", "SwapCached",
+    "Active", "Inactive", "Active(anon)", "Inactive(anon)", "Active(file)",
+    "Inactive(file)", "Unevictable", "Mlocked", "SwapTotal", "SwapFree", "Zswap",
+    "Zswapped", "Dirty", "Writeback", "AnonPages", "Mapped", "Shmem", "KReclaimable",
+    "Slab", "SReclaimable", "SUnreclaim", "KernelStack", "PageTables",
+    "SecPageTables", "NFS_Unstable", "Bounce", "WritebackTmp", "CommitLimit",
+    "Committed_AS", "VmallocTotal", "VmallocUsed", "VmallocChunk", "Percpu",
+    "HardwareCorrupted", "AnonHugePages", "ShmemHugePages", "ShmemPmdMapped",
+    "FileHugePages", "FilePmdMapped", "CmaTotal", "CmaFree", "Unaccepted",
+]
+
+UDEV_PROPERTIES = [
+    "DEVTYPE=disk", "ID_BUS=nvme", "ID_MODEL=SAMSUNG MZQL23T8HCLS-00A07",
+    "ID_REVISION=GDC5602Q", "ID_SERIAL_SHORT=S64HNE0T{n:06d}", "ID_WWN=eui.36344830{n:08x}",
+    "ID_PATH=pci-0000:{n:02x}:00.0-nvme-1", "ID_PATH_TAG=pci-0000_{n:02x}_00_0-nvme-1",
+    "ID_PART_TABLE_TYPE=gpt", "ID_PART_TABLE_UUID=5f0c3e{n:06x}-0000-4000-8000-000000000000",
+    "ID_FS_TYPE=", "MAJOR=259", "MINOR={n}", "SUBSYSTEM=block", "USEC_INITIALIZED=5123456",
+]
+
+
+def write(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def cpu_tree(root: Path, cpus: int, seed: int = 0):
+    """/proc/stat, /proc/loadavg and cpufreq sysfs of a node with cpus CPUs"""
+    rng = random.Random(seed)
+    lines = []
+    rows = [[rng.randrange(10**4, 10**8) for _ in range(CPU_COLUMNS)] for _ in range(cpus)]
+    total = [sum(col) for col in zip(*rows)]
+    lines.append("cpu  " + " ".join(map(str, total)))
+    lines += [f"cpu{c} " + " ".join(map(str, row)) for c, row in enumerate(rows)]
+    lines += [
+        "intr 123456789 " + " 0" * 512,
+        "ctxt 987654321",
+        "btime 1700000000",
+        "processes 1234567",
+        "procs_running 3",
+        "procs_blocked 0",
+        "softirq 12345678 0 1 2 3 4 5 6 7 8 9",
+    ]
+    write(root / "proc" / "stat", "\n".join(lines) + "\n")
+    write(root / "proc" / "loadavg", "0.52 0.58 0.59 1/467 12345\n")
+    freqs = [800000, 1200000, 1800000, 2400000, 3000000]
+    for c in range(cpus):
+        d = root / "sys" / "devices" / "system" / "cpu" / f"cpu{c}" / "cpufreq"
+        write(d / "scaling_driver", "acpi-cpufreq\n")
+        write(d / "scaling_available_governors", "conservative ondemand userspace powersave performance schedutil\n")
+        write(d / "scaling_available_frequencies", " ".join(map(str, freqs)) + "\n")
+        write(d / "scaling_cur_freq", f"{rng.choice(freqs)}\n")
+        write(d / "scaling_min_freq", f"{freqs[0]}\n")
+        write(d / "scaling_max_freq", f"{freqs[-1]}\n")
+        write(d / "scaling_governor", "performance\n")
+
+
+def meminfo_tree(root: Path, seed: int = 0):
+    """/proc/meminfo with the fields of a recent kernel"""
+    rng = random.Random(seed)
+    lines = [f"{f + ':':<16}{rng.randrange(0, 10**9):>12} kB" for f in MEMINFO_FIELDS]
+    lines += [
+        "HugePages_Total:       0",
+        "HugePages_Free:        0",
+        "HugePages_Rsvd:        0",
+        "HugePages_Surp:        0",
+        "Hugepagesize:       2048 kB",
+        "Hugetlb:               0 kB",
+        "DirectMap4k:      123456 kB",
+        "DirectMap2M:     1234567 kB",
+        "DirectMap1G:    12345678 kB",
+    ]
+    write(root / "proc" / "meminfo", "\n".join(lines) + "\n")
+
+
+def disk_tree(root: Path, disks: int, partitions: int = 2, seed: int = 0):
+    """/proc/diskstats and udev data of disks NVMe namespaces
+
+    Every disk also gets partitions, which DISK ignores.
+    """
+    rng = random.Random(seed)
+    lines = []
+    minor = 0
+    for n in range(disks):
+        for p in range(partitions + 1):
+            name = f"nvme{n}n1" if p == 0 else f"nvme{n}n1p{p}"
+            stats = " ".join(str(rng.randrange(0, 10**9)) for _ in range(17))
+            lines.append(f" 259 {minor:7d} {name} {stats}")
+            if p == 0:
+                props = "\n".join(
+                    "E:" + prop.format(n=n) for prop in UDEV_PROPERTIES
+                )
+                write(
+                    root / "run" / "udev" / "data" / f"b259:{minor}",
+                    f"S:disk/by-id/nvme-eui.{n:016x}\nW:{n}\nI:5123456\n{props}\nG:systemd\n",
+                )
+            minor += 1
+    write(root / "proc" / "diskstats", "\n".join(lines) + "\n")
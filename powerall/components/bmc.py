@@ -1,8 +1,12 @@
 from opts.logopt import *
 from opts.argsopt import *
-from prometheus_client import Gauge, Info, generate_latest
-from redfish import redfish_client
-from .component import Component
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily
+from .capture import capture
+from .component import Component, Signal
+from .exposition import Exposition
+from .volatility import Cadence, FAST, SLOW
+from typing import Dict
 import threading
 import re
 
@@ -83,61 +87,29 @@ class BMC(Component):
         self._enabled = get_arg(f"{self._metric}_enable")
         self._config = get_arg(f"{self._metric}_config")
         self._lock = threading.RLock()
+        self._families = []
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._exposition = Exposition()
+        # threshold sensors come with their readings, discrete sensors only
+        # with an Enable/Disable state that rarely changes
+        self._cadence = Cadence(
+            self._metric,
+            {
+                "thermal": FAST,
+                "power": FAST,
+                "threshold_sensors": FAST,
+                "discrete_sensors": SLOW,
+            },
+        )
         if self._enabled:
-            # manufacturer, model
-            self._machine_info = Info(
-                f"{self._metric}_machine_info",
-                "Machine info in BMC",
-            )
-            # state, health, controlmode, speedratio
-            self._fan_info = Info(
-                f"{self._metric}_fan_info",
-                "Fan info in BMC",
-                ["index", "name"],
-            )
-            # reading
-            self._fan_read = Gauge(
-                f"{self._metric}_fan_read",
-                "Fan read value in BMC",
-                ["index", "name", "readingunits"],
-            )
-            # cpupower, mempower, fanpower, totalpower
-            self._power_info = Gauge(
-                f"{self._metric}_power_info",
-                "Power info in BMC",
-                ["component"],
-            )
-            # poweroutputpower, powerinputpower,
-            self._powersupply_power = Gauge(
-                f"{self._metric}_powersupply_power",
-                "PowerSupply info in BMC",
-                ["index", "mode"],
-            )
-            # status
-            self._threshold_sensors = Info(
-                f"{self._metric}_threshold_sensors",
-                "Threshold sensors info in BMC.",
-                ["name", "unit"],
-            )
-            # readingvalue
-            self._threshold_sensors_values = Gauge(
-                f"{self._metric}_threshold_sensors_values",
-                "Threshold sensors data in BMC. None value will set to -1",
-                ["name", "unit"],
-            )
-            # status
-            self._discrete_sensors = Gauge(
-                f"{self._metric}_discrete_sensors",
-                "Discrete sensors data in BMC. 0 is Disable, 1 is Enable",
-                ["name"],
-            )
             if self._config == "Inspur-NF5280M6":
                 host, user, passwd = (
                     get_arg(f"{self._metric}_host"),
                     get_arg(f"{self._metric}_user"),
                     get_arg(f"{self._metric}_passwd"),
                 )
-                self._redfish_obj = redfish_client(
+                self._redfish_obj = capture.redfish_client(
                     base_url=f"https://{host}", username=f"{user}", password=f"{passwd}"
                 )
 
@@ -151,8 +123,11 @@ class BMC(Component):
                 # For machine_info
                 response = self._redfish_obj.get("/redfish/v1/Chassis/1")
                 res = response.dict
-                self._machine_info.info(
-                    {"manufacturer": res["Manufacturer"], "model": res["Model"]}
+                # manufacturer, model
+                self._machine_info = InfoMetricFamily(
+                    f"{self._metric}_machine_info",
+                    "Machine info in BMC",
+                    value={"manufacturer": res["Manufacturer"], "model": res["Model"]},
                 )
 
                 def exit_func():
@@ -308,12 +283,51 @@ class BMC(Component):
                     return None
         return ret
 
-    def inspur_nf5280m6_update(self):
-        final_output = bytes("", "utf-8")
+    def inspur_nf5280m6_update(self) -> list:
+        # state, health, controlmode, speedratio
+        fan_info_f = InfoMetricFamily(
+            f"{self._metric}_fan_info", "Fan info in BMC", labels=["index", "name"]
+        )
+        # reading
+        fan_read_f = GaugeMetricFamily(
+            f"{self._metric}_fan_read",
+            "Fan read value in BMC",
+            labels=["index", "name", "readingunits"],
+        )
+        # cpupower, mempower, fanpower, totalpower
+        power_info_f = GaugeMetricFamily(
+            f"{self._metric}_power_info", "Power info in BMC", labels=["component"]
+        )
+        # poweroutputpower, powerinputpower,
+        powersupply_power_f = GaugeMetricFamily(
+            f"{self._metric}_powersupply_power",
+            "PowerSupply info in BMC",
+            labels=["index", "mode"],
+        )
+        # status
+        threshold_sensors_f = InfoMetricFamily(
+            f"{self._metric}_threshold_sensors",
+            "Threshold sensors info in BMC.",
+            labels=["name", "unit"],
+        )
+        # readingvalue
+        threshold_sensors_values_f = GaugeMetricFamily(
+            f"{self._metric}_threshold_sensors_values",
+            "Threshold sensors data in BMC. None value will set to -1",
+            labels=["name", "unit"],
+        )
+        # status
+        discrete_sensors_f = GaugeMetricFamily(
+            f"{self._metric}_discrete_sensors",
+            "Discrete sensors data in BMC. 0 is Disable, 1 is Enable",
+            labels=["name"],
+        )
 
         # for fan info
-        response = self._redfish_obj.get("/redfish/v1/Chassis/1/Thermal")
-        res = response.dict
+        res = self._cadence.get(
+            "thermal",
+            lambda: self._redfish_obj.get("/redfish/v1/Chassis/1/Thermal").dict,
+        )
         for f, fan in enumerate(res["Fans"]):
             name = fan["Name"]
             status = fan["Status"]
@@ -325,81 +339,100 @@ class BMC(Component):
             oem_public = oem["Public"]
             controlmode = oem_public["ControlMode"]
             speedratio = oem_public["SpeedRatio"]
-            self._fan_info.labels(index=str(f), name=name).info(
+            fan_info_f.add_metric(
+                [str(f), name],
                 {
                     "state": state,
                     "health": health,
                     "controlmode": controlmode,
                     "speedratio": str(speedratio),
-                }
+                },
             )
-            self._fan_read.labels(
-                index=str(f), name=name, readingunits=readingunits
-            ).set(reading)
+            fan_read_f.add_metric([str(f), name, readingunits], reading)
         # for power and powersupply info
-        response = self._redfish_obj.get("/redfish/v1/Chassis/1/Power")
-        res = response.dict
+        res = self._cadence.get(
+            "power", lambda: self._redfish_obj.get("/redfish/v1/Chassis/1/Power").dict
+        )
         for pl, powersupply in enumerate(res["PowerSupplies"]):
             poutw = powersupply["PowerOutputWatts"]
             pinw = powersupply["PowerInputWatts"]
-            self._powersupply_power.labels(index=pl, mode="input").set(pinw)
-            self._powersupply_power.labels(index=pl, mode="output").set(poutw)
+            powersupply_power_f.add_metric([str(pl), "input"], pinw)
+            powersupply_power_f.add_metric([str(pl), "output"], poutw)
         oem = res["Oem"]
         oem_public = oem["Public"]
         cpupower = oem_public["CurrentCPUPowerWatts"]
         mempower = oem_public["CurrentMemoryPowerWatts"]
         fanpower = oem_public["CurrentFANPowerWatts"]
         totalpower = oem_public["TotalPower"]
-        self._power_info.labels(component="cpu").set(cpupower)
-        self._power_info.labels(component="mem").set(mempower)
-        self._power_info.labels(component="fan").set(fanpower)
-        self._power_info.labels(component="total").set(totalpower)
+        power_info_f.add_metric(["cpu"], cpupower)
+        power_info_f.add_metric(["mem"], mempower)
+        power_info_f.add_metric(["fan"], fanpower)
+        power_info_f.add_metric(["total"], totalpower)
 
         # for sensors
-        response = self._redfish_obj.get("/redfish/v1/Chassis/1/ThresholdSensors")
-        res = response.dict
+        res = self._cadence.get(
+            "threshold_sensors",
+            lambda: self._redfish_obj.get(
+                "/redfish/v1/Chassis/1/ThresholdSensors"
+            ).dict,
+        )
         for sensor in res["Sensors"]:
             name = sensor["Name"]
             status = sensor["Status"]
             unit = sensor["unit"]
             readingvalue = sensor["ReadingValue"]
             if readingvalue is None:
-                readingvalue = "-1"
-            else:
-                readingvalue = str(readingvalue)
-            self._threshold_sensors.labels(name=name, unit=unit).info(
-                {"status": status}
-            )
-            self._threshold_sensors_values.labels(name=name, unit=unit).set(
-                readingvalue
-            )
+                readingvalue = -1.0
+            threshold_sensors_f.add_metric([name, unit], {"status": status})
+            threshold_sensors_values_f.add_metric([name, unit], float(readingvalue))
 
-        response = self._redfish_obj.get("/redfish/v1/Chassis/1/DiscreteSensors")
-        res = response.dict
+        res = self._cadence.get(
+            "discrete_sensors",
+            lambda: self._redfish_obj.get("/redfish/v1/Chassis/1/DiscreteSensors").dict,
+        )
         for sensor in res["Sensors"]:
             name = sensor["Name"]
             status = sensor["Status"]
-            self._discrete_sensors.labels(name=name).set(1 if status == "Enable" else 0)
-
-        final_output += (
-            generate_latest(self._machine_info)
-            + generate_latest(self._fan_info)
-            + generate_latest(self._fan_read)
-            + generate_latest(self._power_info)
-            + generate_latest(self._powersupply_power)
-            + generate_latest(self._threshold_sensors)
-            + generate_latest(self._threshold_sensors_values)
-            + generate_latest(self._discrete_sensors)
-        )
-        return final_output
+            discrete_sensors_f.add_metric([name], 1 if status == "Enable" else 0)
+
+        return [
+            self._machine_info,
+            fan_info_f,
+            fan_read_f,
+            power_info_f,
+            powersupply_power_f,
+            threshold_sensors_f,
+            threshold_sensors_values_f,
+            discrete_sensors_f,
+        ]
+
+    def collect(self):
+        """Families built by the last update, see CollectorRegistry"""
+        return self._families
 
     @enabled
     @locked
     def update(self) -> bytes:
-        final_output = bytes("", "utf-8")
+        families = []
         if self._config == "Inspur-NF5280M6":
-            final_output += self.inspur_nf5280m6_update()
-        return final_output
+            families = self.inspur_nf5280m6_update()
+        self._families = families
+        return self._exposition.render(self._registry)
+
+    def signals(self) -> Dict[str, Signal]:
+        if not self._enabled or self._config != "Inspur-NF5280M6":
+            return {}
+        return {
+            "power": Signal(
+                "component", "Total power in BMC (watt).", self.sample_power, watts=1.0
+            )
+        }
+
+    @locked
+    def sample_power(self) -> Dict[str, float]:
+        """Total power, one Redfish session is shared with update"""
+        res = self._redfish_obj.get("/redfish/v1/Chassis/1/Power").dict
+        return {"total": float(res["Oem"]["Public"]["TotalPower"])}
 
     @enabled
     @locked
@@ -407,6 +440,7 @@ class BMC(Component):
         result = {}
         if self._config == "Inspur-NF5280M6":
             result = self.inspur_nf5280m6_control(argl)
+            self._cadence.invalidate("thermal")
         else:
             logger.warning("No Server config choose")
             result = {"error": "No Server config choose"}
@@ -0,0 +1,305 @@
+"""
+Record and replay of the raw inputs components read
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+
+class Handle:
+    """Device handle handed out while replaying"""
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+
+
+class Capture:
+    """Record every file read, NVML call and Redfish GET, or replay them
+
+    A capture is gzip compressed JSON lines, one input per line:
+    {"k": kind, "key": ..., "d": seconds the read took, "v": value}. "v"
+    is left out when the value did not change since the last read of the
+    same key. Errors are stored in "e" instead. While replaying, the
+    reads of a key are returned in order and start over at the end.
+
+    Recording flushes at least once a second, so a capture cut short by a
+    kill is still readable up to the last flush.
+    """
+
+    def __init__(self) -> None:
+        self._name = "capture"
+        self._mode = "off"
+        self._lock = threading.Lock()
+        # record: key -> last value written, replay: key -> [entries, position]
+        self._last: Dict[Tuple[str, str], Any] = {}
+        self._entries: Dict[Tuple[str, str], list] = {}
+        self._handles: Dict[int, str] = {}
+        self._handle_refs: List[Any] = []
+        self._file = None
+        self._flushed = 0.0
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-mode",
+            type=str,
+            default="off",
+            choices=["off", "record", "replay"],
+            help="Record raw hardware inputs to the capture file, or replay them instead of reading hardware",
+        )
+        add_option(
+            f"--{self._name}-file",
+            type=str,
+            default="powerall-capture.jsonl.gz",
+            help="Capture file to record to or replay from",
+        )
+        add_option(
+            f"--{self._name}-timing",
+            type=str,
+            default="fast",
+            choices=["fast", "original"],
+            help="Replay at full speed or take as long as each recorded read took",
+        )
+        return self
+
+    def setup(self):
+        self._mode = get_arg(f"{self._name}_mode")
+        self._timing = get_arg(f"{self._name}_timing")
+        path = get_arg(f"{self._name}_file")
+        if self._mode == "record":
+            self._file = gzip.open(path, "ab")
+            logger.warning(f"Record raw inputs to {path}")
+        elif self._mode == "replay":
+            self.load(path)
+            logger.warning(f"Replay {len(self._entries)} raw inputs from {path}")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._file is not None:
+            with self._lock:
+                self._file.close()
+                self._file = None
+        self._flushed = 0.0
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def load(self, path: str):
+        last: Dict[Tuple[str, str], Any] = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    r = json.loads(line)
+                    key = (r["k"], r["key"])
+                    if "v" in r:
+                        last[key] = r["v"]
+                    entry = (r.get("e"), last.get(key), r.get("d", 0.0))
+                    self._entries.setdefault(key, [[], 0])[0].append(entry)
+            except (EOFError, json.JSONDecodeError):
+                logger.warning(f"Capture {path} was cut short, replay what was flushed")
+
+    def write(self, kind: str, key: str, seconds: float, value: Any = None, error: Any = None):
+        with self._lock:
+            if self._file is None:
+                return
+            r = {"k": kind, "key": key, "d": round(seconds, 6)}
+            if error is not None:
+                r["e"] = error
+            elif self._last.get((kind, key), r) != value:
+                r["v"] = value
+                self._last[(kind, key)] = value
+            self._file.write(json.dumps(r, separators=(",", ":")).encode() + b"\n")
+            now = time.monotonic()
+            if now - self._flushed >= 1.0:
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                self._flushed = now
+
+    def next(self, kind: str, key: str) -> Optional[tuple]:
+        """Next recorded (error, value, seconds) of a key, None if never recorded"""
+        with self._lock:
+            recorded = self._entries.get((kind, key))
+            if recorded is None:
+                return None
+            entries, pos = recorded
+            recorded[1] = (pos + 1) % len(entries)
+            entry = entries[pos]
+        if self._timing == "original":
+            time.sleep(entry[2])
+        return entry
+
+    def read_text(self, path: str) -> str:
+        """Contents of a procfs, sysfs or udev data file"""
+        if self._mode == "replay":
+            entry = self.next("file", path)
+            if entry is None or entry[0] is not None:
+                raise FileNotFoundError(path)
+            return entry[1]
+        start = time.perf_counter()
+        try:
+            with open(path, "r") as f:
+                text = f.read()
+        except OSError:
+            if self._mode == "record":
+                self.write("file", path, time.perf_counter() - start, error="missing")
+            raise
+        if self._mode == "record":
+            self.write("file", path, time.perf_counter() - start, text)
+        return text
+
+    def path_exists(self, path: str) -> bool:
+        if self._mode == "replay":
+            entry = self.next("exists", path)
+            return entry is not None and bool(entry[1])
+        exists = os.path.exists(path)
+        if self._mode == "record":
+            self.write("exists", path, 0.0, exists)
+        return exists
+
+    def nvml_call(self, name: str, *args):
+        """Call a pynvml function by name"""
+        # imported on first use, so a disabled NVGPU never loads pynvml
+        import pynvml
+
+        fn = getattr(pynvml, name)
+        if self._mode == "off":
+            return fn(*args)
+        key = self.nvml_key(name, args)
+        if self._mode == "replay":
+            entry = self.next("nvml", key)
+            if entry is None:
+                raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+            if entry[0] is not None:
+                raise pynvml.NVMLError(entry[0])
+            return decode(entry[1])
+        start = time.perf_counter()
+        try:
+            ret = fn(*args)
+        except pynvml.NVMLError as e:
+            self.write("nvml", key, time.perf_counter() - start, error=e.value)
+            raise
+        if name.startswith("nvmlDeviceGetHandleBy"):
+            with self._lock:
+                self._handles[id(ret)] = f"gpu{args[0]}"
+                self._handle_refs.append(ret)
+            value = {"h": f"gpu{args[0]}"}
+        else:
+            value = encode(ret)
+        self.write("nvml", key, time.perf_counter() - start, value)
+        return ret
+
+    def nvml_key(self, name: str, args: tuple) -> str:
+        # device functions take the handle first, key it by its index
+        parts = [repr(a) for a in args]
+        if args and name.startswith("nvmlDevice") and not name.startswith("nvmlDeviceGetHandleBy"):
+            handle = args[0]
+            if isinstance(handle, Handle):
+                parts[0] = handle.token
+            else:
+                parts[0] = self._handles.get(id(handle), parts[0])
+        return f"{name}({','.join(parts)})"
+
+    def redfish_client(self, **kwargs):
+        """Redfish client, recording or replaying its GETs"""
+        if self._mode == "replay":
+            return ReplayRedfish(self)
+        import redfish
+
+        client = redfish.redfish_client(**kwargs)
+        if self._mode == "record":
+            return RecordRedfish(self, client)
+        return client
+
+
+class RecordRedfish:
+    def __init__(self, capture: Capture, client) -> None:
+        self._capture = capture
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get(self, path: str, *args, **kwargs):
+        start = time.perf_counter()
+        response = self._client.get(path, *args, **kwargs)
+        self._capture.write(
+            "redfish",
+            path,
+            time.perf_counter() - start,
+            {"status": getattr(response, "status", None), "dict": response.dict},
+        )
+        return response
+
+
+class ReplayRedfish:
+    def __init__(self, capture: Capture) -> None:
+        self._capture = capture
+
+    def login(self, *args, **kwargs):
+        pass
+
+    def logout(self):
+        pass
+
+    def get(self, path: str, *args, **kwargs):
+        entry = self._capture.next("redfish", path)
+        if entry is None:
+            raise KeyError(f"Redfish GET {path} is not in the capture")
+        return SimpleNamespace(status=entry[1]["status"], dict=entry[1]["dict"])
+
+    def patch(self, path: str, *args, **kwargs):
+        raise RuntimeError(f"Redfish PATCH {path} is not available while replaying")
+
+
+def encode(value):
+    """JSON form of an NVML result"""
+    if isinstance(value, bytes):
+        return {"b": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return {"t": [encode(v) for v in value]}
+    fields = getattr(value, "_fields_", None) or getattr(value, "_fields", None)
+    if fields is not None:
+        names = [f[0] if isinstance(f, tuple) else f for f in fields]
+        return {"s": {n: encode(getattr(value, n)) for n in names}}
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if "b" in value:
+            return base64.b64decode(value["b"])
+        if "t" in value:
+            return tuple(decode(v) for v in value["t"])
+        if "s" in value:
+            return SimpleNamespace(**{n: decode(v) for n, v in value["s"].items()})
+        if "h" in value:
+            return Handle(value["h"])
+    return value
+
+
+capture = Capture()
+
+
+def read_text(path: str) -> str:
+    return capture.read_text(path)
+
+
+def path_exists(path: str) -> bool:
+    return capture.path_exists(path)
+
+
+class NVML:
+    """pynvml functions going through the capture, e.g. nvml.nvmlDeviceGetCount()"""
+
+    def __getattr__(self, name: str):
+        return lambda *args: capture.nvml_call(name, *args)
+
+
+nvml = NVML()
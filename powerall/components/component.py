@@ -1,4 +1,28 @@
 from abc import ABCMeta, abstractmethod
+from typing import Callable, Dict, Optional
+
+
+class Signal:
+    """Fast value of a component that can be sampled between scrapes
+
+    Args:
+        label (str): label name of the series read returns
+        help (str): metric help
+        read (Callable[[], Dict[str, float]]): current value of each series, by label value
+        watts (Optional[float]): watts of one unit read, for power signals
+    """
+
+    def __init__(
+        self,
+        label: str,
+        help: str,
+        read: Callable[[], Dict[str, float]],
+        watts: Optional[float] = None,
+    ) -> None:
+        self.label = label
+        self.help = help
+        self.read = read
+        self.watts = watts
 
 
 class Component:
@@ -33,3 +57,19 @@ class Component:
     @abstractmethod
     def control(self, argl):
         pass
+
+    def signals(self) -> Dict[str, Signal]:
+        """Signals of the component by name, read after setup"""
+        return {}
+
+    def energy(self) -> Dict[str, float]:
+        """Hardware energy counters in joules by label value, for the series that have one"""
+        return {}
+
+    def states(self) -> Dict[str, float]:
+        """Seconds spent in each state so far, summed over the devices of the component"""
+        return {}
+
+    def collect(self) -> list:
+        """Metric families built by the last update"""
+        return []
@@ -1,17 +1,55 @@
 from opts.logopt import *
 from opts.argsopt import *
-from prometheus_client import Gauge, Info, generate_latest
-from .component import Component
-import os
+from opts.pathopt import *
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily
+from .capture import path_exists, read_text
+from .component import Component, Signal
+from .exposition import Exposition
+from .volatility import Cadence, FAST, SLOW
+from typing import Dict, List, Tuple
 import re
 import threading
-import psutil
 
 cpus_list = re.compile(r"[0-9]+-[0-9]+")
-cpufreq_sysfsp = "/sys/devices/system/cpu/"
-cpufreq_policys = f"{cpufreq_sysfsp}/cpufreq/"
+cpu_line = re.compile(r"cpu[0-9]+$")
 # https://man7.org/linux/man-pages/man5/proc.5.html
 user_hz = 100.0
+# first columns of each cpu line in /proc/stat
+cpu_modes = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+
+
+def cpufreq_path(cpu, name: str) -> str:
+    return sysfs_path("devices/system/cpu", f"cpu{cpu}", "cpufreq", name)
+
+
+def rapl_path(package: int, name: str) -> str:
+    return sysfs_path("class/powercap", f"intel-rapl:{package}", name)
+
+
+def read_cputimes() -> Dict[str, List[str]]:
+    """Columns of each line of /proc/stat, by its first column"""
+    cputimes = {}
+    for line in read_text(procfs_path("stat")).splitlines():
+        line = line.split()
+        if line:
+            cputimes[line[0]] = line[1:]
+    return cputimes
+
+
+def cpu_ids(cputimes: Dict[str, List[str]]) -> List[int]:
+    """Ids of the online CPUs, offline ones have no line in /proc/stat"""
+    return sorted(int(k[3:]) for k in cputimes.keys() if cpu_line.match(k))
+
+
+def busy_total(cputime: List[str]) -> Tuple[float, float]:
+    """Busy and total ticks of a /proc/stat cpu line, like psutil
+
+    guest and guest_nice are already part of user and nice, iowait is idle.
+    """
+    times = [float(x) for x in cputime[:10]]
+    total = sum(times) - sum(times[8:10])
+    return total - times[3] - (times[4] if len(times) > 4 else 0.0), total
 
 
 class CPU(Component):
@@ -62,41 +100,66 @@ class CPU(Component):
     def setup(self):
         self._lock = threading.RLock()
         self._enabled = get_arg(f"{self._metric}_enable")
-        self._cpu_nums = os.cpu_count()
-        self._freqs = Gauge(
-            f"{self._metric}_freqs", "CPU Freqs in MHz", ["cpu", "mode"]
-        )
-        self._utils = Gauge(f"{self._metric}_utils", "CPU Utils in percentage", ["cpu"])
-        self._scaling_govs = Info(
-            f"{self._metric}_scaling_govs", "Current Scaling Governors", ["cpu"]
-        )
-        self._cpu_seconds_total = Gauge(
-            f"{self._metric}_seconds_total",
-            "Seconds the CPUs spent in each mode.",
-            ["cpu", "mode"],
+        self._cadence = Cadence(
+            self._metric,
+            {
+                "cputimes": FAST,
+                "loadavg": FAST,
+                "cur_freq": FAST,
+                "limits": SLOW,
+                "governor": SLOW,
+            },
         )
-        self._loadavg = Gauge(f"{self._metric}_loadavg", "load average", ["m"])
+        self._cputimes = read_cputimes()
+        self._cpu_ids = cpu_ids(self._cputimes)
+        self._cpu_nums = len(self._cpu_ids)
+        self._utils: Dict[int, float] = {}
+        self._sampled = busy_total(self._cputimes["cpu"])
+        self._families = []
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._exposition = Exposition()
 
         # get CPUFreq scaling drivers, available scaling governors and available scaling frequencies
-        # use sysfs provided by CPUFreq module
-        with open(f"{cpufreq_sysfsp}/cpu0/cpufreq/scaling_driver", "r") as f:
-            self._scaling_driver = f.readline().strip()
-        with open(
-            f"{cpufreq_sysfsp}/cpu0/cpufreq/scaling_available_governors", "r"
-        ) as f:
-            self._scaling_available_governors = f.readline().strip().split()
-        ava_freqs = f"{cpufreq_sysfsp}/cpu0/cpufreq/scaling_available_frequencies"
-        if os.path.exists(ava_freqs):
-            with open(ava_freqs, "r") as f:
-                self._scaling_available_frequencies = f.readline().strip().split()
-        else:
-            self._scaling_available_frequencies = []
-
-        # if exists, psutil will divide current by 1000 default
+        # use sysfs provided by CPUFreq module, without it nothing can be controlled
+        first = self._cpu_ids[0] if self._cpu_ids else 0
+        self._cpufreq = path_exists(cpufreq_path(first, "scaling_cur_freq"))
+        self._scaling_driver = ""
+        self._scaling_available_governors = []
+        self._scaling_available_frequencies = []
+        if self._cpufreq:
+            self._scaling_driver = read_text(
+                cpufreq_path(first, "scaling_driver")
+            ).strip()
+            self._scaling_available_governors = read_text(
+                cpufreq_path(first, "scaling_available_governors")
+            ).split()
+            ava_freqs = cpufreq_path(first, "scaling_available_frequencies")
+            if path_exists(ava_freqs):
+                self._scaling_available_frequencies = read_text(ava_freqs).split()
+
+        # package energy counters of powercap, in microjoules, they wrap at
+        # max_energy_range_uj, every few minutes on a busy server
+        self._rapl_ranges: Dict[int, int] = {}
+        self._rapl_last: Dict[int, int] = {}
+        self._rapl_joules: Dict[int, float] = {}
+        package = 0
+        while path_exists(rapl_path(package, "energy_uj")):
+            try:
+                self._rapl_ranges[package] = int(
+                    read_text(rapl_path(package, "max_energy_range_uj"))
+                )
+                # only root can read energy_uj on recent kernels
+                int(read_text(rapl_path(package, "energy_uj")))
+            except (OSError, ValueError) as e:
+                logger.warning(f"unable to read RAPL energy of package {package}: {e}")
+                self._rapl_ranges.clear()
+                break
+            package += 1
+
+        # current frequency is exported in kHz when cpufreq provides it
         self._cpu_freq_curr_div = 1.0
-        if os.path.exists("/sys/devices/system/cpu/cpufreq/policy0") or os.path.exists(
-            "/sys/devices/system/cpu/cpu0/cpufreq"
-        ):
+        if self._cpufreq:
             self._cpu_freq_curr_div = 1000.0
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -134,10 +197,8 @@ class CPU(Component):
                     result["error"] = f"no chosen governors {gov}"
                     return result
                 if cpus == "all":
-                    for i in range(self._cpu_nums):
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{i}/cpufreq/scaling_governor", "wb"
-                        ) as f:
+                    for i in self._cpu_ids:
+                        with open(cpufreq_path(i, "scaling_governor"), "wb") as f:
                             f.write(gov.encode())
                 else:
                     cpulist = self.parse_cpus(cpus)
@@ -147,9 +208,7 @@ class CPU(Component):
                         return result
                     cpulist = list(set(cpulist))
                     for c in cpulist:
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{c}/cpufreq/scaling_governor", "wb"
-                        ) as f:
+                        with open(cpufreq_path(c, "scaling_governor"), "wb") as f:
                             f.write(gov.encode())
             elif arg == "change-freq":
                 try:
@@ -166,14 +225,10 @@ class CPU(Component):
                     result["error"] = f"no chosen freq {freq} or gov userspace"
                     return result
                 if cpus == "all":
-                    for i in range(self._cpu_nums):
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{i}/cpufreq/scaling_governors", "wb"
-                        ) as f:
+                    for i in self._cpu_ids:
+                        with open(cpufreq_path(i, "scaling_governors"), "wb") as f:
                             f.write("userspace".encode())
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{i}/cpufreq/scaling_setspeed", "wb"
-                        ) as f:
+                        with open(cpufreq_path(i, "scaling_setspeed"), "wb") as f:
                             f.write(freq.encode())
                 else:
                     cpulist = self.parse_cpus(cpus)
@@ -183,13 +238,9 @@ class CPU(Component):
                         return result
                     cpulist = list(set(cpulist))
                     for c in cpulist:
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{c}/cpufreq/scaling_governors", "wb"
-                        ) as f:
+                        with open(cpufreq_path(c, "scaling_governors"), "wb") as f:
                             f.write("userspace".encode())
-                        with open(
-                            f"{cpufreq_sysfsp}/cpu{c}/cpufreq/scaling_setspeed", "wb"
-                        ) as f:
+                        with open(cpufreq_path(c, "scaling_setspeed"), "wb") as f:
                             f.write(freq.encode())
             else:
                 result["error"] = "unknown CPU control commands"
@@ -226,67 +277,161 @@ class CPU(Component):
                     return None
         return ret
 
+    def read_freqs(self, ids: List[int]) -> Dict[int, Tuple[float, float, float]]:
+        """Current, min and max MHz of each online CPU, like psutil.cpu_freq
+
+        Falls back to /proc/cpuinfo without min and max if there is no cpufreq.
+        Min and max are limits set by control, they refresh on the slow cadence.
+        """
+        freqs = {}
+        if self._cpufreq:
+            for c in ids:
+                cur = self._cadence.get(
+                    "cur_freq",
+                    lambda: int(read_text(cpufreq_path(c, "scaling_cur_freq"))) / 1000.0,
+                    c,
+                )
+                low, high = self._cadence.get("limits", lambda: self.read_limits(c), c)
+                freqs[c] = (cur, low, high)
+            return freqs
+        # one block per online CPU, its processor line comes first
+        c = None
+        for line in read_text(procfs_path("cpuinfo")).splitlines():
+            key, _, value = line.partition(":")
+            key = key.strip().lower()
+            if key == "processor":
+                c = int(value)
+            elif key == "cpu mhz" and c is not None:
+                freqs[c] = (float(value), 0.0, 0.0)
+        return freqs
+
+    def read_limits(self, c: int) -> Tuple[float, float]:
+        """Min and max MHz of a CPU"""
+        return tuple(
+            int(read_text(cpufreq_path(c, name))) / 1000.0
+            for name in ("scaling_min_freq", "scaling_max_freq")
+        )
+
+    def collect(self):
+        """Families built by the last update, see CollectorRegistry"""
+        return self._families
+
     @enabled
     @locked
     def update(self) -> bytes:
-        output = bytes("", "utf-8")
-        freqs = psutil.cpu_freq(percpu=True)
-        utils = psutil.cpu_percent(percpu=True)
-        cputimes = {}
-        with open(f"/proc/stat", "r") as f:
-            for line in f.readlines():
-                line = line.strip().split(sep=" ", maxsplit=1)
-                cputimes[line[0]] = line[1].strip()
+        cputimes = self._cadence.get("cputimes", read_cputimes)
+        # CPUs may go offline or come back between updates
+        ids = cpu_ids(cputimes)
+        freqs = self.read_freqs(ids)
+        # utilization only moves when /proc/stat was read again
+        fresh = cputimes is not self._cputimes
+        freqs_f = GaugeMetricFamily(
+            f"{self._metric}_freqs", "CPU Freqs in MHz", labels=["cpu", "mode"]
+        )
+        utils_f = GaugeMetricFamily(
+            f"{self._metric}_utils", "CPU Utils in percentage", labels=["cpu"]
+        )
+        scaling_govs_f = InfoMetricFamily(
+            f"{self._metric}_scaling_govs", "Current Scaling Governors", labels=["cpu"]
+        )
+        cpu_seconds_total_f = GaugeMetricFamily(
+            f"{self._metric}_seconds_total",
+            "Seconds the CPUs spent in each mode.",
+            labels=["cpu", "mode"],
+        )
+        loadavg_f = GaugeMetricFamily(
+            f"{self._metric}_loadavg", "load average", labels=["m"]
+        )
         # use /proc/loadavg to get load average
-        with open("/proc/loadavg", "r") as f:
-            avgs = f.readline().strip().split(sep=" ")
-            self._loadavg.labels(m="1").set(avgs[0])
-            self._loadavg.labels(m="5").set(avgs[1])
-            self._loadavg.labels(m="15").set(avgs[2])
-        for c in range(self._cpu_nums):
-            self._freqs.labels(cpu=c, mode="current").set(
-                freqs[c][0] * self._cpu_freq_curr_div
-            )
-            self._freqs.labels(cpu=c, mode="min").set(freqs[c][1])
-            self._freqs.labels(cpu=c, mode="max").set(freqs[c][2])
-            self._utils.labels(cpu=c).set(utils[c])
-            with open(f"{cpufreq_sysfsp}/cpu{c}/cpufreq/scaling_governor", "r") as f:
-                scaling_driver = f.readline().strip()
-                self._scaling_govs.labels(cpu=c).info({"governors": scaling_driver})
-            # parse cpu time spent on each mode by /proc/stat
-            cputime = cputimes[f"cpu{c}"].split(sep=" ")
-            self._cpu_seconds_total.labels(cpu=c, mode="user").set(
-                float(cputime[0]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="nice").set(
-                float(cputime[1]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="system").set(
-                float(cputime[2]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="idle").set(
-                float(cputime[3]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="iowait").set(
-                float(cputime[4]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="irq").set(
-                float(cputime[5]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="softirq").set(
-                float(cputime[6]) / user_hz
-            )
-            self._cpu_seconds_total.labels(cpu=c, mode="steal").set(
-                float(cputime[7]) / user_hz
-            )
-        output += (
-            generate_latest(self._freqs)
-            + generate_latest(self._utils)
-            + generate_latest(self._scaling_govs)
-            + generate_latest(self._cpu_seconds_total)
-            + generate_latest(self._loadavg)
+        avgs = self._cadence.get(
+            "loadavg", lambda: read_text(procfs_path("loadavg")).strip().split(sep=" ")
         )
-        return output
+        loadavg_f.add_metric(["1"], float(avgs[0]))
+        loadavg_f.add_metric(["5"], float(avgs[1]))
+        loadavg_f.add_metric(["15"], float(avgs[2]))
+        for c in ids:
+            cpu = str(c)
+            if c in freqs:
+                cur, low, high = freqs[c]
+                freqs_f.add_metric([cpu, "current"], cur * self._cpu_freq_curr_div)
+                freqs_f.add_metric([cpu, "min"], low)
+                freqs_f.add_metric([cpu, "max"], high)
+            # utilization since the last update, from /proc/stat
+            cputime = cputimes[f"cpu{c}"]
+            last = self._cputimes.get(f"cpu{c}")
+            if fresh and last is None:
+                # just came online
+                self._utils[c] = 0.0
+            elif fresh:
+                busy, total = busy_total(cputime)
+                last_busy, last_total = busy_total(last)
+                busy_delta = max(0.0, busy - last_busy)
+                total_delta = max(0.0, total - last_total)
+                util = 0.0
+                if total_delta > 0:
+                    util = round(min(100.0, busy_delta / total_delta * 100), 1)
+                self._utils[c] = util
+            utils_f.add_metric([cpu], self._utils.get(c, 0.0))
+            if self._cpufreq:
+                scaling_driver = self._cadence.get(
+                    "governor",
+                    lambda: read_text(cpufreq_path(c, "scaling_governor")).strip(),
+                    c,
+                )
+                scaling_govs_f.add_metric([cpu], {"governors": scaling_driver})
+            # parse cpu time spent on each mode by /proc/stat
+            for i, mode in enumerate(cpu_modes):
+                cpu_seconds_total_f.add_metric([cpu, mode], float(cputime[i]) / user_hz)
+        self._cputimes = cputimes
+        self._cpu_ids = ids
+        self._families = [
+            freqs_f,
+            utils_f,
+            scaling_govs_f,
+            cpu_seconds_total_f,
+            loadavg_f,
+        ]
+        return self._exposition.render(self._registry)
+
+    def signals(self) -> Dict[str, Signal]:
+        return {
+            "util": Signal("cpu", "CPU Utils in percentage.", self.sample_util)
+        }
+
+    def sample_util(self) -> Dict[str, float]:
+        """Utilization of all CPUs since the last sample, from the first line of /proc/stat"""
+        line = read_text(procfs_path("stat")).split("\n", 1)[0].split()
+        busy, total = busy_total(line[1:])
+        last_busy, last_total = self._sampled
+        self._sampled = busy, total
+        if total <= last_total:
+            return {}
+        return {"all": min(100.0, max(0.0, busy - last_busy) / (total - last_total) * 100)}
+
+    def energy(self) -> Dict[str, float]:
+        """Joules of each CPU package from RAPL, counted across the wraps of energy_uj"""
+        if not self._enabled:
+            return {}
+        ret = {}
+        for package, energy_range in self._rapl_ranges.items():
+            uj = int(read_text(rapl_path(package, "energy_uj")))
+            last = self._rapl_last.get(package)
+            if last is None:
+                joules = uj / 1e6
+            else:
+                delta = uj - last
+                if delta < 0:
+                    delta += energy_range
+                joules = self._rapl_joules[package] + delta / 1e6
+            self._rapl_last[package] = uj
+            self._rapl_joules[package] = joules
+            ret[str(package)] = joules
+        return ret
+
+    def states(self) -> Dict[str, float]:
+        """Seconds all CPUs spent in each mode"""
+        line = read_text(procfs_path("stat")).split("\n", 1)[0].split()
+        return {mode: float(line[1 + i]) / user_hz for i, mode in enumerate(cpu_modes)}
 
     @enabled
     @locked
@@ -298,4 +443,7 @@ class CPU(Component):
         except Exception as e:
             logger.warning(f"CPUFreq control failed due to: {e}")
             result["error"] = "cpufreq control failed"
+        finally:
+            # governors and limits may have changed, even if a later write failed
+            self._cadence.invalidate("governor", "limits")
         return result
@@ -1,7 +1,11 @@
 from opts.logopt import *
 from opts.argsopt import *
-from prometheus_client import Gauge, Info, generate_latest
+from opts.pathopt import *
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from .capture import read_text
 from .component import Component
+from .exposition import Exposition
 from typing import Dict, List
 import threading
 import re
@@ -57,6 +61,26 @@ diskstatDiscardSectors = 16
 diskstatDiscardTicks = 17
 diskstatFlushRequestsCompleted = 18
 diskstatTimeSpentFlushing = 19
+# exported metric label, /proc/diskstats field and its scale
+diskstat_fields = [
+    ("reads_completed_total", diskstatReadIOs, 1.0),
+    ("reads_merged_total", diskstatReadMerges, 1.0),
+    ("read_bytes_total", diskstatReadSectors, unixSectorSize),
+    ("read_time_seconds_total", diskstatReadTicks, secondsPerTick),
+    ("writes_completed_total", diskstatWriteIOs, 1.0),
+    ("writes_merged_total", diskstatWriteMerges, 1.0),
+    ("written_bytes_total", diskstatWriteSectors, unixSectorSize),
+    ("write_time_seconds_total", diskstatWriteTicks, secondsPerTick),
+    ("io_now", diskstatIOsInProgress, 1.0),
+    ("io_time_seconds_total", diskstatIOsTotalTicks, secondsPerTick),
+    ("io_time_weighted_seconds_total", diskstatWeightedIOTicks, secondsPerTick),
+    ("discards_completed_total", diskstatDiscardIOs, 1.0),
+    ("discards_merged_total", diskstatDiscardMerges, 1.0),
+    ("discarded_sectors_total", diskstatDiscardSectors, 1.0),
+    ("discard_time_seconds_total", diskstatDiscardTicks, secondsPerTick),
+    ("flush_requests_total", diskstatFlushRequestsCompleted, 1.0),
+    ("flush_requests_time_seconds_total", diskstatTimeSpentFlushing, secondsPerTick),
+]
 
 
 class DISK(Component):
@@ -107,11 +131,10 @@ class DISK(Component):
     def setup(self):
         self._lock = threading.RLock()
         self._enabled = get_arg(f"{self._metric}_enable")
-        self._diskstat = Gauge(
-            f"{self._metric}_diskstat",
-            "Disk stat in different metric",
-            ["disk", "metric"],
-        )
+        self._families = []
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._exposition = Exposition()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
@@ -119,91 +142,49 @@ class DISK(Component):
     def get_attrs(self, argl):
         pass
 
+    def collect(self):
+        """Families built by the last update, see CollectorRegistry"""
+        return self._families
+
     @enabled
     @locked
     def update(self) -> bytes:
-        output = bytes("", "utf-8")
         # use /proc/diskstats together with /run/udev/data to get disk info
         diskstats: Dict[str, List[int]] = {}
         udevstats: Dict[str, Dict[str, str]] = {}
-        with open("/proc/diskstats", "r") as f:
-            for disk in f.readlines():
-                disk = [x for x in disk.strip().split(sep=" ") if x != ""]
-                if (
-                    re.match(diskstatsDefaultIgnoredDevices, disk[diskstatDeviceName])
-                    is None
-                ):
-                    diskstats[disk[diskstatDeviceName]] = disk
+        for disk in read_text(procfs_path("diskstats")).splitlines():
+            disk = [x for x in disk.strip().split(sep=" ") if x != ""]
+            if (
+                re.match(diskstatsDefaultIgnoredDevices, disk[diskstatDeviceName])
+                is None
+            ):
+                diskstats[disk[diskstatDeviceName]] = disk
         for disk in diskstats.values():
             devname = disk[diskstatDeviceName]
             major = disk[diskstatMajorNumber]
             minor = disk[diskstatMinorNumber]
-            with open(f"/run/udev/data/b{major}:{minor}", "r") as udev:
-                for p in udev.readlines():
-                    if p.startswith(udevDevicePropertyPrefix):
-                        porpers = p[2:].strip().split(sep="=", maxsplit=1)
-                        if len(porpers) == 2:
-                            if devname not in udevstats:
-                                udevstats[devname] = {}
-                            udevstats[devname][porpers[0]] = porpers[1]
+            udev = read_text(udev_data_path(f"b{major}:{minor}"))
+            for p in udev.splitlines():
+                if p.startswith(udevDevicePropertyPrefix):
+                    porpers = p[2:].strip().split(sep="=", maxsplit=1)
+                    if len(porpers) == 2:
+                        if devname not in udevstats:
+                            udevstats[devname] = {}
+                        udevstats[devname][porpers[0]] = porpers[1]
+        diskstat_f = GaugeMetricFamily(
+            f"{self._metric}_diskstat",
+            "Disk stat in different metric",
+            labels=["disk", "metric"],
+        )
         for disk in diskstats.values():
             devname = disk[diskstatDeviceName]
-            try:
-                self._diskstat.labels(disk=devname, metric="reads_completed_total").set(
-                    disk[diskstatReadIOs]
-                )
-                self._diskstat.labels(disk=devname, metric="reads_merged_total").set(
-                    disk[diskstatReadMerges]
-                )
-                self._diskstat.labels(disk=devname, metric="read_bytes_total").set(
-                    float(disk[diskstatReadSectors]) * unixSectorSize
-                )
-                self._diskstat.labels(
-                    disk=devname, metric="read_time_seconds_total"
-                ).set(float(disk[diskstatReadTicks]) * secondsPerTick)
-                self._diskstat.labels(
-                    disk=devname, metric="writes_completed_total"
-                ).set(disk[diskstatWriteIOs])
-                self._diskstat.labels(disk=devname, metric="writes_merged_total").set(
-                    disk[diskstatWriteMerges]
-                )
-                self._diskstat.labels(disk=devname, metric="written_bytes_total").set(
-                    float(disk[diskstatWriteSectors]) * unixSectorSize
-                )
-                self._diskstat.labels(
-                    disk=devname, metric="write_time_seconds_total"
-                ).set(float(disk[diskstatWriteTicks]) * secondsPerTick)
-                self._diskstat.labels(disk=devname, metric="io_now").set(
-                    disk[diskstatIOsInProgress]
-                )
-                self._diskstat.labels(disk=devname, metric="io_time_seconds_total").set(
-                    float(disk[diskstatIOsTotalTicks]) * secondsPerTick
-                )
-                self._diskstat.labels(
-                    disk=devname, metric="io_time_weighted_seconds_total"
-                ).set(float(disk[diskstatWeightedIOTicks]) * secondsPerTick)
-                self._diskstat.labels(
-                    disk=devname, metric="discards_completed_total"
-                ).set(disk[diskstatDiscardIOs])
-                self._diskstat.labels(disk=devname, metric="discards_merged_total").set(
-                    disk[diskstatDiscardMerges]
-                )
-                self._diskstat.labels(
-                    disk=devname, metric="discarded_sectors_total"
-                ).set(disk[diskstatDiscardSectors])
-                self._diskstat.labels(
-                    disk=devname, metric="discard_time_seconds_total"
-                ).set(float(disk[diskstatDiscardTicks]) * secondsPerTick)
-                self._diskstat.labels(disk=devname, metric="flush_requests_total").set(
-                    disk[diskstatFlushRequestsCompleted]
-                )
-                self._diskstat.labels(
-                    disk=devname, metric="flush_requests_time_seconds_total"
-                ).set(float(disk[diskstatTimeSpentFlushing]) * secondsPerTick)
-            except IndexError:
-                continue
-        output += generate_latest(self._diskstat)
-        return output
+            for metric, field, scale in diskstat_fields:
+                # older kernels have fewer fields, e.g. no discard stats
+                if field >= len(disk):
+                    break
+                diskstat_f.add_metric([devname, metric], float(disk[field]) * scale)
+        self._families = [diskstat_f]
+        return self._exposition.render(self._registry)
 
     @enabled
     @locked
@@ -0,0 +1,164 @@
+"""
+Text exposition with pre-encoded static parts
+"""
+
+from prometheus_client.utils import floatToGoString, INF, MINUS_INF
+from typing import Dict, Tuple
+
+om_suffixes = ["_created", "_gsum", "_gcount"]
+
+
+class Exposition:
+    """Render a registry like generate_latest, reusing encoded parts
+
+    HELP/TYPE headers and the `name{labels} ` prefix of every series are
+    encoded once. The last line of every series is kept with its value, so
+    a scrape only formats the values that changed. Lines are written into
+    one buffer that is kept between scrapes.
+    """
+
+    def __init__(self, size: int = 64 * 1024) -> None:
+        self._headers: Dict[Tuple, bytes] = {}
+        # (sample name, label items) -> [prefix, last value, last line]
+        self._series: Dict[Tuple, list] = {}
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._pos = 0
+        self._samples = 0
+
+    def header(self, metric) -> bytes:
+        key = (metric.name, metric.type, metric.documentation)
+        header = self._headers.get(key)
+        if header is None:
+            mname, mtype = metric.name, metric.type
+            # Munging from OpenMetrics into Prometheus format.
+            if mtype == "counter":
+                mname = mname + "_total"
+            elif mtype == "info":
+                mname = mname + "_info"
+                mtype = "gauge"
+            elif mtype == "stateset":
+                mtype = "gauge"
+            elif mtype == "gaugehistogram":
+                mtype = "histogram"
+            elif mtype == "unknown":
+                mtype = "untyped"
+            header = (
+                f"# HELP {mname} {escape_doc(metric.documentation)}\n"
+                f"# TYPE {mname} {mtype}\n"
+            ).encode("utf-8")
+            self._headers[key] = header
+        return header
+
+    def reserve(self, size: int):
+        """Make room for size more bytes after the current position"""
+        if self._pos + size > len(self._buffer):
+            self._view.release()
+            grow = max(self._pos + size, 2 * len(self._buffer)) - len(self._buffer)
+            self._buffer.extend(bytes(grow))
+            self._view = memoryview(self._buffer)
+
+    def write(self, data: bytes):
+        self.reserve(len(data))
+        end = self._pos + len(data)
+        self._view[self._pos : end] = data
+        self._pos = end
+
+    def write_samples(self, samples):
+        series = self._series
+        view, pos = self._view, self._pos
+        for s in samples:
+            # label order follows the family's labelnames, so no sort for the key
+            key = (s.name, tuple(s.labels.items()))
+            entry = series.get(key)
+            if entry is None:
+                entry = [encode_prefix(s), None, b""]
+                series[key] = entry
+            value = s.value
+            if value == entry[1] and s.timestamp is None:
+                line = entry[2]
+            else:
+                text = format_value(value)
+                if s.timestamp is not None:
+                    text = f"{text} {int(float(s.timestamp) * 1000):d}"
+                line = entry[0] + f"{text}\n".encode("utf-8")
+                entry[1], entry[2] = value, line
+            end = pos + len(line)
+            if end > len(view):
+                self._pos = pos
+                self.reserve(len(line))
+                view = self._view
+            view[pos:end] = line
+            pos = end
+        self._pos = pos
+        self._samples += len(samples)
+
+    def render(self, registry) -> bytes:
+        """Same output as generate_latest(registry)
+
+        Args:
+            registry: collector registry, or anything with a collect method
+
+        Returns:
+            bytes: text exposition of all collected families
+        """
+        self._pos = 0
+        self._samples = 0
+        for metric in registry.collect():
+            self.write(self.header(metric))
+            # OpenMetrics specific samples, put in a gauge at the end.
+            om_names = {metric.name + suffix: suffix for suffix in om_suffixes}
+            om_samples = {}
+            samples = []
+            for s in metric.samples:
+                suffix = om_names.get(s.name)
+                if suffix is None:
+                    samples.append(s)
+                else:
+                    om_samples.setdefault(suffix, []).append(s)
+            self.write_samples(samples)
+            for suffix, samples in sorted(om_samples.items()):
+                self.write(
+                    (
+                        f"# HELP {metric.name}{suffix} {escape_doc(metric.documentation)}\n"
+                        f"# TYPE {metric.name}{suffix} gauge\n"
+                    ).encode("utf-8")
+                )
+                self.write_samples(samples)
+        # drop series that went away, e.g. removed disks
+        if len(self._series) > 2 * self._samples + 1024:
+            self._series.clear()
+        return bytes(self._view[: self._pos])
+
+
+def encode_prefix(sample) -> bytes:
+    if sample.labels:
+        labelstr = ",".join(
+            f'{k}="{escape_label(v)}"' for k, v in sorted(sample.labels.items())
+        )
+        return f"{sample.name}{{{labelstr}}} ".encode("utf-8")
+    return f"{sample.name} ".encode("utf-8")
+
+
+def format_value(value) -> str:
+    """Same as floatToGoString, with a fast path for the common values"""
+    value = float(value)
+    # repr already matches Go below 1e6, Go switches to exponents sooner
+    if MINUS_INF < value < 1e6:
+        return repr(value)
+    if value == INF or value == MINUS_INF or value != value:
+        return floatToGoString(value)
+    s = repr(value)
+    dot = s.find(".")
+    if dot > 6:
+        mantissa = f"{s[0]}.{s[1:dot]}{s[dot + 1:]}".rstrip("0.")
+        return f"{mantissa}e+0{dot - 1}"
+    return s
+
+
+def escape_doc(doc: str) -> str:
+    return doc.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
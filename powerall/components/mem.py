@@ -1,9 +1,28 @@
 from opts.logopt import *
 from opts.argsopt import *
-from prometheus_client import Gauge, generate_latest
+from opts.pathopt import *
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from .capture import read_text
 from .component import Component
+from .exposition import Exposition
 import threading
 
+# exported type label and its /proc/meminfo field
+meminfo_fields = [
+    ("memtotal", "MemTotal"),
+    ("memfree", "MemFree"),
+    ("memavailable", "MemAvailable"),
+    ("buffers", "Buffers"),
+    ("cached", "Cached"),
+    ("slab", "Slab"),
+    ("pagetables", "PageTables"),
+    ("swapcached", "SwapCached"),
+    ("swaptotal", "SwapTotal"),
+    ("swapfree", "SwapFree"),
+    ("hardwarecorrupted", "HardwareCorrupted"),
+]
+
 
 class MEM(Component):
     def __init__(self) -> None:
@@ -53,9 +72,10 @@ class MEM(Component):
     def setup(self):
         self._lock = threading.RLock()
         self._enabled = get_arg(f"{self._metric}_enable")
-        self._mem_bytes = Gauge(
-            f"{self._metric}_bytes", "Memory usage in bytes.", ["type"]
-        )
+        self._families = []
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._exposition = Exposition()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
@@ -63,31 +83,25 @@ class MEM(Component):
     def get_attrs(self, argl):
         pass
 
+    def collect(self):
+        """Families built by the last update, see CollectorRegistry"""
+        return self._families
+
     @enabled
     @locked
     def update(self) -> bytes:
-        output = bytes("", "utf-8")
         mems = {}
         # use /proc/meminfo to get memory info
-        with open("/proc/meminfo", "r") as f:
-            for line in f.readlines():
-                line = line.strip().split(sep=":", maxsplit=1)
-                mems[line[0]] = (
-                    float(line[1].strip().split(sep=" ", maxsplit=1)[0]) * 1024
-                )
-        self._mem_bytes.labels(type="memtotal").set(mems["MemTotal"])
-        self._mem_bytes.labels(type="memfree").set(mems["MemFree"])
-        self._mem_bytes.labels(type="memavailable").set(mems["MemAvailable"])
-        self._mem_bytes.labels(type="buffers").set(mems["Buffers"])
-        self._mem_bytes.labels(type="cached").set(mems["Cached"])
-        self._mem_bytes.labels(type="slab").set(mems["Slab"])
-        self._mem_bytes.labels(type="pagetables").set(mems["PageTables"])
-        self._mem_bytes.labels(type="swapcached").set(mems["SwapCached"])
-        self._mem_bytes.labels(type="swaptotal").set(mems["SwapTotal"])
-        self._mem_bytes.labels(type="swapfree").set(mems["SwapFree"])
-        self._mem_bytes.labels(type="hardwarecorrupted").set(mems["HardwareCorrupted"])
-        output += generate_latest(self._mem_bytes)
-        return output
+        for line in read_text(procfs_path("meminfo")).splitlines():
+            line = line.strip().split(sep=":", maxsplit=1)
+            mems[line[0]] = float(line[1].strip().split(sep=" ", maxsplit=1)[0]) * 1024
+        mem_bytes_f = GaugeMetricFamily(
+            f"{self._metric}_bytes", "Memory usage in bytes.", labels=["type"]
+        )
+        for t, field in meminfo_fields:
+            mem_bytes_f.add_metric([t], mems[field])
+        self._families = [mem_bytes_f]
+        return self._exposition.render(self._registry)
 
     @enabled
     @locked
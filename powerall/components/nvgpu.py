@@ -1,13 +1,27 @@
-from prometheus_client import Gauge, Info, generate_latest
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily
 from pynvml import *
 from opts.logopt import *
 from opts.argsopt import *
-from .component import Component
+from .capture import nvml
+from .component import Component, Signal
+from .exposition import Exposition
+from .volatility import Cadence, FAST, SLOW, STATIC
+from typing import Dict
 import re
 import threading
 
 nvgpus_list = re.compile(r"[0-9]+-[0-9]+")
 
+# after these no query of the device succeeds, fail the update instead of skipping a metric
+nvml_fatal_errors = (
+    NVML_ERROR_UNINITIALIZED,
+    NVML_ERROR_DRIVER_NOT_LOADED,
+    NVML_ERROR_GPU_IS_LOST,
+    NVML_ERROR_RESET_REQUIRED,
+    NVML_ERROR_LIB_RM_VERSION_MISMATCH,
+)
+
 
 class NVGPU(Component):
     def __init__(self) -> None:
@@ -65,125 +79,95 @@ class NVGPU(Component):
         self._lock = threading.RLock()
         self._enabled = get_arg(f"{self._metric}_enable")
         self._config = get_arg(f"{self._metric}_config")
+        self._nvgpu_nums = 0
+        self._nvgpu_devices = []
+        self._nvgpu_power_min_maxs = []
+        self._families = []
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._exposition = Exposition()
+        self._cadence = Cadence(
+            self._metric,
+            {
+                "gpuinfo": STATIC,
+                "appclk": SLOW,
+                "compute_mode": SLOW,
+                "persis_mode": SLOW,
+                "enforce_limit": SLOW,
+                "fan_speed": FAST,
+                "clk": FAST,
+                "perf": FAST,
+                "util": FAST,
+                "temp": FAST,
+                "power": FAST,
+                "mem": FAST,
+            },
+        )
         try:
-            nvmlInit()
+            nvml.nvmlInit()
         except NVMLError as error:
             logger.warning(
                 f"Could not init NVML: {error}, will disable nvgpu info collect"
             )
             self._enabled = False
-        self._nvgpu_power = Gauge(
-            f"{self._metric}_power",
-            "NVGPU Power information from nvml (milliwatt).",
-            ["index", "mode"],
-        )
-        self._nvgpu_fan_speed = Gauge(
-            f"{self._metric}_fan_speed",
-            "NVGPU Fan Speed from nvml. (rpm)",
-            ["index", "fan", "mode"],
-        )
+        # fan and power limits are read once, (labels, value) of each sample
+        self._nvgpu_fan_speed_limits = []
+        self._nvgpu_power_limits = []
         self.collect_gpu_stable_info()
         self._nvgpu_power_enforce_limits = [None] * self._nvgpu_nums
+        self._nvgpu_no_energy = set()
+        self._nvgpu_no_violation = set()
         self._nvgpu_clocks = [x for x in range(NVML_CLOCK_COUNT)]
         self._nvgpu_id_clocks = [x for x in range(NVML_CLOCK_ID_COUNT)]
         self._nvgpu_temps = [x for x in range(NVML_TEMPERATURE_COUNT)]
-        # uuid, name, bus_type
-        self._nvgpu_info = Info(
-            f"{self._metric}_gpuinfo",
-            "NVGPU information from nvml.",
-            ["index"],
-        )
-        self._nvgpu_appclk = Gauge(
-            f"{self._metric}_appclk",
-            "NVGPU Applications Clock information from nvml. (MHz)",
-            ["index", "type"],
-        )
-        self._nvgpu_clk = Gauge(
-            f"{self._metric}_clk",
-            "NVGPU Clock information from nvml. (MHz)",
-            ["index", "type", "id"],
-        )
-        # mode
-        self._nvgpu_compute_mode = Info(
-            f"{self._metric}_compute_mode",
-            "NVGPU Compute Mode information from nvml.",
-            ["index"],
-        )
-        self._nvgpu_perf = Gauge(
-            f"{self._metric}_perf",
-            "NVGPU Performance State information from nvml. Value indicates P<value>",
-            ["index"],
-        )
-        # mode
-        self._nvgpu_persis_mode = Info(
-            f"{self._metric}_persis_mode",
-            "NVGPU Persistence Mode information from nvml.",
-            ["index"],
-        )
-        self._nvgpu_util = Gauge(
-            f"{self._metric}_util",
-            "NVGPU Utilization Rates information from nvml. (percentage)",
-            ["index", "type"],
-        )
-        self._nvgpu_temp = Gauge(
-            f"{self._metric}_temp",
-            "NVGPU Temperature information from nvml in Celsius format.",
-            ["index", "type"],
-        )
-        self._nvgpu_mem = Gauge(
-            f"{self._metric}_mem",
-            "NVGPU Memory from nvml (bytes IEC).",
-            ["index", "mode"],
-        )
 
     @enabled
     def collect_gpu_stable_info(self):
         try:
-            self._nvgpu_nums = nvmlDeviceGetCount()
+            self._nvgpu_nums = nvml.nvmlDeviceGetCount()
             self._nvgpu_devices = []
             for i in range(self._nvgpu_nums):
-                self._nvgpu_devices.append(nvmlDeviceGetHandleByIndex(i))
+                self._nvgpu_devices.append(nvml.nvmlDeviceGetHandleByIndex(i))
             # driver_v, cuda_v, nvml_v
-            self._nvgpu_sys_info = Info(
-                f"{self._metric}_sysinfo", "NVGPU System information from nvml."
-            )
-            cudaV = nvmlSystemGetCudaDriverVersion_v2()
+            cudaV = nvml.nvmlSystemGetCudaDriverVersion_v2()
             # Rounding
-            self._nvgpu_sys_info.info(
-                {
-                    "driver_v": nvmlSystemGetDriverVersion(),
+            self._nvgpu_sys_info = InfoMetricFamily(
+                f"{self._metric}_sysinfo",
+                "NVGPU System information from nvml.",
+                value={
+                    "driver_v": nvml.nvmlSystemGetDriverVersion(),
                     "cuda_v": f"{cudaV//1000}.{cudaV%1000//10}",
-                    "nvml_v": nvmlSystemGetNVMLVersion(),
-                }
+                    "nvml_v": nvml.nvmlSystemGetNVMLVersion(),
+                },
             )
             self._nvgpu_has_fan = [True] * self._nvgpu_nums
             self._fanNums = [0] * self._nvgpu_nums
             self._nvgpu_power_min_maxs = []
             for i, d in enumerate(self._nvgpu_devices):
-                fanNums = nvmlDeviceGetNumFans(d)
+                fanNums = nvml.nvmlDeviceGetNumFans(d)
                 self._fanNums[i] = fanNums
                 if fanNums > 0:
                     minFanSpeed, maxFanSpeed = 0.0, 0.0
-                    nvmlDeviceGetMinMaxFanSpeed(d, minFanSpeed, maxFanSpeed)
+                    nvml.nvmlDeviceGetMinMaxFanSpeed(d, minFanSpeed, maxFanSpeed)
                     for f in range(fanNums):
-                        self._nvgpu_fan_speed.labels(index=i, fan=f, mode="min").set(
-                            minFanSpeed
+                        self._nvgpu_fan_speed_limits.append(
+                            ([str(i), str(f), "min"], minFanSpeed)
                         )
-                        self._nvgpu_fan_speed.labels(index=i, fan=f, mode="max").set(
-                            maxFanSpeed
+                        self._nvgpu_fan_speed_limits.append(
+                            ([str(i), str(f), "max"], maxFanSpeed)
                         )
                 else:
                     logger.warning(f"GPU {i} has not Fan. Will disable it")
                     self._nvgpu_has_fan[i] = False
                 try:
-                    nvgpu_power_min_max = nvmlDeviceGetPowerManagementLimitConstraints(
+                    nvgpu_power_min_max = nvml.nvmlDeviceGetPowerManagementLimitConstraints(
                         d
                     )
-                    self._nvgpu_power.labels(index=i, mode="min").set(
-                        nvgpu_power_min_max[0]
+                    self._nvgpu_power_limits.append(
+                        ([str(i), "min"], nvgpu_power_min_max[0])
                     )
-                    self._nvgpu_power.labels(index=i, mode="max").set(
-                        nvgpu_power_min_max[1]
+                    self._nvgpu_power_limits.append(
+                        ([str(i), "max"], nvgpu_power_min_max[1])
                     )
                     self._nvgpu_power_min_maxs.append(nvgpu_power_min_max)
                 except NVMLError as error:
@@ -198,7 +182,7 @@ class NVGPU(Component):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            nvmlShutdown()
+            nvml.nvmlShutdown()
         except NVMLError as e:
             logger.warning(f"NVML {e}, no need to shutdown")
         except Exception as e:
@@ -235,7 +219,7 @@ class NVGPU(Component):
                     for i, d in enumerate(self._nvgpu_devices):
                         try:
                             # use mW
-                            nvmlDeviceSetPowerManagementLimit(d, int(pl) * 1000)
+                            nvml.nvmlDeviceSetPowerManagementLimit(d, int(pl) * 1000)
                         except NVMLError as e:
                             logger.warning(
                                 f"Change NVGPU {i} change powerlimit to {pl} failed due to: {e}"
@@ -253,7 +237,7 @@ class NVGPU(Component):
                         try:
                             d = self._nvgpu_devices[g]
                             # use mW
-                            nvmlDeviceSetPowerManagementLimit(d, int(pl) * 1000)
+                            nvml.nvmlDeviceSetPowerManagementLimit(d, int(pl) * 1000)
                         except NVMLError as e:
                             logger.warning(
                                 f"Change NVGPU {g} change powerlimit to {pl} failed due to: {e}"
@@ -299,143 +283,248 @@ class NVGPU(Component):
                     return None
         return ret
 
+    def collect(self):
+        """Families built by the last update, see CollectorRegistry"""
+        return self._families
+
     @enabled
     @locked
     def update(self) -> bytes:
-        final_output = bytes("", "utf-8")
-        final_output += generate_latest(self._nvgpu_sys_info)
+        # uuid, name, bus_type
+        info_f = InfoMetricFamily(
+            f"{self._metric}_gpuinfo", "NVGPU information from nvml.", labels=["index"]
+        )
+        fan_speed_f = GaugeMetricFamily(
+            f"{self._metric}_fan_speed",
+            "NVGPU Fan Speed from nvml. (rpm)",
+            labels=["index", "fan", "mode"],
+        )
+        for labels, value in self._nvgpu_fan_speed_limits:
+            fan_speed_f.add_metric(labels, value)
+        appclk_f = GaugeMetricFamily(
+            f"{self._metric}_appclk",
+            "NVGPU Applications Clock information from nvml. (MHz)",
+            labels=["index", "type"],
+        )
+        clk_f = GaugeMetricFamily(
+            f"{self._metric}_clk",
+            "NVGPU Clock information from nvml. (MHz)",
+            labels=["index", "type", "id"],
+        )
+        # mode
+        compute_mode_f = InfoMetricFamily(
+            f"{self._metric}_compute_mode",
+            "NVGPU Compute Mode information from nvml.",
+            labels=["index"],
+        )
+        perf_f = GaugeMetricFamily(
+            f"{self._metric}_perf",
+            "NVGPU Performance State information from nvml. Value indicates P<value>",
+            labels=["index"],
+        )
+        # mode
+        persis_mode_f = InfoMetricFamily(
+            f"{self._metric}_persis_mode",
+            "NVGPU Persistence Mode information from nvml.",
+            labels=["index"],
+        )
+        util_f = GaugeMetricFamily(
+            f"{self._metric}_util",
+            "NVGPU Utilization Rates information from nvml. (percentage)",
+            labels=["index", "type"],
+        )
+        temp_f = GaugeMetricFamily(
+            f"{self._metric}_temp",
+            "NVGPU Temperature information from nvml in Celsius format.",
+            labels=["index", "type"],
+        )
+        power_f = GaugeMetricFamily(
+            f"{self._metric}_power",
+            "NVGPU Power information from nvml (milliwatt).",
+            labels=["index", "mode"],
+        )
+        for labels, value in self._nvgpu_power_limits:
+            power_f.add_metric(labels, value)
+        mem_f = GaugeMetricFamily(
+            f"{self._metric}_mem",
+            "NVGPU Memory from nvml (bytes IEC).",
+            labels=["index", "mode"],
+        )
         for i, d in enumerate(self._nvgpu_devices):
+            index = str(i)
+
             # Get GPU Info
 
-            uuid, name, busType = (
-                nvmlDeviceGetUUID(d),
-                nvmlDeviceGetName(d),
-                getBusTypeString(nvmlDeviceGetBusType(d)),
-            )
-            self._nvgpu_info.labels(index=i).info(
-                {"uuid": uuid, "name": name, "bus_type": busType}
-            )
-            final_output += generate_latest(self._nvgpu_info)
+            try:
+                uuid, name, busType = self._cadence.get(
+                    "gpuinfo",
+                    lambda: (
+                        nvml.nvmlDeviceGetUUID(d),
+                        nvml.nvmlDeviceGetName(d),
+                        getBusTypeString(nvml.nvmlDeviceGetBusType(d)),
+                    ),
+                    i,
+                )
+                info_f.add_metric(
+                    [index], {"uuid": uuid, "name": name, "bus_type": busType}
+                )
+            except NVMLError as error:
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(f"unable to get GPU {i} Info: {error}")
 
             # Get GPU Fan Info
 
             if self._nvgpu_has_fan[i]:
                 for f in range(self._fanNums[i]):
-                    fanSpeed = nvmlDeviceGetFanSpeed_v2(d, f)
-                    self._nvgpu_fan_speed.labels(index=i, fan=f, mode="current").set(
-                        fanSpeed
-                    )
-                final_output += generate_latest(self._nvgpu_fan_speed)
+                    try:
+                        fanSpeed = self._cadence.get(
+                            "fan_speed",
+                            lambda: nvml.nvmlDeviceGetFanSpeed_v2(d, f),
+                            i,
+                            f,
+                        )
+                        fan_speed_f.add_metric([index, str(f), "current"], fanSpeed)
+                    except NVMLError as error:
+                        if error.value in nvml_fatal_errors:
+                            raise
+                        logger.warning(
+                            f"unable to get GPU {i} Fan {f} Speed: {error}. Will disable it"
+                        )
+                        self._nvgpu_has_fan[i] = False
+                        break
 
             # Get GPU Clock Info
 
-            for t in self._nvgpu_clocks:
+            for t in list(self._nvgpu_clocks):
                 try:
-                    appclk = nvmlDeviceGetApplicationsClock(d, t)
-                    self._nvgpu_appclk.labels(index=i, type=getClockTypeString(t)).set(
-                        appclk
+                    appclk = self._cadence.get(
+                        "appclk", lambda: nvml.nvmlDeviceGetApplicationsClock(d, t), i, t
                     )
+                    appclk_f.add_metric([index, getClockTypeString(t)], appclk)
                 except NVMLError as error:
+                    if error.value in nvml_fatal_errors:
+                        raise
                     logger.warning(
                         f"unable to get GPU {i} Applications Clock Type {getClockTypeString(t)} Info: {error}. Will disable it"
                     )
                     self._nvgpu_clocks.remove(t)
-                for tt in self._nvgpu_id_clocks:
+                for tt in list(self._nvgpu_id_clocks):
                     try:
-                        clk = nvmlDeviceGetClock(d, t, tt)
-                        self._nvgpu_clk.labels(
-                            index=i, type=getClockTypeString(t), id=getClockIDString(tt)
-                        ).set(clk)
+                        clk = self._cadence.get(
+                            "clk", lambda: nvml.nvmlDeviceGetClock(d, t, tt), i, t, tt
+                        )
+                        clk_f.add_metric(
+                            [index, getClockTypeString(t), getClockIDString(tt)], clk
+                        )
                     except NVMLError as error:
+                        if error.value in nvml_fatal_errors:
+                            raise
                         logger.warning(
                             f"unable to get GPU {i} Clock Type {getClockTypeString(t)} ID {getClockIDString(tt)} Info: {error}. Will disable it"
                         )
                         self._nvgpu_id_clocks.remove(tt)
-            final_output += generate_latest(self._nvgpu_appclk)
-            final_output += generate_latest(self._nvgpu_clk)
 
             # Get Compute Mode
 
             try:
-                compute_m = nvmlDeviceGetComputeMode(d)
-                self._nvgpu_compute_mode.labels(index=i).info(
-                    {"mode": getComputeModeString(compute_m)}
+                compute_m = self._cadence.get(
+                    "compute_mode", lambda: nvml.nvmlDeviceGetComputeMode(d), i
+                )
+                compute_mode_f.add_metric(
+                    [index], {"mode": getComputeModeString(compute_m)}
                 )
             except NVMLError as error:
+                if error.value in nvml_fatal_errors:
+                    raise
                 logger.warning(f"unable to get GPU {i} Compute Mode Info: {error}")
-            final_output += generate_latest(self._nvgpu_compute_mode)
 
             # Get Performance State
 
             try:
-                perf_state = nvmlDeviceGetPerformanceState(d)
-                self._nvgpu_perf.labels(index=i).set(perf_state)
+                perf_state = self._cadence.get(
+                    "perf", lambda: nvml.nvmlDeviceGetPerformanceState(d), i
+                )
+                perf_f.add_metric([index], perf_state)
             except NVMLError as error:
-                return logger.warning(
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(
                     f"unable to get GPU {i} Performance State Info: {error}"
                 )
-            final_output += generate_latest(self._nvgpu_perf)
 
             # Get Persistence Mode
 
             try:
-                persis_mode = nvmlDeviceGetPersistenceMode(d)
-                self._nvgpu_persis_mode.labels(index=i).info(
-                    {"mode": getPersisModeString(persis_mode)}
+                persis_mode = self._cadence.get(
+                    "persis_mode", lambda: nvml.nvmlDeviceGetPersistenceMode(d), i
+                )
+                persis_mode_f.add_metric(
+                    [index], {"mode": getPersisModeString(persis_mode)}
                 )
             except NVMLError as error:
-                return logger.warning(
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(
                     f"unable to get GPU {i} Persistence Mode Info: {error}"
                 )
-            final_output += generate_latest(self._nvgpu_persis_mode)
 
             # Get GPU Utilization
 
             try:
-                util = nvmlDeviceGetUtilizationRates(d)
-                self._nvgpu_util.labels(index=i, type="GPU").set(util.gpu)
-                self._nvgpu_util.labels(index=i, type="MEMORY").set(util.memory)
+                util = self._cadence.get(
+                    "util", lambda: nvml.nvmlDeviceGetUtilizationRates(d), i
+                )
+                util_f.add_metric([index, "GPU"], util.gpu)
+                util_f.add_metric([index, "MEMORY"], util.memory)
             except NVMLError as error:
-                return logger.warning(
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(
                     f"unable to get GPU {i} Utilization Info: {error}"
                 )
-            final_output += generate_latest(self._nvgpu_util)
 
             # Get Temperature Info
 
-            for t in self._nvgpu_temps:
+            for t in list(self._nvgpu_temps):
                 try:
-                    temp = nvmlDeviceGetTemperature(d, t)
-                    self._nvgpu_temp.labels(
-                        index=i, type=getTemperatureSensorString(t)
-                    ).set(temp)
+                    temp = self._cadence.get(
+                        "temp", lambda: nvml.nvmlDeviceGetTemperature(d, t), i, t
+                    )
+                    temp_f.add_metric([index, getTemperatureSensorString(t)], temp)
                 except NVMLError as error:
+                    if error.value in nvml_fatal_errors:
+                        raise
                     self._nvgpu_temps.remove(t)
-                    return logger.warning(
+                    logger.warning(
                         f"unable to get GPU {i} Temperature Sensor {getTemperatureSensorString(t)} Value: {error}. Will disable it"
                     )
-                final_output += generate_latest(self._nvgpu_temp)
 
             # Get Power Info
 
             try:
-                power = nvmlDeviceGetPowerUsage(d)
-                self._nvgpu_power.labels(index=i, mode="usage").set(power)
+                power = self._cadence.get(
+                    "power", lambda: nvml.nvmlDeviceGetPowerUsage(d), i
+                )
+                power_f.add_metric([index, "usage"], power)
             except NVMLError as error:
-                return logger.warning(
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(
                     f"unable to get GPU {i} Power Usage Value: {error}"
                 )
             try:
-                enforce_limit = nvmlDeviceGetEnforcedPowerLimit(d)
-                self._nvgpu_power_enforce_limits[i] = enforce_limit
-                self._nvgpu_power.labels(index=i, mode="enforce_limit").set(
-                    enforce_limit
+                enforce_limit = self._cadence.get(
+                    "enforce_limit", lambda: nvml.nvmlDeviceGetEnforcedPowerLimit(d), i
                 )
+                self._nvgpu_power_enforce_limits[i] = enforce_limit
+                power_f.add_metric([index, "enforce_limit"], enforce_limit)
             except NVMLError as error:
+                if error.value in nvml_fatal_errors:
+                    raise
                 logger.warning(
                     f"unable to get GPU {i} Power Enforced Limitation Value: {error}"
                 )
-            final_output += generate_latest(self._nvgpu_power)
 
             """
                 Get Memory Info
@@ -443,15 +532,96 @@ class NVGPU(Component):
             """
 
             try:
-                mem = nvmlDeviceGetMemoryInfo(d)
-                self._nvgpu_mem.labels(index=i, mode="total").set(mem.total)
-                self._nvgpu_mem.labels(index=i, mode="free").set(mem.free)
-                self._nvgpu_mem.labels(index=i, mode="used").set(mem.used)
+                mem = self._cadence.get(
+                    "mem", lambda: nvml.nvmlDeviceGetMemoryInfo(d), i
+                )
+                mem_f.add_metric([index, "total"], mem.total)
+                mem_f.add_metric([index, "free"], mem.free)
+                mem_f.add_metric([index, "used"], mem.used)
             except NVMLError as error:
-                return logger.warning(f"unable to get GPU {i} Memory Info: {error}")
-            final_output += generate_latest(self._nvgpu_mem)
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(f"unable to get GPU {i} Memory Info: {error}")
+
+        self._families = [
+            self._nvgpu_sys_info,
+            info_f,
+            fan_speed_f,
+            appclk_f,
+            clk_f,
+            compute_mode_f,
+            perf_f,
+            persis_mode_f,
+            util_f,
+            temp_f,
+            power_f,
+            mem_f,
+        ]
+        return self._exposition.render(self._registry)
+
+    def signals(self) -> Dict[str, Signal]:
+        if not self._enabled:
+            return {}
+        return {
+            "power": Signal(
+                "index",
+                "NVGPU Power Usage from nvml (milliwatt).",
+                self.sample_power,
+                watts=0.001,
+            )
+        }
+
+    def sample_power(self) -> Dict[str, float]:
+        """Power usage of each GPU, NVML is thread safe so the update lock is not taken"""
+        return {
+            str(i): nvml.nvmlDeviceGetPowerUsage(d)
+            for i, d in enumerate(self._nvgpu_devices)
+        }
+
+    def energy(self) -> Dict[str, float]:
+        """Joules since the driver loaded of each GPU that counts them (Volta and later)"""
+        if not self._enabled:
+            return {}
+        ret = {}
+        for i, d in enumerate(self._nvgpu_devices):
+            if i in self._nvgpu_no_energy:
+                continue
+            try:
+                ret[str(i)] = nvml.nvmlDeviceGetTotalEnergyConsumption(d) / 1000.0
+            except NVMLError as error:
+                if error.value in nvml_fatal_errors:
+                    raise
+                logger.warning(
+                    f"unable to get GPU {i} Total Energy Consumption: {error}. Will integrate its power"
+                )
+                self._nvgpu_no_energy.add(i)
+        return ret
 
-        return final_output
+    def states(self) -> Dict[str, float]:
+        """Seconds all GPUs were held below their clocks by power and thermal limits"""
+        if not self._enabled:
+            return {}
+        ret = {}
+        for policy, state in (
+            (NVML_PERF_POLICY_POWER, "power_capped"),
+            (NVML_PERF_POLICY_THERMAL, "thermal_capped"),
+        ):
+            for i, d in enumerate(self._nvgpu_devices):
+                if (i, policy) in self._nvgpu_no_violation:
+                    continue
+                try:
+                    violation = nvml.nvmlDeviceGetViolationStatus(d, policy)
+                except NVMLError as error:
+                    if error.value in nvml_fatal_errors:
+                        raise
+                    logger.warning(
+                        f"unable to get GPU {i} {state} time: {error}. Will disable it"
+                    )
+                    self._nvgpu_no_violation.add((i, policy))
+                    continue
+                # nanoseconds
+                ret[state] = ret.get(state, 0.0) + violation.violationTime / 1e9
+        return ret
 
     @enabled
     @locked
@@ -459,6 +629,8 @@ class NVGPU(Component):
         result = {}
         if self._config == "nvml":
             result = self.nvml_control(argl)
+            # power limits may have changed, even if a later device failed
+            self._cadence.invalidate("enforce_limit")
         else:
             logger.warning("No NVGPU controls config choose")
             result = {"error": "No NVGPU config choose"}
@@ -0,0 +1,94 @@
+"""
+Components discovered from a table and entry points, imported only when enabled
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from importlib import import_module, metadata
+from typing import Dict, List
+from .component import Component
+
+# Built-in components as "module:Class", in the order they are collected
+builtin = {
+    "cpu": "components.cpu:CPU",
+    "nvgpu": "components.nvgpu:NVGPU",
+    "bmc": "components.bmc:BMC",
+    "disk": "components.disk:DISK",
+    "hwmon": "components.hwmon:HWMON",
+    "mem": "components.mem:MEM",
+    "process": "components.process:PROCESS",
+}
+
+# Packages add components with entry points in this group, named by component
+entry_point_group = "powerall.components"
+
+
+def component_entry_points() -> list:
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        return list(eps.select(group=entry_point_group))
+    return list(eps.get(entry_point_group, []))
+
+
+def load(target: str) -> type:
+    """Import a "module:Class" target and return the class"""
+    module, _, attr = target.partition(":")
+    return getattr(import_module(module), attr)
+
+
+class Registry:
+    """Import, construct and enter only the enabled components
+
+    Only the --<component>-enable options are parsed before components
+    are imported, so a disabled component costs neither its imports
+    (pynvml, redfish) nor its __enter__. Options of disabled components
+    are accepted and ignored.
+    """
+
+    def __init__(self) -> None:
+        self._name = "registry"
+        self._table: Dict[str, str] = dict(builtin)
+        self._components: Dict[str, Component] = {}
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        for ep in component_entry_points():
+            if ep.name in self._table:
+                logger.warning(f"Component {ep.name} from {ep.value} is already registered")
+                continue
+            self._table[ep.name] = ep.value
+        enables = ArgumentParser(add_help=False, allow_abbrev=False)
+        for name in self._table:
+            enables.add_argument(f"--{name}-enable", type=bool, default=True)
+        enabled, _ = enables.parse_known_args()
+        try:
+            for name, target in self._table.items():
+                if getattr(enabled, f"{name}_enable"):
+                    self._components[name] = self._stack.enter_context(load(target)())
+                else:
+                    add_option(
+                        f"--{name}-enable",
+                        type=bool,
+                        default=True,
+                        help=f"Enable {name} Component",
+                    )
+                    ignore_options(f"--{name}-")
+        except BaseException:
+            self._stack.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._stack.__exit__(exc_type, exc_val, exc_tb)
+
+    @property
+    def components(self) -> Dict[str, Component]:
+        """Enabled components by name, in collection order"""
+        return self._components
+
+    @property
+    def names(self) -> List[str]:
+        """Every registered component, enabled or not"""
+        return list(self._table)
@@ -0,0 +1,103 @@
+"""
+Volatility classes of collected values and their refresh intervals
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from typing import Any, Callable, Dict, Tuple
+import math
+import time
+
+# read once, e.g. GPU UUIDs
+STATIC = "static"
+# change rarely or only through control, e.g. governors and power limits
+SLOW = "slow"
+# change all the time, e.g. utilization and power draw
+FAST = "fast"
+
+intervals: Dict[str, float] = {STATIC: math.inf, SLOW: 60.0, FAST: 0.0}
+overrides: Dict[Tuple[str, str], float] = {}
+
+
+def add_volatility_options():
+    """Add Volatility Options"""
+    add_option(
+        "--volatility-slow",
+        type=float,
+        default=intervals[SLOW],
+        help="Seconds between refreshes of slowly changing values",
+    )
+    add_option(
+        "--volatility-fast",
+        type=float,
+        default=intervals[FAST],
+        help="Seconds between refreshes of fast changing values, 0 refreshes on every update",
+    )
+    add_option(
+        "--volatility-intervals",
+        type=str,
+        default="",
+        help="Per component class intervals in seconds, e.g. bmc.slow=300,nvgpu.static=3600",
+    )
+
+
+def setup_volatility():
+    """Use the volatility options, call after parse_args"""
+    intervals[SLOW] = get_arg("volatility_slow")
+    intervals[FAST] = get_arg("volatility_fast")
+    overrides.clear()
+    for i in get_arg("volatility_intervals").split(","):
+        if i == "":
+            continue
+        try:
+            key, seconds = i.split("=")
+            component, cls = key.strip().split(".")
+            if cls not in intervals:
+                raise ValueError(cls)
+            overrides[(component, cls)] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignore invalid volatility interval: {i}")
+
+
+class Cadence:
+    """Cached values of one component, each refreshed at the interval of its class
+
+    Args:
+        component (str): component name, for per component intervals
+        items (Dict[str, str]): volatility class of each item
+    """
+
+    def __init__(self, component: str, items: Dict[str, str]) -> None:
+        self._component = component
+        self._items = items
+        self._values: Dict[tuple, Any] = {}
+        self._refreshed: Dict[tuple, float] = {}
+
+    def interval(self, item: str) -> float:
+        cls = self._items[item]
+        return overrides.get((self._component, cls), intervals[cls])
+
+    def get(self, item: str, fn: Callable[[], Any], *key) -> Any:
+        """Value of an item, from fn() only if it is due
+
+        Args:
+            item (str): declared item
+            fn (Callable[[], Any]): reads the value, errors are raised and nothing is cached
+            key: tells apart values of one item, e.g. a device index
+
+        Returns:
+            Any: fresh or cached value
+        """
+        k = (item,) + key
+        now = time.monotonic()
+        refreshed = self._refreshed.get(k)
+        if refreshed is None or now - refreshed >= self.interval(item):
+            self._values[k] = fn()
+            self._refreshed[k] = now
+        return self._values[k]
+
+    def invalidate(self, *items: str):
+        """Refresh items on their next get, all of them if none are given"""
+        for k in list(self._refreshed):
+            if not items or k[0] in items:
+                del self._refreshed[k]
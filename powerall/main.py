@@ -4,54 +4,93 @@
 Deploy on single node
 """
 
-from typing import Dict
+from typing import Dict, Iterator, Optional, Tuple
 from opts.argsopt import *
 from opts.logopt import *
+from opts.pathopt import *
 from flask import Response, Flask, request, jsonify
-from components.cpu import CPU
-from components.nvgpu import NVGPU
-from components.bmc import BMC
-from components.disk import DISK
-from components.hwmon import HWMON
-from components.mem import MEM
-from components.process import PROCESS
 from components.component import Component
+from components.capture import capture
+from components.registry import Registry
+from components.volatility import add_volatility_options, setup_volatility
+from scrape.scheduler import Scheduler
+from scrape.parallel import Parallel
+from scrape.coalesce import SingleFlight
+from scrape.encoding import Compression
+from scrape.formats import Formats, content_types, TEXT
+from scrape.serving import Server
+from scrape.instrument import Instrumentation
+from scrape.profiling import Profiling
+from scrape.readiness import Readiness
+from scrape.breaker import Breakers
+from scrape.sampler import Sampler
+from scrape.history import History
+from scrape.energy import Energy
+from scrape.jobs import Jobs
+from scrape.recorder import Recorder
 from prometheus_client import Info, generate_latest
 import os
+import signal
 import socket
+import sys
+import time
 
 # Set basic args
 add_option("-s", "--server", type=str, default="127.0.0.1", help="Specify server")
 add_option("-p", "--port", type=int, default=8082, help="Specify metrics port")
 add_option("--debug", type=bool, default=False, help="Enable Debug Mode")
+add_path_options()
+add_volatility_options()
 add_option(
     "--cluster",
     type=str,
     default="powerall",
     help="Set controller/collector in which cluster",
 )
+add_option(
+    "--collect-mode",
+    type=str,
+    default="sync",
+    choices=["sync", "parallel", "background"],
+    help="Update components one by one (sync) or all at once (parallel) while serving /metrics, or in background threads",
+)
+add_option(
+    "--stream-metrics",
+    type=bool,
+    default=False,
+    help="Send /metrics in chunks, each component as soon as it finishes",
+)
 
 app = Flask(__name__)
 
-# Init components and execute __enter__ steps
-with CPU() as cpu, NVGPU() as nvgpu, BMC() as bmc, DISK() as disk, HWMON() as hwmon, MEM() as mem, PROCESS() as process:
+# Init enabled components and execute __enter__ steps
+with capture, Registry() as registry, Scheduler() as scheduler, Parallel() as parallel, SingleFlight() as singleflight, Compression() as compression, Server() as server, Instrumentation() as instrument, Profiling() as profiling, Readiness() as readiness, Breakers() as breakers, Sampler() as sampler, History() as history, Energy() as energy, Jobs() as jobs, Recorder() as recorder:
     # Init components
-    components: Dict[str, Component] = {
-        "cpu": cpu,
-        "nvgpu": nvgpu,
-        "bmc": bmc,
-        "disk": disk,
-        "hwmon": hwmon,
-        "mem": mem,
-        "process": process,
-    }
+    components: Dict[str, Component] = registry.components
 
     # Parse args
     parse_args()
+    setup_paths()
+    # Record or replay raw inputs before components read any
+    capture.setup()
 
     # Set up logger
     host, port, debug = get_arg("server"), get_arg("port"), get_arg("debug")
+    collect_mode = get_arg("collect_mode")
+    stream_metrics = get_arg("stream_metrics")
     setup_logger(debug)
+    setup_volatility()
+    def terminate(signum, frame):
+        """Unwind the with block on SIGTERM like on Ctrl-C, so helpers finish their files
+
+        Only the first SIGTERM exits, a second one, e.g. from a service
+        manager stopping the whole process group, would raise SystemExit
+        again inside the __exit__ of a helper and cut its cleanup short.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
 
     # Set up uname info
     uname = os.uname()
@@ -75,26 +114,209 @@ with CPU() as cpu, NVGPU() as nvgpu, BMC() as bmc, DISK() as disk, HWMON() as hw
 
     const_output = generate_latest(uname_info)
 
-    for c in components.values():
-        c.setup()
+    singleflight.setup()
+    compression.setup()
+    server.setup()
+    profiling.setup()
+    instrument.setup(profiling)
+    breakers.setup(instrument)
+    # Set up components concurrently, serve the ready ones meanwhile
+    readiness.setup(components, instrument)
+    energy.setup(components, readiness, sampler)
+    jobs.setup(components, readiness, sampler, energy)
+    sampler.setup(components, readiness)
+    formats = Formats()
+    if collect_mode == "background":
+        scheduler.setup(components, instrument, readiness, breakers)
+    elif collect_mode == "parallel":
+        parallel.setup(components, instrument, breakers)
+    history.setup(components, readiness, breakers, collect_mode != "background")
+    recorder.setup(components, readiness, breakers, collect_mode != "background")
 
-    @app.route("/metrics")
-    def monitor():
-        """Set Monitor Route
+    def select(collect: list, exclude: list) -> Tuple[str, ...]:
+        """Components selected by collect[] and exclude[] of a scrape
+
+        Args:
+            collect (list): components to update, empty for all
+            exclude (list): components not to update
+
+        Raises:
+            ValueError: both filters are given, or a component is unknown
 
         Returns:
-            _type_: _description_
+            Tuple[str, ...]: selected ready components in the order of components
+        """
+        if collect and exclude:
+            raise ValueError("collect[] and exclude[] can't be used together")
+        for name in collect + exclude:
+            if name not in registry.names:
+                raise ValueError(f"Not support component {name}")
+        if collect:
+            return readiness.filter(tuple(n for n in components.keys() if n in collect))
+        return readiness.filter(tuple(n for n in components.keys() if n not in exclude))
+
+    def stream(budget: Optional[float], names: Tuple[str, ...]) -> Iterator[bytes]:
+        """Outputs of the selected components in the chosen collect mode, one by one
+
+        Args:
+            budget (Optional[float]): seconds the parallel mode may wait
+            names (Tuple[str, ...]): components to update
+
+        Yields:
+            bytes: output of one component
         """
-        output = const_output
+        if collect_mode == "background":
+            yield from scheduler.stream(names)
+            return
+        if collect_mode == "parallel":
+            yield from parallel.stream(budget, names)
+            return
         logger.warning(f"Start Update")
-        for c in components.values():
-            upds = c.update()
+        for name in names:
+            c = components[name]
+            try:
+                upds = breakers.update(name, c)
+            except Exception as e:
+                logger.warning(f"Component {name} update failed: {e}")
+                continue
             if upds is not None and isinstance(upds, bytes):
-                output += upds
+                yield upds
             else:
                 logger.warning(f"Component {c.name} didn't capture output of monitor")
         logger.warning(f"End Update")
-        return Response(output, mimetype="text/plain")
+
+    def collect(budget: Optional[float], names: Tuple[str, ...]) -> bytes:
+        """Collect outputs of the selected components in the chosen collect mode
+
+        Args:
+            budget (Optional[float]): seconds the parallel mode may wait
+            names (Tuple[str, ...]): components to update
+
+        Returns:
+            bytes: outputs of the selected components
+        """
+        return b"".join(stream(budget, names))
+
+    def stream_response(
+        budget: Optional[float],
+        names: Tuple[str, ...],
+        encoding: Optional[str],
+        window: str,
+        start: float,
+    ) -> Response:
+        """Chunked /metrics response written while components finish
+
+        Streamed scrapes skip SingleFlight, parallel updates in flight are
+        still shared, see Parallel.submit.
+        """
+
+        def chunks():
+            yield const_output
+            yield from stream(budget, names)
+            yield sampler.metrics(names, window) + energy.metrics(names)
+            yield compression.metrics() + instrument.metrics() + breakers.metrics()
+            instrument.scrape(time.perf_counter() - start)
+
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        body = chunks()
+        if encoding is not None:
+            body = compression.compress_stream(body, encoding)
+            headers["Content-Encoding"] = encoding
+        return Response(body, content_type=content_types[TEXT], headers=headers)
+
+    @app.route("/metrics")
+    def monitor():
+        """Set Monitor Route
+
+        Only the components selected by collect[] or exclude[] are
+        updated. Concurrent scrapes of the same selection share one
+        collection, see SingleFlight, and its converted and compressed
+        forms, see Formats and Compression. Sampler windows are kept per
+        scraper, named by the window parameter or else the remote address.
+
+        Returns:
+            _type_: _description_
+        """
+        start = time.perf_counter()
+        try:
+            names = select(
+                request.args.getlist("collect[]"), request.args.getlist("exclude[]")
+            )
+        except ValueError as e:
+            logger.warning(f"Invalid component filter: {e}")
+            return Response(str(e), status=400, mimetype="text/plain")
+        budget = None
+        if collect_mode == "parallel":
+            budget = parallel.budget(
+                request.headers.get("X-Prometheus-Scrape-Timeout-Seconds")
+            )
+        fmt = formats.negotiate(request.headers.get("Accept"))
+        encoding = compression.negotiate(request.accept_encodings)
+        window = request.args.get("window") or request.remote_addr or ""
+        # other formats are converted from the whole text output
+        if stream_metrics and fmt == TEXT:
+            return stream_response(budget, names, encoding, window, start)
+        # scrapers share the collection, each gets its own sampler window
+        output = singleflight.do(
+            ("metrics", names),
+            lambda: const_output
+            + collect(budget, names)
+            + energy.metrics(names)
+            + compression.metrics()
+            + instrument.metrics()
+            + breakers.metrics(),
+        ) + sampler.metrics(names, window)
+        output = formats.render(output, fmt)
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if encoding is not None:
+            output = compression.compress(output, encoding)
+            headers["Content-Encoding"] = encoding
+        instrument.scrape(time.perf_counter() - start)
+        return Response(output, content_type=content_types[fmt], headers=headers)
+
+    @app.route("/debug/profile")
+    def debug_profile():
+        """Profile the running agent
+
+        ?seconds=N&mode=sample|cprofile&format=collapsed|pstats|text
+
+        Returns:
+            _type_: _description_
+        """
+        if not profiling.enabled:
+            return Response("Profiling is disabled", status=404, mimetype="text/plain")
+        try:
+            body, content_type = profiling.profile(
+                request.args.get("seconds", 10.0, type=float),
+                request.args.get("mode", "sample"),
+                request.args.get("format"),
+            )
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype="text/plain")
+        except RuntimeError as e:
+            return Response(str(e), status=409, mimetype="text/plain")
+        return Response(body, content_type=content_type)
+
+    @app.route("/debug/heap")
+    def debug_heap():
+        """Top allocations and growth since the baseline
+
+        ?limit=N&key=lineno|filename|traceback&baseline=1
+
+        Returns:
+            _type_: _description_
+        """
+        if not profiling.enabled:
+            return Response("Profiling is disabled", status=404, mimetype="text/plain")
+        try:
+            report = profiling.heap(
+                request.args.get("limit", 25, type=int),
+                request.args.get("key", "lineno"),
+                request.args.get("baseline", "") not in ("", "0", "false"),
+            )
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype="text/plain")
+        return Response(report, mimetype="text/plain")
 
     @app.route("/api/control/<component>")
     def control(component):
@@ -110,7 +332,10 @@ with CPU() as cpu, NVGPU() as nvgpu, BMC() as bmc, DISK() as disk, HWMON() as hw
         result = {}
 
         try:
-            result = components[component].control(values)
+            if readiness.ready(component):
+                result = components[component].control(values)
+            else:
+                result = {"error": f"Component {components[component].name} not ready"}
         except KeyError:
             logger.warning("Not support component")
             result["error"] = "Not support component"
@@ -131,13 +356,90 @@ with CPU() as cpu, NVGPU() as nvgpu, BMC() as bmc, DISK() as disk, HWMON() as hw
         result = {}
 
         try:
-            result = components[component].get_attrs(values)
+            if readiness.ready(component):
+                result = components[component].get_attrs(values)
+            else:
+                result = {"error": f"Component {components[component].name} not ready"}
         except KeyError as e:
             logger.warning("Not support component")
             result["error"] = "Not support component"
 
         return jsonify(result)
 
+    @app.route("/api/history")
+    def history_query():
+        """Recorded history of collected series
+
+        ?series=<selector>&from=<unix time>&to=<unix time>&step=<seconds>,
+        series is repeatable, e.g. nvgpu_power{mode="usage"}. The result
+        is shaped like a Prometheus range query.
+
+        Returns:
+            _type_: matrix of the selected series, 400 on invalid arguments
+        """
+        if not history.enabled:
+            return Response("History is disabled", status=404, mimetype="text/plain")
+        try:
+            result = history.query(
+                request.args.getlist("series"),
+                request.args.get("from"),
+                request.args.get("to"),
+                request.args.get("step"),
+            )
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+        return jsonify(
+            {"status": "success", "data": {"resultType": "matrix", "result": result}}
+        )
+
+    def job_response(action, job: str):
+        """Report of a job after action(job), errors as JSON"""
+        if not jobs.enabled:
+            return Response("Jobs are disabled", status=404, mimetype="text/plain")
+        try:
+            return jsonify(action(job))
+        except KeyError:
+            return jsonify({"error": f"Unknown job {job}"}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
+
+    @app.route("/api/jobs/<job>/start", methods=["GET", "POST"])
+    def job_start(job):
+        """Start accounting a job, e.g. from a scheduler prolog
+
+        Returns:
+            _type_: report of the job, 409 if it is running
+        """
+        return job_response(jobs.start, job)
+
+    @app.route("/api/jobs/<job>/stop", methods=["GET", "POST"])
+    def job_stop(job):
+        """Stop accounting a job, e.g. from a scheduler epilog
+
+        Returns:
+            _type_: report of the job, 404 if it is unknown, 409 if it is finished
+        """
+        return job_response(jobs.stop, job)
+
+    @app.route("/api/jobs/<job>")
+    def job_report(job):
+        """Energy, average and peak power of each component and seconds in each state of a job
+
+        Returns:
+            _type_: report of the job, 404 if it is unknown
+        """
+        return job_response(jobs.report, job)
+
+    @app.route("/ready")
+    def ready():
+        """Readiness of each component
+
+        Returns:
+            _type_: 200 once no component setup is pending, 503 before
+        """
+        done, states = readiness.status()
+        return jsonify({"ready": done, "components": states}), 200 if done else 503
+
     @app.route("/api/components")
     def GetComponents():
         """Get Support Components
@@ -149,5 +451,4 @@ with CPU() as cpu, NVGPU() as nvgpu, BMC() as bmc, DISK() as disk, HWMON() as hw
         return jsonify(lists)
 
     if __name__ == "__main__":
-        logger.warning(f"Running on http://{host}:{port}")
-        app.run(host, port, debug)
+        server.serve(app, host, port, debug)
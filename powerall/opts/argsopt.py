@@ -6,6 +6,7 @@ from argparse import ArgumentParser
 from .logopt import *
 
 called_parse_args = False
+ignored_prefixes = []
 parser = ArgumentParser(
     description="PowerAll",
 )
@@ -18,6 +19,13 @@ def add_option(*args, **kwargs):
 
     parser.add_argument(*args, **kwargs)
 
+def ignore_options(prefix: str):
+    """Ignore Options
+    Options starting with prefix are accepted and dropped by parse_args,
+    e.g. options of a component that is disabled and never added them.
+    """
+    ignored_prefixes.append(prefix)
+
 def parse_args():
     """Parse Args
     Once args are parsed, call get_arg next.
@@ -25,7 +33,20 @@ def parse_args():
     global called_parse_args
     called_parse_args = True
     global args
-    args = parser.parse_args()
+    args, unknown = parser.parse_known_args()
+    rest = []
+    skip_value = False
+    for arg in unknown:
+        if skip_value and not arg.startswith("-"):
+            skip_value = False
+            continue
+        ignored = arg.startswith(tuple(ignored_prefixes))
+        # a value given as the next argument, like --bmc-host 10.0.0.1
+        skip_value = ignored and "=" not in arg
+        if not ignored:
+            rest.append(arg)
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
 
 def get_arg(arg_name: str) -> any:
     return getattr(args, arg_name)
@@ -0,0 +1,41 @@
+"""
+Root paths of procfs, sysfs and udev data
+"""
+
+from .argsopt import *
+import os
+
+procfs = "/proc"
+sysfs = "/sys"
+udev_data = "/run/udev/data"
+
+
+def add_path_options():
+    """Add Path Options"""
+    add_option("--path-procfs", type=str, default=procfs, help="procfs mountpoint")
+    add_option("--path-sysfs", type=str, default=sysfs, help="sysfs mountpoint")
+    add_option(
+        "--path-udev-data", type=str, default=udev_data, help="udev data directory"
+    )
+
+
+def setup_paths():
+    """Use the path options, call after parse_args"""
+    set_paths(get_arg("path_procfs"), get_arg("path_sysfs"), get_arg("path_udev_data"))
+
+
+def set_paths(proc: str, sys: str, udev: str):
+    global procfs, sysfs, udev_data
+    procfs, sysfs, udev_data = proc, sys, udev
+
+
+def procfs_path(*parts: str) -> str:
+    return os.path.join(procfs, *parts)
+
+
+def sysfs_path(*parts: str) -> str:
+    return os.path.join(sysfs, *parts)
+
+
+def udev_data_path(*parts: str) -> str:
+    return os.path.join(udev_data, *parts)
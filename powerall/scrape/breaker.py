@@ -0,0 +1,176 @@
+"""
+Per component circuit breakers with exponential backoff
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import Counter, Gauge, generate_latest
+from components.component import Component
+from scrape.instrument import Instrumentation
+from typing import Dict, Optional
+import threading
+import time
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+
+class Circuit:
+    """Breaker state of one component"""
+
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.last_good: Optional[bytes] = None
+
+
+class Breakers:
+    def __init__(self) -> None:
+        self._name = "breaker"
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, Circuit] = {}
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-failures",
+            type=int,
+            default=3,
+            help="Consecutive failed updates that open the circuit of a component, 0 never opens",
+        )
+        add_option(
+            f"--{self._name}-backoff",
+            type=float,
+            default=5.0,
+            help="Seconds an open circuit waits before probing the hardware again",
+        )
+        add_option(
+            f"--{self._name}-max-backoff",
+            type=float,
+            default=300.0,
+            help="Upper bound of the backoff, which doubles after every failed probe",
+        )
+        return self
+
+    def setup(self, instrument: Instrumentation):
+        self._instrument = instrument
+        self._failures = get_arg(f"{self._name}_failures")
+        self._backoff = get_arg(f"{self._name}_backoff")
+        self._max_backoff = get_arg(f"{self._name}_max_backoff")
+        self._state_g = Gauge(
+            "powerall_exporter_circuit_state",
+            "Circuit breaker of a component, 0 closed, 1 open, 2 half-open.",
+            ["component"],
+        )
+        self._failures_g = Gauge(
+            "powerall_exporter_circuit_failures",
+            "Consecutive failed updates of a component.",
+            ["component"],
+        )
+        self._backoff_g = Gauge(
+            "powerall_exporter_circuit_backoff_seconds",
+            "Seconds an open circuit waits between probes.",
+            ["component"],
+        )
+        self._opened = Counter(
+            "powerall_exporter_circuit_opened",
+            "Times the circuit of a component opened.",
+            ["component"],
+        )
+        self._stale = Gauge(
+            "powerall_exporter_circuit_stale",
+            "1 if the last good output of a component was served instead of a fresh one.",
+            ["component"],
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def update(self, name: str, c: Component) -> Optional[bytes]:
+        """Update a component through its circuit
+
+        While the circuit is open the hardware is left alone and the last
+        good output is served, flagged stale. After the backoff one update
+        probes the hardware, a success closes the circuit.
+
+        Args:
+            name (str): component name
+            c (Component): component to update
+
+        Returns:
+            Optional[bytes]: fresh or last good output, errors are raised
+            again while the circuit is closed and there is nothing to serve
+        """
+        with self._lock:
+            circuit = self._circuits.setdefault(name, Circuit())
+            if circuit.state != CLOSED:
+                if circuit.state == HALF_OPEN or time.monotonic() < circuit.retry_at:
+                    self._instrument.skip(name, "circuit_open")
+                    self._stale.labels(component=name).set(1)
+                    return circuit.last_good
+                circuit.state = HALF_OPEN
+                self._state_g.labels(component=name).set(HALF_OPEN)
+        try:
+            upds = self._instrument.update(name, c)
+        except Exception as e:
+            if self.failed(name, circuit, e) and circuit.last_good is not None:
+                self._stale.labels(component=name).set(1)
+                return circuit.last_good
+            raise
+        self.succeeded(name, circuit, upds)
+        return upds
+
+    def failed(self, name: str, circuit: Circuit, error: Exception) -> bool:
+        """Count a failed update
+
+        Returns:
+            bool: the circuit is open now
+        """
+        with self._lock:
+            circuit.failures += 1
+            self._failures_g.labels(component=name).set(circuit.failures)
+            if circuit.state == HALF_OPEN:
+                circuit.backoff = min(circuit.backoff * 2, self._max_backoff)
+            elif self._failures > 0 and circuit.failures >= self._failures:
+                circuit.backoff = self._backoff
+                self._opened.labels(component=name).inc()
+                logger.warning(f"Circuit of component {name} opened: {error}")
+            else:
+                return False
+            circuit.state = OPEN
+            circuit.retry_at = time.monotonic() + circuit.backoff
+            self._state_g.labels(component=name).set(OPEN)
+            self._backoff_g.labels(component=name).set(circuit.backoff)
+            return True
+
+    def succeeded(self, name: str, circuit: Circuit, upds: Optional[bytes]):
+        with self._lock:
+            if circuit.state != CLOSED:
+                logger.warning(f"Circuit of component {name} closed")
+            circuit.state = CLOSED
+            circuit.failures = 0
+            if upds is not None and isinstance(upds, bytes):
+                circuit.last_good = upds
+            self._state_g.labels(component=name).set(CLOSED)
+            self._failures_g.labels(component=name).set(0)
+            self._backoff_g.labels(component=name).set(0)
+            self._stale.labels(component=name).set(0)
+
+    def metrics(self) -> bytes:
+        """Breaker state of every component
+
+        Returns:
+            bytes: text exposition of all breaker metrics
+        """
+        return b"".join(
+            generate_latest(m)
+            for m in (
+                self._state_g,
+                self._failures_g,
+                self._backoff_g,
+                self._opened,
+                self._stale,
+            )
+        )
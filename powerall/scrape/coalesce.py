@@ -0,0 +1,76 @@
+"""
+Single-flight coalescing of concurrent scrapes
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from typing import Callable, Dict, Hashable
+import threading
+import time
+
+
+class Call:
+    """One collection, shared by every scrape that arrives while it runs"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.output = None
+        self.error = None
+        self.finished = 0.0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._name = "singleflight"
+        self._calls: Dict[Hashable, Call] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-ttl",
+            type=float,
+            default=0.5,
+            help="Seconds a finished collection is reused by later scrapes, 0 only shares in-flight ones",
+        )
+        return self
+
+    def setup(self):
+        self._ttl = get_arg(f"{self._name}_ttl")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def do(self, key: Hashable, fn: Callable[[], bytes]) -> bytes:
+        """Run fn, unless the same key is in flight or finished within the TTL
+
+        Args:
+            key (Hashable): identifies scrapes that may share output
+            fn (Callable[[], bytes]): collection to run
+
+        Returns:
+            bytes: output of the shared collection
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and (
+                not call.done.is_set()
+                or (call.error is None and time.monotonic() - call.finished < self._ttl)
+            ):
+                leader = False
+            else:
+                call = Call()
+                self._calls[key] = call
+                leader = True
+        if leader:
+            try:
+                call.output = fn()
+            except Exception as e:
+                call.error = e
+            call.finished = time.monotonic()
+            call.done.set()
+        else:
+            logger.debug(f"Scrape {key} attached to a shared collection")
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.output
@@ -0,0 +1,162 @@
+"""
+Content-Encoding negotiation and compression of /metrics
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import Gauge, Histogram, generate_latest
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+import gzip
+import hashlib
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compressed outputs kept, scrapers with their own sampler window each get one
+cache_entries = 16
+
+
+class Compression:
+    def __init__(self) -> None:
+        self._name = "compression"
+        # (encoding, digest of the output) -> compressed output, least recent first
+        self._cache: OrderedDict[Tuple[str, bytes], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-enable",
+            type=bool,
+            default=True,
+            help="Compress /metrics when the scraper accepts gzip or zstd",
+        )
+        add_option(
+            f"--{self._name}-level",
+            type=int,
+            default=6,
+            help="gzip compression level, 1 (fast) to 9 (small)",
+        )
+        add_option(
+            f"--{self._name}-zstd-level",
+            type=int,
+            default=3,
+            help="zstd compression level, used when zstandard is installed",
+        )
+        return self
+
+    def setup(self):
+        self._enabled = get_arg(f"{self._name}_enable")
+        self._level = get_arg(f"{self._name}_level")
+        self._zstd_level = get_arg(f"{self._name}_zstd_level")
+        self._encodings = ["gzip"]
+        if zstandard is not None:
+            self._encodings.insert(0, "zstd")
+        self._seconds = Histogram(
+            "powerall_exporter_compression_seconds",
+            "Time spent compressing /metrics output.",
+            ["encoding"],
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+        )
+        self._ratio = Gauge(
+            "powerall_exporter_compression_ratio",
+            "Uncompressed size divided by compressed size of the last compressed output.",
+            ["encoding"],
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def negotiate(self, accept_encodings) -> Optional[str]:
+        """Pick the encoding the scraper prefers among the supported ones
+
+        Args:
+            accept_encodings: parsed Accept-Encoding header, see werkzeug Accept
+
+        Returns:
+            Optional[str]: encoding to use, None to send identity
+        """
+        if not self._enabled:
+            return None
+        return accept_encodings.best_match(self._encodings)
+
+    def compress(self, output: bytes, encoding: str) -> bytes:
+        """Compress output, reusing the result for the same output
+
+        Outputs are compressed outside of the lock, so scrapers with
+        different outputs compress in parallel.
+
+        Args:
+            output (bytes): /metrics output
+            encoding (str): negotiated encoding
+
+        Returns:
+            bytes: compressed output
+        """
+        key = (encoding, hashlib.blake2b(output, digest_size=16).digest())
+        with self._lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                return compressed
+        start = time.perf_counter()
+        if encoding == "zstd":
+            compressed = zstandard.ZstdCompressor(level=self._zstd_level).compress(
+                output
+            )
+        else:
+            compressed = gzip.compress(output, compresslevel=self._level, mtime=0)
+        self._seconds.labels(encoding=encoding).observe(time.perf_counter() - start)
+        self._ratio.labels(encoding=encoding).set(len(output) / max(1, len(compressed)))
+        with self._lock:
+            self._cache[key] = compressed
+            if len(self._cache) > cache_entries:
+                self._cache.popitem(last=False)
+        return compressed
+
+    def compress_stream(self, chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        """Compress chunks as they come, flushing after each one
+
+        Args:
+            chunks (Iterable[bytes]): /metrics output in parts
+            encoding (str): negotiated encoding
+
+        Yields:
+            bytes: compressed data up to the end of each chunk
+        """
+        if encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self._zstd_level).compressobj()
+            flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            # wbits 31 writes a gzip header and trailer
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+            flush_mode = zlib.Z_SYNC_FLUSH
+        elapsed, size, compressed_size = 0.0, 0, 0
+        for chunk in chunks:
+            start = time.perf_counter()
+            out = compressor.compress(chunk) + compressor.flush(flush_mode)
+            elapsed += time.perf_counter() - start
+            size += len(chunk)
+            compressed_size += len(out)
+            if out:
+                yield out
+        out = compressor.flush()
+        compressed_size += len(out)
+        self._seconds.labels(encoding=encoding).observe(elapsed)
+        self._ratio.labels(encoding=encoding).set(size / max(1, compressed_size))
+        yield out
+
+    def metrics(self) -> bytes:
+        """Compression self-metrics
+
+        Returns:
+            bytes: compression time and ratio of earlier scrapes
+        """
+        if not self._enabled:
+            return b""
+        return generate_latest(self._seconds) + generate_latest(self._ratio)
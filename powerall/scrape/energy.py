@@ -0,0 +1,241 @@
+"""
+Energy counters integrated from sampled power, checkpointed across restarts
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from components.component import Component, Signal
+from scrape.readiness import Readiness
+from scrape.sampler import Sampler
+from typing import Dict, Optional, Sequence, Tuple
+import json
+import os
+import threading
+import time
+
+
+class Meter:
+    """Energy of one series
+
+    joules only grows. A hardware counter is followed by its last reading
+    hw, which also counts the energy used while the agent was down. Else
+    power samples are integrated with the trapezoidal rule.
+    """
+
+    def __init__(self, joules: float = 0.0, hw: Optional[float] = None) -> None:
+        self.joules = joules
+        self.hw = hw
+        self.last: Optional[Tuple[float, float]] = None
+
+    def sample(self, t: float, watts: float):
+        if self.last is not None and t > self.last[0]:
+            self.joules += (t - self.last[0]) * (watts + self.last[1]) / 2
+        self.last = (t, watts)
+
+    def counter(self, hw: float):
+        if self.hw is not None and hw >= self.hw:
+            self.joules += hw - self.hw
+        elif self.hw is not None:
+            # counter reset with the driver, count from 0
+            self.joules += hw
+        self.hw = hw
+
+
+class Energy:
+    def __init__(self) -> None:
+        self._name = "energy"
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._scrape_lock = threading.Lock()
+        self._names: Optional[Sequence[str]] = None
+        self._meters: Dict[str, Dict[str, Meter]] = {}
+        self._labels: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-file",
+            type=str,
+            default="",
+            help="State file of the energy counters, empty disables energy counters",
+        )
+        add_option(
+            f"--{self._name}-signals",
+            type=str,
+            default="nvgpu.power,bmc.power",
+            help="Power signals integrated into energy counters, sampled at their sampler rate",
+        )
+        add_option(
+            f"--{self._name}-checkpoint",
+            type=float,
+            default=30.0,
+            help="Seconds between two writes of the state file",
+        )
+        add_option(
+            f"--{self._name}-interval",
+            type=float,
+            default=1.0,
+            help="Seconds between two reads of the hardware energy counters, scrapes serve the last read",
+        )
+        return self
+
+    def setup(
+        self, components: Dict[str, Component], readiness: Readiness, sampler: Sampler
+    ):
+        """Load the state file and subscribe to the power signals, call before sampler.setup
+
+        Args:
+            components (Dict[str, Component]): components measured, by name
+            readiness (Readiness): hardware counters are read once a component is ready
+            sampler (Sampler): samples the power signals
+        """
+        self._path = get_arg(f"{self._name}_file")
+        self.enabled = self._path != ""
+        if not self.enabled:
+            return
+        self._components = components
+        self._readiness = readiness
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+            for name, meters in state.items():
+                self._labels[name] = meters.pop("__label__", "index")
+                self._meters[name] = {
+                    label: Meter(m["joules"], m.get("hw")) for label, m in meters.items()
+                }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Ignore invalid energy state {self._path}: {e}")
+            self._meters.clear()
+        for key in get_arg(f"{self._name}_signals").split(","):
+            key = key.strip()
+            name = key.partition(".")[0]
+            if name in components:
+                sampler.subscribe(
+                    key, lambda s, t, values, name=name: self.sample(name, s, t, values)
+                )
+        self._thread = threading.Thread(target=self.run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Write the final checkpoint, main.py turns SIGTERM into an exit to get here"""
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self.read_counters()
+        self.save()
+
+    def sample(self, name: str, s: Signal, t: float, values: Dict[str, float]):
+        """Integrate a read of a power signal, series with a hardware counter are skipped"""
+        if s.watts is None:
+            return
+        with self._lock:
+            self._labels[name] = s.label
+            meters = self._meters.setdefault(name, {})
+            for label, value in values.items():
+                meter = meters.get(label)
+                if meter is None:
+                    meter = meters[label] = Meter()
+                if meter.hw is None:
+                    meter.sample(t, value * s.watts)
+
+    def read_counters(self):
+        """Follow the hardware energy counters of the ready components"""
+        for name, c in self._components.items():
+            if not self._readiness.ready(name):
+                continue
+            try:
+                counters = c.energy()
+            except Exception as e:
+                logger.warning(f"Component {name} energy counters failed: {e}")
+                continue
+            if not counters:
+                continue
+            with self._lock:
+                meters = self._meters.setdefault(name, {})
+                for label, hw in counters.items():
+                    meter = meters.get(label)
+                    if meter is None:
+                        meter = meters[label] = Meter()
+                    meter.counter(hw)
+
+    def save(self):
+        """Write the state file, atomically"""
+        with self._lock:
+            state = {
+                name: dict(
+                    {label: {"joules": m.joules, "hw": m.hw} for label, m in meters.items()},
+                    __label__=self._labels.get(name, "index"),
+                )
+                for name, meters in self._meters.items()
+            }
+        try:
+            with open(f"{self._path}.tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(f"{self._path}.tmp", self._path)
+        except OSError as e:
+            logger.warning(f"Could not write energy state {self._path}: {e}")
+
+    def totals(self) -> Dict[str, float]:
+        """Joules of each component so far, as of the last read of the hardware counters"""
+        with self._lock:
+            return {
+                name: sum(m.joules for m in meters.values())
+                for name, meters in self._meters.items()
+            }
+
+    def run(self):
+        """Read the hardware counters and write checkpoints, off the scrape path
+
+        A slow driver call only delays this thread, scrapes and jobs keep
+        serving the last read.
+        """
+        interval = get_arg(f"{self._name}_interval")
+        checkpoint = get_arg(f"{self._name}_checkpoint")
+        saved = time.monotonic()
+        self.read_counters()
+        while not self._stop.wait(min(interval, checkpoint)):
+            self.read_counters()
+            if time.monotonic() - saved >= checkpoint:
+                self.save()
+                saved = time.monotonic()
+
+    def collect(self):
+        """Energy counters of the selected components, see CollectorRegistry"""
+        families = []
+        with self._lock:
+            for name, meters in self._meters.items():
+                if self._names is not None and name not in self._names:
+                    continue
+                energy_f = CounterMetricFamily(
+                    f"{name}_energy_joules",
+                    f"Energy used by {name} in joules, from hardware counters or integrated power samples.",
+                    labels=[self._labels.get(name, "index")],
+                )
+                for label, meter in sorted(meters.items()):
+                    energy_f.add_metric([label], meter.joules)
+                families.append(energy_f)
+        return families
+
+    def metrics(self, names: Optional[Sequence[str]] = None) -> bytes:
+        """Energy counters, as of the last read of the hardware counters
+
+        Args:
+            names (Optional[Sequence[str]]): components to include, None for all
+
+        Returns:
+            bytes: text exposition of the energy counters
+        """
+        if not self.enabled:
+            return b""
+        with self._scrape_lock:
+            self._names = names
+            return generate_latest(self._registry)
@@ -0,0 +1,273 @@
+"""
+Exposition formats of /metrics: classic text, OpenMetrics text and protobuf
+"""
+
+from prometheus_client.core import Metric
+from prometheus_client.openmetrics import exposition as openmetrics
+from prometheus_client.parser import text_string_to_metric_families
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import struct
+import threading
+
+TEXT = "text"
+OPENMETRICS = "openmetrics"
+PROTOBUF = "protobuf"
+
+content_types = {
+    TEXT: "text/plain; version=0.0.4; charset=utf-8",
+    OPENMETRICS: openmetrics.CONTENT_TYPE_LATEST,
+    PROTOBUF: "application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited",
+}
+
+# io.prometheus.client.MetricType
+proto_types = {
+    "counter": 0,
+    "gauge": 1,
+    "summary": 2,
+    "untyped": 3,
+    "unknown": 3,
+    "histogram": 4,
+    "gaugehistogram": 5,
+}
+
+# converted outputs kept, scrapers with their own sampler window each get one
+cache_entries = 16
+
+
+class Formats:
+    """Negotiate the exposition format and convert text snapshots to it
+
+    Components render the classic text format. Other formats are parsed
+    from it once per output and the result is kept by a digest of the
+    output, like the compressed output in Compression.
+    """
+
+    def __init__(self) -> None:
+        # (format, digest of the text output) -> formatted output, least recent first
+        self._cache: OrderedDict[Tuple[str, bytes], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def negotiate(self, accept: Optional[str]) -> str:
+        """Pick a format from the Accept header, highest q first
+
+        Args:
+            accept (Optional[str]): Accept header of the scrape
+
+        Returns:
+            str: one of TEXT, OPENMETRICS and PROTOBUF
+        """
+        best, best_q = TEXT, 0.0
+        for media_range in (accept or "").split(","):
+            parts = [p.strip() for p in media_range.split(";")]
+            params = dict(p.split("=", 1) for p in parts[1:] if "=" in p)
+            try:
+                q = float(params.get("q", "1"))
+            except ValueError:
+                continue
+            if parts[0] == "application/openmetrics-text":
+                fmt = OPENMETRICS
+            elif (
+                parts[0] == "application/vnd.google.protobuf"
+                and params.get("proto") == "io.prometheus.client.MetricFamily"
+                and params.get("encoding") == "delimited"
+            ):
+                fmt = PROTOBUF
+            else:
+                continue
+            if q > best_q:
+                best, best_q = fmt, q
+        return best
+
+    def render(self, output: bytes, fmt: str) -> bytes:
+        """Convert a text output, reusing the result for the same output
+
+        Outputs are converted outside of the lock, so scrapers with
+        different outputs convert in parallel.
+
+        Args:
+            output (bytes): /metrics output in the classic text format
+            fmt (str): negotiated format
+
+        Returns:
+            bytes: output in the negotiated format
+        """
+        if fmt == TEXT:
+            return output
+        key = (fmt, hashlib.blake2b(output, digest_size=16).digest())
+        with self._lock:
+            formatted = self._cache.get(key)
+            if formatted is not None:
+                self._cache.move_to_end(key)
+                return formatted
+        families = parse(output)
+        if fmt == OPENMETRICS:
+            formatted = openmetrics.generate_latest(Families(families))
+        else:
+            formatted = b"".join(encode_family(f) for f in families)
+        with self._lock:
+            self._cache[key] = formatted
+            if len(self._cache) > cache_entries:
+                self._cache.popitem(last=False)
+        return formatted
+
+
+class Families:
+    """Collector over already built families"""
+
+    def __init__(self, families: List[Metric]) -> None:
+        self._families = families
+
+    def collect(self):
+        return self._families
+
+
+def parse(output: bytes) -> List[Metric]:
+    """Parse the classic text format back into families
+
+    The text format splits some OpenMetrics types up: `<name>_created`
+    is its own gauge and info metrics are gauges named `<name>_info`.
+    Both are folded back into the family they belong to.
+    """
+    families = list(text_string_to_metric_families(output.decode("utf-8")))
+    by_name = {f.name: f for f in families}
+    ret = []
+    for f in families:
+        if f.type == "gauge" and f.name.endswith("_created"):
+            owner = by_name.get(f.name[: -len("_created")])
+            if owner is not None and owner.type in ("counter", "histogram", "summary"):
+                owner.samples.extend(f.samples)
+                continue
+        if (
+            f.type == "gauge"
+            and f.name.endswith("_info")
+            and f.samples
+            and all(s.value == 1 for s in f.samples)
+        ):
+            info = Metric(f.name[: -len("_info")], f.documentation, "info")
+            info.samples = f.samples
+            f = info
+        ret.append(f)
+    return ret
+
+
+def varint(n: int) -> bytes:
+    out = bytearray()
+    n &= (1 << 64) - 1
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def field_bytes(number: int, data: bytes) -> bytes:
+    return varint(number << 3 | 2) + varint(len(data)) + data
+
+
+def field_str(number: int, s: str) -> bytes:
+    return field_bytes(number, s.encode("utf-8"))
+
+
+def field_double(number: int, value: float) -> bytes:
+    return varint(number << 3 | 1) + struct.pack("<d", float(value))
+
+
+def field_varint(number: int, value: int) -> bytes:
+    return varint(number << 3) + varint(int(value))
+
+
+def field_timestamp(number: int, seconds: float) -> bytes:
+    # google.protobuf.Timestamp
+    secs = int(seconds)
+    return field_bytes(
+        number,
+        field_varint(1, secs) + field_varint(2, int((seconds - secs) * 1e9)),
+    )
+
+
+def encode_labels(labels: Dict[str, str]) -> bytes:
+    return b"".join(
+        field_bytes(1, field_str(1, k) + field_str(2, v)) for k, v in labels.items()
+    )
+
+
+def encode_family(f: Metric) -> bytes:
+    """Length delimited io.prometheus.client.MetricFamily
+
+    Args:
+        f (Metric): parsed family
+
+    Returns:
+        bytes: varint length followed by the encoded message
+    """
+    name, mtype = f.name, f.type
+    if mtype == "counter":
+        name = name + "_total"
+    elif mtype == "info":
+        name, mtype = name + "_info", "gauge"
+    elif mtype == "stateset":
+        mtype = "gauge"
+    metrics = []
+    if mtype in ("histogram", "gaugehistogram", "summary"):
+        # one metric per label set, buckets and quantiles folded into it
+        groups: Dict[Tuple, Dict] = {}
+        for s in f.samples:
+            labels = {k: v for k, v in s.labels.items() if k not in ("le", "quantile")}
+            g = groups.setdefault(tuple(sorted(labels.items())), {"labels": labels})
+            suffix = s.name[len(f.name) :]
+            if suffix == "_bucket":
+                g.setdefault("buckets", []).append((float(s.labels["le"]), s.value))
+            elif suffix == "" and "quantile" in s.labels:
+                g.setdefault("quantiles", []).append((float(s.labels["quantile"]), s.value))
+            else:
+                g[suffix] = s.value
+        for g in groups.values():
+            if mtype == "summary":
+                body = field_varint(1, g.get("_count", 0)) + field_double(2, g.get("_sum", 0))
+                for q, v in g.get("quantiles", []):
+                    body += field_bytes(3, field_double(1, q) + field_double(2, v))
+                if "_created" in g:
+                    body += field_timestamp(4, g["_created"])
+                value_field = field_bytes(4, body)
+            else:
+                count = g.get("_count", g.get("_gcount", 0))
+                body = field_varint(1, count) + field_double(2, g.get("_sum", g.get("_gsum", 0)))
+                for le, v in g.get("buckets", []):
+                    if le != float("inf"):
+                        body += field_bytes(3, field_varint(1, v) + field_double(2, le))
+                if "_created" in g:
+                    body += field_timestamp(15, g["_created"])
+                value_field = field_bytes(7, body)
+            metrics.append(encode_labels(g["labels"]) + value_field)
+    else:
+        created = {
+            tuple(sorted(s.labels.items())): s.value
+            for s in f.samples
+            if s.name == f.name + "_created"
+        }
+        for s in f.samples:
+            if s.name == f.name + "_created":
+                continue
+            if mtype == "counter":
+                body = field_double(1, s.value)
+                ts = created.get(tuple(sorted(s.labels.items())))
+                if ts is not None:
+                    body += field_timestamp(3, ts)
+                value_field = field_bytes(3, body)
+            elif mtype == "gauge":
+                value_field = field_bytes(2, field_double(1, s.value))
+            else:
+                value_field = field_bytes(5, field_double(1, s.value))
+            metric = encode_labels(s.labels) + value_field
+            if s.timestamp is not None:
+                metric += field_varint(6, int(float(s.timestamp) * 1000))
+            metrics.append(metric)
+    msg = field_str(1, name) + field_str(2, f.documentation)
+    msg += field_varint(3, proto_types.get(mtype, 3))
+    msg += b"".join(field_bytes(4, m) for m in metrics)
+    return varint(len(msg)) + msg
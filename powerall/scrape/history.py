@@ -0,0 +1,551 @@
+"""
+Local history of collected series, a memory-mapped head and compressed blocks
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from components.component import Component
+from scrape.readiness import Readiness
+from scrape.breaker import Breakers
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+# time column value of a slot never written
+EMPTY = 0xFFFFFFFF
+NAN = struct.pack("=d", math.nan)
+# value columns added to a file at once
+GROW = 64
+# slots of a block, the head holds the block being written and is sealed once full
+BLOCK = 64
+MAGIC = b"PAH1"
+
+
+def zigzag(n: int) -> int:
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def encode_times(times: Sequence[int]) -> bytes:
+    """Delta-of-delta of centisecond times, each a zigzag varint
+
+    Times of a regular interval take one byte each.
+    """
+    out = bytearray()
+    last = delta = 0
+    for t in times:
+        d = t - last
+        n = zigzag(d - delta)
+        while n >= 0x80:
+            out.append(n & 0x7F | 0x80)
+            n >>= 7
+        out.append(n)
+        last, delta = t, d
+    return bytes(out)
+
+
+def decode_times(data: bytes, n: int) -> List[int]:
+    times = []
+    pos = last = delta = 0
+    for _ in range(n):
+        z = shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            z |= (b & 0x7F) << shift
+            shift += 7
+            if b < 0x80:
+                break
+        delta += z >> 1 if z & 1 == 0 else -(z >> 1) - 1
+        last += delta
+        times.append(last)
+    return times
+
+
+def encode_values(values: array) -> bytes:
+    """float64 values, each XORed with the previous one
+
+    A header byte holds the leading zero bytes of the XOR and the count
+    of bytes that follow, trailing zero bytes are dropped, so a repeated
+    value takes one byte.
+    """
+    out = bytearray()
+    last = 0
+    for bits in memoryview(values.tobytes()).cast("Q"):
+        x = bits ^ last
+        last = bits
+        if x == 0:
+            out.append(0)
+            continue
+        lead = (64 - x.bit_length()) // 8
+        trail = ((x & -x).bit_length() - 1) // 8
+        size = 8 - lead - trail
+        out.append(lead << 4 | size)
+        out += (x >> 8 * trail).to_bytes(size, "big")
+    return bytes(out)
+
+
+def decode_values(data: bytes, n: int) -> array:
+    bits = array("Q", bytes(8 * n))
+    pos = last = 0
+    for i in range(n):
+        header = data[pos]
+        pos += 1
+        size = header & 0x0F
+        if size:
+            trail = 8 - (header >> 4) - size
+            last ^= int.from_bytes(data[pos : pos + size], "big") << 8 * trail
+            pos += size
+        bits[i] = last
+    return array("d", bits.tobytes())
+
+
+selector = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?$")
+matcher = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*(?:,|$)')
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def parse_selector(s: str) -> Tuple[str, Dict[str, str]]:
+    """name or name{label="value",...}, labels not given match any value
+
+    Raises:
+        ValueError: invalid selector
+    """
+    m = selector.match(s.strip())
+    if m is None:
+        raise ValueError(f"Invalid series selector {s}")
+    name, body = m.group(1), m.group(2) or ""
+    labels, pos = {}, 0
+    while pos < len(body):
+        lm = matcher.match(body, pos)
+        if lm is None or lm.end() == pos:
+            raise ValueError(f"Invalid series selector {s}")
+        labels[lm.group(1)] = lm.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        pos = lm.end()
+    return name, labels
+
+
+def downsample(
+    points: List[Tuple[float, float]], start: float, step: float
+) -> List[Tuple[float, float]]:
+    """Mean of the points in each step long bucket from start, 0 keeps every point"""
+    if step <= 0:
+        return points
+    buckets: Dict[int, List[float]] = {}
+    for t, v in points:
+        buckets.setdefault(int((t - start) // step), []).append(v)
+    return [(start + k * step, math.fsum(vs) / len(vs)) for k, vs in sorted(buckets.items())]
+
+
+class Store:
+    """History of one component, a ring of blocks of slots
+
+    The .head file holds the block being written in fixed width columns,
+    a time column of block * 4 bytes, the time of a slot as centiseconds
+    since base, then one column per series of block * 8 bytes of float64
+    values, NaN where a series had no sample. A full head is sealed into
+    the .<n>.blk file of its block, times as delta-of-delta varints and
+    each series XORed against its previous value, about 1 to 3 bytes per
+    sample of a steady series and at most 9. Blocks start on fixed slot
+    boundaries, so a query reads only the blocks of its range. The .json
+    file lists the series of each column.
+
+    Args:
+        path (str): file path without extension
+        slots (int): samples kept of each series, at least
+        max_series (int): series kept, later new ones are dropped
+    """
+
+    def __init__(self, path: str, slots: int, max_series: int) -> None:
+        self._path = path
+        self._block = min(BLOCK, slots)
+        # one more block, the one being refilled hides its sealed file
+        self._blocks = math.ceil(slots / self._block) + 1
+        self._width = 4 * self._block
+        self._value_width = 8 * self._block
+        self._max_series = max_series
+        self._lock = threading.Lock()
+        self._full = False
+        self.load()
+
+    def load(self):
+        meta = None
+        try:
+            with open(f"{self._path}.json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if (
+            meta is None
+            or meta.get("block") != self._block
+            or meta.get("blocks") != self._blocks
+            # files of earlier formats have no xor value field
+            or meta.get("value") != "xor"
+            or not os.path.exists(f"{self._path}.head")
+        ):
+            self.create()
+            return
+        self._base = meta["base"]
+        self._series: List[Key] = [
+            (name, tuple((k, v) for k, v in labels)) for name, labels in meta["series"]
+        ]
+        self._index = {key: i for i, key in enumerate(self._series)}
+        self._columns = meta["columns"]
+        self._head = meta["head"]
+        self._file = open(f"{self._path}.head", "r+b")
+        self._file.truncate(self.column(self._columns))
+        self._mm = mmap.mmap(self._file.fileno(), self.column(self._columns))
+        times = array("I", self._mm[: self._width])
+        # slots of the head are written in order
+        self._next = sum(1 for t in times if t != EMPTY)
+
+    def create(self):
+        for old in (f"{self._path}.col", f"{self._path}.head"):
+            if os.path.exists(old):
+                os.remove(old)
+        for k in range(self._blocks):
+            if os.path.exists(self.block_path(k)):
+                os.remove(self.block_path(k))
+        self._base = time.time()
+        self._series = []
+        self._index = {}
+        self._columns = 0
+        self._head = 0
+        self._next = 0
+        self._file = open(f"{self._path}.head", "w+b")
+        self._file.write(b"\xff" * self._width)
+        self._file.flush()
+        self._mm = mmap.mmap(self._file.fileno(), self._width)
+        self.save()
+
+    def column(self, i: int) -> int:
+        """Offset of the head value column of series i"""
+        return self._width + i * self._value_width
+
+    def block_path(self, k: int) -> str:
+        return f"{self._path}.{k}.blk"
+
+    def save(self):
+        meta = {
+            "block": self._block,
+            "blocks": self._blocks,
+            "value": "xor",
+            "base": self._base,
+            "columns": self._columns,
+            "head": self._head,
+            "series": [[name, list(labels)] for name, labels in self._series],
+        }
+        with open(f"{self._path}.json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{self._path}.json.tmp", f"{self._path}.json")
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+
+    def add(self, key: Key) -> bool:
+        """Give a new series a column
+
+        Returns:
+            bool: the series has a column
+        """
+        if len(self._series) >= self._max_series:
+            if not self._full:
+                logger.warning(f"History {self._path} keeps {self._max_series} series, drops new ones")
+                self._full = True
+            return False
+        if len(self._series) == self._columns:
+            self._mm.close()
+            offset = self.column(self._columns)
+            self._columns += GROW
+            self._file.truncate(self.column(self._columns))
+            self._mm = mmap.mmap(self._file.fileno(), self.column(self._columns))
+            self._mm[offset:] = NAN * (self._block * GROW)
+        self._index[key] = len(self._series)
+        self._series.append(key)
+        return True
+
+    def record(self, t: float, samples: Dict[Key, float]):
+        """Write one slot of the head, sealing it once full
+
+        Args:
+            t (float): unix time of the samples
+            samples (Dict[Key, float]): value of each series
+        """
+        with self._lock:
+            offset = round((t - self._base) * 100)
+            if not 0 <= offset < EMPTY:
+                self._mm.close()
+                self._file.close()
+                self.create()
+                offset = 0
+            added = False
+            for key in samples:
+                if key not in self._index:
+                    added = self.add(key) or added
+            if added:
+                self.save()
+            slot = self._next
+            struct.pack_into("=I", self._mm, 4 * slot, offset)
+            for i, key in enumerate(self._series):
+                struct.pack_into(
+                    "=d", self._mm, self.column(i) + 8 * slot, samples.get(key, math.nan)
+                )
+            self._next = slot + 1
+            if self._next == self._block:
+                self.seal()
+
+    def seal(self):
+        """Encode the full head into the file of its block and start the next block"""
+        n = len(self._series)
+        streams = [encode_times(array("I", self._mm[: self._width]))]
+        for i in range(n):
+            streams.append(encode_values(array("d", self._mm[self.column(i) : self.column(i + 1)])))
+        ends = array("I")
+        end = 0
+        for stream in streams:
+            end += len(stream)
+            ends.append(end)
+        path = self.block_path(self._head)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(MAGIC + struct.pack("=II", self._block, n) + ends.tobytes())
+            for stream in streams:
+                f.write(stream)
+        os.replace(f"{path}.tmp", path)
+        self._mm[: self._width] = b"\xff" * self._width
+        self._mm[self._width :] = NAN * (self._block * self._columns)
+        self._head = (self._head + 1) % self._blocks
+        self._next = 0
+        self.save()
+
+    def read_block(
+        self, k: int, columns: Sequence[int]
+    ) -> Optional[Tuple[List[int], Dict[int, array]]]:
+        """Times and the given value columns of sealed block k, None if there is none"""
+        try:
+            with open(self.block_path(k), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if data[:4] != MAGIC:
+            return None
+        block, n = struct.unpack_from("=II", data, 4)
+        start = 12 + 4 * (n + 1)
+        ends = array("I", data[12:start])
+        begins = [0] + ends.tolist()
+        times = decode_times(data[start + begins[0] : start + ends[0]], block)
+        values = {
+            i: decode_values(data[start + begins[1 + i] : start + ends[1 + i]], block)
+            for i in columns
+            if i < n
+        }
+        return times, values
+
+    def query(
+        self, selectors: List[Tuple[str, Dict[str, str]]], start: float, end: float, step: float
+    ) -> List[dict]:
+        """Points of the selected series between start and end, see downsample"""
+        with self._lock:
+            selected = [
+                (i, key)
+                for i, key in enumerate(self._series)
+                if any(
+                    key[0] == name and all(dict(key[1]).get(k) == v for k, v in labels.items())
+                    for name, labels in selectors
+                )
+            ]
+            if not selected:
+                return []
+            used = self._next
+            chunks = [
+                (
+                    array("I", self._mm[: 4 * used]).tolist(),
+                    {
+                        i: array("d", self._mm[self.column(i) : self.column(i) + 8 * used])
+                        for i, _ in selected
+                    },
+                )
+            ]
+            head = self._head
+            base = self._base
+        for k in range(self._blocks):
+            if k == head:
+                continue
+            chunk = self.read_block(k, [i for i, _ in selected])
+            if chunk is not None:
+                chunks.append(chunk)
+        lo, hi = (start - base) * 100, (end - base) * 100
+        result = []
+        for i, (name, labels) in selected:
+            points = sorted(
+                (base + t / 100, v)
+                for times, columns in chunks
+                if i in columns
+                for t, v in zip(times, columns[i])
+                if lo <= t <= hi and not math.isnan(v)
+            )
+            if points:
+                result.append(
+                    {
+                        "metric": dict(labels, __name__=name),
+                        "values": [
+                            [t, repr(v)] for t, v in downsample(points, start, step)
+                        ],
+                    }
+                )
+        return result
+
+
+class History:
+    def __init__(self) -> None:
+        self._name = "history"
+        self.enabled = False
+        self._threads: List[threading.Thread] = []
+        self._stores: Dict[str, Store] = {}
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-dir",
+            type=str,
+            default="",
+            help="Directory keeping recent history of every collected series, empty disables history",
+        )
+        add_option(
+            f"--{self._name}-hours",
+            type=float,
+            default=6.0,
+            help="Hours of history kept, each sample of a series takes 1 to 9 bytes on disk, 1 if it did not change",
+        )
+        add_option(
+            f"--{self._name}-interval",
+            type=float,
+            default=15.0,
+            help="Seconds between two recorded samples of a component",
+        )
+        add_option(
+            f"--{self._name}-max-series",
+            type=int,
+            default=4096,
+            help="Series kept per component, later new ones are dropped, each takes 512 bytes of the memory-mapped head",
+        )
+        return self
+
+    def setup(
+        self,
+        components: Dict[str, Component],
+        readiness: Readiness,
+        breakers: Breakers,
+        refresh: bool,
+    ):
+        """Start one recording thread per component
+
+        Args:
+            components (Dict[str, Component]): components to record, by name
+            readiness (Readiness): a thread starts recording once its component is ready
+            breakers (Breakers): updates go through the component's circuit
+            refresh (bool): update a component no scrape updated since the last sample,
+                so history goes on while nothing scrapes
+        """
+        directory = get_arg(f"{self._name}_dir")
+        self.enabled = directory != ""
+        if not self.enabled:
+            return
+        self._readiness = readiness
+        self._breakers = breakers
+        self._refresh = refresh
+        self._interval = get_arg(f"{self._name}_interval")
+        slots = max(1, math.ceil(get_arg(f"{self._name}_hours") * 3600 / self._interval))
+        max_series = get_arg(f"{self._name}_max_series")
+        os.makedirs(directory, exist_ok=True)
+        for name, c in components.items():
+            self._stores[name] = Store(os.path.join(directory, name), slots, max_series)
+            t = threading.Thread(
+                target=self.run,
+                args=(name, c),
+                name=f"{self._name}-{name}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        for store in self._stores.values():
+            store.close()
+
+    def run(self, name: str, c: Component):
+        """Record the latest families of a component every interval seconds
+
+        Families no update replaced since the last sample, e.g. while its
+        circuit is open, are not recorded again.
+        """
+        while not self._readiness.done(name, 1.0):
+            if self._stop.is_set():
+                return
+        if not self._readiness.ready(name):
+            return
+        last = None
+        while not self._stop.is_set():
+            start = time.monotonic()
+            families = c.collect()
+            if families is last and self._refresh:
+                try:
+                    self._breakers.update(name, c)
+                except Exception as e:
+                    logger.warning(f"Component {name} history update failed: {e}")
+                families = c.collect()
+            if families is not last and families:
+                samples = {
+                    (s.name, tuple(sorted(s.labels.items()))): s.value
+                    for f in families
+                    for s in f.samples
+                }
+                self._stores[name].record(time.time(), samples)
+            last = families
+            self._stop.wait(max(0.0, self._interval - (time.monotonic() - start)))
+
+    def query(
+        self,
+        series: Sequence[str],
+        start: Optional[str],
+        end: Optional[str],
+        step: Optional[str],
+    ) -> List[dict]:
+        """Recorded points of the selected series, like a Prometheus range query
+
+        Args:
+            series (Sequence[str]): series selectors, see parse_selector
+            start (Optional[str]): unix time, an hour before end by default
+            end (Optional[str]): unix time, now by default
+            step (Optional[str]): seconds of each averaged point, every sample by default
+
+        Raises:
+            ValueError: invalid arguments
+
+        Returns:
+            List[dict]: metric labels and [time, value] pairs of each series
+        """
+        if not series:
+            raise ValueError("series is required")
+        selectors = [parse_selector(s) for s in series]
+        end = time.time() if end is None else float(end)
+        start = end - 3600 if start is None else float(start)
+        step = 0.0 if step is None else float(step)
+        if start > end:
+            raise ValueError("from is after to")
+        result = []
+        for store in self._stores.values():
+            result += store.query(selectors, start, end, step)
+        return result
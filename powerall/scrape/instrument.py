@@ -0,0 +1,120 @@
+"""
+Self-instrumentation of component updates and scrapes
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from components.component import Component
+from scrape.profiling import Profiling
+from typing import Optional
+import time
+
+
+class Instrumentation:
+    def __init__(self) -> None:
+        self._name = "instrument"
+
+    def __enter__(self):
+        return self
+
+    def setup(self, profiling: Profiling):
+        self._profiling = profiling
+        self._update_seconds = Histogram(
+            "powerall_exporter_update_duration_seconds",
+            "Time spent in update() of a component.",
+            ["component"],
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+        )
+        self._errors = Counter(
+            "powerall_exporter_update_errors",
+            "Updates of a component that raised an error.",
+            ["component"],
+        )
+        self._skipped = Counter(
+            "powerall_exporter_update_skipped",
+            "Collections of a component that served no fresh output, by reason.",
+            ["component", "reason"],
+        )
+        self._bytes = Gauge(
+            "powerall_exporter_output_bytes",
+            "Size of the last output of a component.",
+            ["component"],
+        )
+        self._series = Gauge(
+            "powerall_exporter_series",
+            "Series in the last output of a component.",
+            ["component"],
+        )
+        self._scrape_seconds = Histogram(
+            "powerall_exporter_scrape_duration_seconds",
+            "Time spent serving /metrics.",
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def update(self, name: str, c: Component) -> Optional[bytes]:
+        """Run c.update() and record its duration, errors and output size
+
+        Args:
+            name (str): component name
+            c (Component): component to update
+
+        Returns:
+            Optional[bytes]: output of the update, errors are raised again
+        """
+        start = time.perf_counter()
+        try:
+            upds = self._profiling.call(c.update)
+        except Exception:
+            self._errors.labels(component=name).inc()
+            raise
+        finally:
+            self._update_seconds.labels(component=name).observe(
+                time.perf_counter() - start
+            )
+        if upds is not None and isinstance(upds, bytes):
+            self._bytes.labels(component=name).set(len(upds))
+            self._series.labels(component=name).set(series(upds))
+        else:
+            self.skip(name, "no_output")
+        return upds
+
+    def skip(self, name: str, reason: str):
+        """Count a collection that served no fresh output
+
+        Args:
+            name (str): component name
+            reason (str): e.g. no_output, deadline or stale
+        """
+        self._skipped.labels(component=name, reason=reason).inc()
+
+    def scrape(self, seconds: float):
+        self._scrape_seconds.observe(seconds)
+
+    def metrics(self) -> bytes:
+        """Self-metrics of updates and scrapes
+
+        Returns:
+            bytes: text exposition of all instrumentation metrics
+        """
+        return b"".join(
+            generate_latest(m)
+            for m in (
+                self._update_seconds,
+                self._errors,
+                self._skipped,
+                self._bytes,
+                self._series,
+                self._scrape_seconds,
+            )
+        )
+
+
+def series(output: bytes) -> int:
+    """Sample lines in a text exposition"""
+    lines = output.count(b"\n")
+    comments = output.count(b"\n#") + (1 if output.startswith(b"#") else 0)
+    return lines - comments
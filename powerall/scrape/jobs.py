@@ -0,0 +1,241 @@
+"""
+Energy accounting of jobs between start and stop markers
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from components.component import Component, Signal
+from scrape.readiness import Readiness
+from scrape.sampler import Sampler
+from scrape.energy import Energy
+from array import array
+from collections import OrderedDict
+from typing import Dict, Optional
+import threading
+import time
+
+
+class Peaks:
+    """Highest power of each second over the last seconds, in two preallocated arrays"""
+
+    def __init__(self, seconds: int) -> None:
+        self.size = seconds
+        # second each slot holds, -1 for none
+        self.seconds = array("q", [-1]) * seconds
+        self.watts = array("d", bytes(8 * seconds))
+
+    def add(self, t: float, watts: float):
+        s = int(t)
+        i = s % self.size
+        if self.seconds[i] != s:
+            self.seconds[i] = s
+            self.watts[i] = watts
+        elif watts > self.watts[i]:
+            self.watts[i] = watts
+
+    def peak(self, begin: float, end: float) -> Optional[float]:
+        """Highest power between begin and end, None without samples"""
+        best = None
+        last = int(end)
+        for s in range(max(int(begin), last - self.size + 1), last + 1):
+            i = s % self.size
+            if self.seconds[i] == s and (best is None or self.watts[i] > best):
+                best = self.watts[i]
+        return best
+
+
+class Mark:
+    """Counters of a job at its start or stop"""
+
+    def __init__(
+        self, monotonic: float, energy: Dict[str, float], states: Dict[str, Dict[str, float]]
+    ) -> None:
+        self.time = time.time()
+        self.monotonic = monotonic
+        self.energy = energy
+        self.states = states
+
+
+class Job:
+    def __init__(self, start: Mark) -> None:
+        self.start = start
+        self.stop: Optional[Mark] = None
+
+
+class Jobs:
+    def __init__(self) -> None:
+        self._name = "jobs"
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._running: "OrderedDict[str, Job]" = OrderedDict()
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._peaks: Dict[str, Peaks] = {}
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-enable",
+            type=bool,
+            default=False,
+            help="Enable the job energy accounting API",
+        )
+        add_option(
+            f"--{self._name}-signals",
+            type=str,
+            default="nvgpu.power,bmc.power",
+            help="Power signals of the peak power of a job, sampled at their sampler rate",
+        )
+        add_option(
+            f"--{self._name}-max",
+            type=int,
+            default=10000,
+            help="Jobs kept, the oldest finished ones are dropped first",
+        )
+        add_option(
+            f"--{self._name}-peak-hours",
+            type=float,
+            default=24.0,
+            help="Hours of per second peak power kept, longer jobs get the peak of their end",
+        )
+        return self
+
+    def setup(
+        self,
+        components: Dict[str, Component],
+        readiness: Readiness,
+        sampler: Sampler,
+        energy: Energy,
+    ):
+        """Subscribe to the power signals, call before sampler.setup
+
+        Args:
+            components (Dict[str, Component]): components accounted, by name
+            readiness (Readiness): counters are read once a component is ready
+            sampler (Sampler): samples the power signals
+            energy (Energy): energy counters, jobs report no energy without them
+        """
+        self.enabled = get_arg(f"{self._name}_enable")
+        if not self.enabled:
+            return
+        self._components = components
+        self._readiness = readiness
+        self._energy = energy
+        self._max = max(1, get_arg(f"{self._name}_max"))
+        if not energy.enabled:
+            logger.warning("Energy counters are disabled, jobs report no energy")
+        seconds = max(1, int(get_arg(f"{self._name}_peak_hours") * 3600))
+        for key in get_arg(f"{self._name}_signals").split(","):
+            key = key.strip()
+            name = key.partition(".")[0]
+            if name in components:
+                self._peaks[name] = Peaks(seconds)
+                sampler.subscribe(
+                    key, lambda s, t, values, name=name: self.sample(name, s, t, values)
+                )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def sample(self, name: str, s: Signal, t: float, values: Dict[str, float]):
+        """Add a read of a power signal, all series of the component together"""
+        if s.watts is None or not values:
+            return
+        watts = sum(values.values()) * s.watts
+        with self._lock:
+            self._peaks[name].add(t, watts)
+
+    def mark(self) -> Mark:
+        """Energy and time in state counters now"""
+        monotonic = time.monotonic()
+        states = {}
+        for name, c in self._components.items():
+            if not self._readiness.ready(name):
+                continue
+            try:
+                s = c.states()
+            except Exception as e:
+                logger.warning(f"Component {name} states failed: {e}")
+                continue
+            if s:
+                states[name] = s
+        energy = self._energy.totals() if self._energy.enabled else {}
+        return Mark(monotonic, energy, states)
+
+    def start(self, job: str) -> dict:
+        """Start accounting a job, a finished job of the same id is replaced
+
+        Raises:
+            ValueError: the job is running
+        """
+        m = self.mark()
+        with self._lock:
+            if job in self._running:
+                raise ValueError(f"Job {job} is running")
+            self._finished.pop(job, None)
+            self._running[job] = Job(m)
+            while len(self._running) + len(self._finished) > self._max:
+                jobs = self._finished if self._finished else self._running
+                dropped, _ = jobs.popitem(last=False)
+                logger.warning(f"Drop job {dropped}, more than {self._max} jobs")
+        return self.report(job)
+
+    def stop(self, job: str) -> dict:
+        """Stop accounting a job
+
+        Raises:
+            KeyError: the job is unknown
+            ValueError: the job is finished
+        """
+        m = self.mark()
+        with self._lock:
+            if job in self._finished:
+                raise ValueError(f"Job {job} is finished")
+            j = self._running.pop(job)
+            j.stop = m
+            self._finished[job] = j
+        return self.report(job)
+
+    def report(self, job: str) -> dict:
+        """Energy, average and peak power of each component, and seconds in each state
+
+        A running job is reported until now.
+
+        Raises:
+            KeyError: the job is unknown
+        """
+        with self._lock:
+            j = self._running.get(job) or self._finished[job]
+        start, stop = j.start, j.stop
+        if stop is None:
+            stop = self.mark()
+        seconds = stop.monotonic - start.monotonic
+        components = {}
+        for name in sorted(set(start.energy) | set(self._peaks)):
+            report = {}
+            if name in start.energy and name in stop.energy:
+                joules = stop.energy[name] - start.energy[name]
+                report["energy_joules"] = joules
+                report["average_watts"] = joules / seconds if seconds > 0 else None
+            if name in self._peaks:
+                with self._lock:
+                    report["peak_watts"] = self._peaks[name].peak(
+                        start.monotonic, stop.monotonic
+                    )
+            components[name] = report
+        states = {
+            name: {
+                state: value - start.states[name][state]
+                for state, value in s.items()
+                if state in start.states.get(name, {})
+            }
+            for name, s in stop.states.items()
+            if name in start.states
+        }
+        return {
+            "id": job,
+            "state": "running" if j.stop is None else "finished",
+            "start": start.time,
+            "stop": None if j.stop is None else j.stop.time,
+            "seconds": seconds,
+            "components": components,
+            "states": states,
+        }
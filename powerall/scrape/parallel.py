@@ -0,0 +1,247 @@
+"""
+Parallel collection with per component deadlines
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import Gauge, generate_latest
+from components.component import Component
+from scrape.instrument import Instrumentation
+from scrape.breaker import Breakers
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
+from typing import Dict, Iterator, Optional, Sequence
+import threading
+import time
+
+
+class Parallel:
+    def __init__(self) -> None:
+        self._name = "parallel"
+        self._executor = None
+        self._inflight: Dict[str, Future] = {}
+        self._last_good: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-workers",
+            type=int,
+            default=0,
+            help="Threads updating components, 0 means one per component",
+        )
+        add_option(
+            f"--{self._name}-timeout",
+            type=float,
+            default=10.0,
+            help="Default seconds a component may take before its last good output is served",
+        )
+        add_option(
+            f"--{self._name}-timeouts",
+            type=str,
+            default="",
+            help="Per component deadlines in seconds, e.g. bmc=5,nvgpu=2",
+        )
+        add_option(
+            f"--{self._name}-timeout-offset",
+            type=float,
+            default=0.5,
+            help="Seconds subtracted from X-Prometheus-Scrape-Timeout-Seconds to leave time for the response",
+        )
+        return self
+
+    def setup(
+        self,
+        components: Dict[str, Component],
+        instrument: Instrumentation,
+        breakers: Breakers,
+    ):
+        """Create the worker pool
+
+        Args:
+            components (Dict[str, Component]): components to update, by name
+            instrument (Instrumentation): records every update
+            breakers (Breakers): every update goes through the component's circuit
+        """
+        self._components = components
+        self._instrument = instrument
+        self._breakers = breakers
+        self._timeout = get_arg(f"{self._name}_timeout")
+        self._timeouts = self.parse_timeouts(get_arg(f"{self._name}_timeouts"))
+        self._timeout_offset = get_arg(f"{self._name}_timeout_offset")
+        workers = get_arg(f"{self._name}_workers")
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers if workers > 0 else max(1, len(components)),
+            thread_name_prefix=self._name,
+        )
+        self._timeout_marker = Gauge(
+            "powerall_exporter_collect_timeout",
+            "1 if a component missed its deadline and its last good output was served.",
+            ["component"],
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Parallel collector exit")
+
+    def parse_timeouts(self, timeouts: str) -> Dict[str, float]:
+        """name=seconds,name=seconds
+
+        Args:
+            timeouts (str): timeouts option value
+
+        Returns:
+            Dict[str, float]: deadline of each named component
+        """
+        ret = {}
+        for i in timeouts.split(","):
+            if i == "":
+                continue
+            try:
+                name, seconds = i.split("=")
+                ret[name.strip()] = float(seconds)
+            except ValueError:
+                logger.warning(f"Ignore invalid parallel timeout: {i}")
+        return ret
+
+    def budget(self, scrape_timeout: Optional[str]) -> Optional[float]:
+        """Overall budget from the X-Prometheus-Scrape-Timeout-Seconds header
+
+        Args:
+            scrape_timeout (Optional[str]): header value, None if not sent
+
+        Returns:
+            Optional[float]: seconds left for collection, None if unlimited
+        """
+        if scrape_timeout is None:
+            return None
+        try:
+            return max(0.0, float(scrape_timeout) - self._timeout_offset)
+        except ValueError:
+            logger.warning(f"Invalid scrape timeout header: {scrape_timeout}")
+            return None
+
+    def submit(self, names: Optional[Sequence[str]] = None) -> Dict[str, Future]:
+        """Start an update of every component not already being updated
+
+        A component still running from an earlier scrape keeps its future,
+        so a hung device never occupies more than one worker.
+
+        Args:
+            names (Optional[Sequence[str]]): components to update, None for all
+
+        Returns:
+            Dict[str, Future]: pending or finished update of each component
+        """
+        futures = {}
+        with self._lock:
+            for name in self._components.keys() if names is None else names:
+                f = self._inflight.get(name)
+                if f is None or f.done():
+                    f = self._executor.submit(
+                        self._breakers.update, name, self._components[name]
+                    )
+                    f.add_done_callback(lambda f, name=name: self.done(name, f))
+                    self._inflight[name] = f
+                futures[name] = f
+        return futures
+
+    def done(self, name: str, f: Future):
+        """Keep the output of a finished update, even one that missed its deadline
+
+        Args:
+            name (str): component name
+            f (Future): finished update
+        """
+        if f.cancelled() or f.exception() is not None:
+            return
+        upds = f.result()
+        if upds is not None and isinstance(upds, bytes):
+            self._last_good[name] = upds
+
+    def collect(
+        self, budget: Optional[float] = None, names: Optional[Sequence[str]] = None
+    ) -> bytes:
+        """Update all components at once and wait for each up to its deadline
+
+        Args:
+            budget (Optional[float]): overall seconds to wait, None if unlimited
+            names (Optional[Sequence[str]]): components to update, None for all
+
+        Returns:
+            bytes: outputs of all components plus timeout markers
+        """
+        return b"".join(self.stream(budget, names))
+
+    def stream(
+        self, budget: Optional[float] = None, names: Optional[Sequence[str]] = None
+    ) -> Iterator[bytes]:
+        """Outputs of all components in the order they finish, see collect
+
+        A component that misses its deadline is yielded from its last good
+        output once the deadline passes.
+
+        Args:
+            budget (Optional[float]): overall seconds to wait, None if unlimited
+            names (Optional[Sequence[str]]): components to update, None for all
+
+        Yields:
+            bytes: output of one component, timeout markers last
+        """
+        start = time.monotonic()
+        pending = self.submit(names)
+        deadlines = {}
+        for name in pending.keys():
+            timeout = self._timeouts.get(name, self._timeout)
+            if budget is not None:
+                timeout = min(timeout, budget)
+            deadlines[name] = start + timeout
+        while pending:
+            wait(
+                list(pending.values()),
+                timeout=max(0.0, min(deadlines[n] for n in pending) - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            now = time.monotonic()
+            for name, f in list(pending.items()):
+                if not f.done() and now < deadlines[name]:
+                    continue
+                del pending[name]
+                upds = self.result(name, f, deadlines[name] - start)
+                if upds is not None:
+                    yield upds
+        yield generate_latest(self._timeout_marker)
+
+    def result(self, name: str, f: Future, timeout: float) -> Optional[bytes]:
+        """Output of a finished update, or the last good one if it is not done
+
+        Args:
+            name (str): component name
+            f (Future): update of the component
+            timeout (float): deadline of the component, for logging
+
+        Returns:
+            Optional[bytes]: output to serve, None if there is none
+        """
+        timed_out = False
+        try:
+            upds = f.result(timeout=0)
+        except TimeoutError:
+            logger.warning(f"Component {name} missed its {timeout:.1f}s deadline")
+            timed_out = True
+            upds = self._last_good.get(name)
+            self._instrument.skip(name, "deadline")
+        except Exception as e:
+            logger.warning(f"Component {name} update failed: {e}")
+            upds = None
+        self._timeout_marker.labels(component=name).set(1 if timed_out else 0)
+        if upds is not None and isinstance(upds, bytes):
+            return upds
+        logger.warning(f"Component {name} didn't capture output of monitor")
+        return None
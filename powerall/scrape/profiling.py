@@ -0,0 +1,274 @@
+"""
+On-demand profiling of the running agent
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from typing import Callable, Dict, List, Optional, Tuple
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Profiling:
+    """Sampling and cProfile profiles, tracemalloc heap snapshots
+
+    cProfile only sees the thread it is enabled in, so the cProfile mode
+    profiles the component updates run during the window, whichever
+    thread runs them, and merges the results. Since Python 3.12 only one
+    profiler may be active, so one update is profiled at a time and
+    updates running meanwhile in other threads are not profiled. The
+    sampling mode looks at the stacks of all threads.
+    """
+
+    def __init__(self) -> None:
+        self._name = "profiling"
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+        # held by the one update being profiled
+        self._profiling = threading.Lock()
+        self._profiles: Optional[List[cProfile.Profile]] = None
+        self._baseline = None
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-enable",
+            type=bool,
+            default=False,
+            help="Serve /debug/profile and /debug/heap",
+        )
+        add_option(
+            f"--{self._name}-max-seconds",
+            type=float,
+            default=60.0,
+            help="Longest profile /debug/profile may take",
+        )
+        add_option(
+            f"--{self._name}-interval",
+            type=float,
+            default=0.005,
+            help="Seconds between two stack samples of the sampling profiler",
+        )
+        add_option(
+            f"--{self._name}-tracemalloc-frames",
+            type=int,
+            default=0,
+            help="Trace allocations from startup keeping this many frames, 0 starts tracing on the first /debug/heap",
+        )
+        return self
+
+    def setup(self):
+        self._enabled = get_arg(f"{self._name}_enable")
+        self._max_seconds = get_arg(f"{self._name}_max_seconds")
+        self._interval = get_arg(f"{self._name}_interval")
+        frames = get_arg(f"{self._name}_tracemalloc_frames")
+        if self._enabled and frames > 0:
+            tracemalloc.start(frames)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def call(self, fn: Callable):
+        """Run fn, under cProfile while a cProfile profile is being taken
+
+        fn runs unprofiled while another update is profiled.
+        """
+        profiles = self._profiles
+        if profiles is None or not self._profiling.acquire(blocking=False):
+            return fn()
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # another profiling tool is active, e.g. a debugger
+                logger.warning(f"Could not profile an update: {e}")
+                return fn()
+            try:
+                return fn()
+            finally:
+                profile.disable()
+                with self._lock:
+                    profiles.append(profile)
+        finally:
+            self._profiling.release()
+
+    def profile(
+        self, seconds: float, mode: str, fmt: Optional[str] = None
+    ) -> Tuple[bytes, str]:
+        """Profile the process for some seconds
+
+        Args:
+            seconds (float): length of the profile
+            mode (str): sample or cprofile
+            fmt (Optional[str]): collapsed (sample only), pstats or text,
+                None for collapsed samples or cProfile pstats
+
+        Raises:
+            ValueError: invalid arguments
+            RuntimeError: another profile is being taken
+
+        Returns:
+            Tuple[bytes, str]: profile and its content type
+        """
+        if mode not in ("sample", "cprofile"):
+            raise ValueError(f"Unknown profile mode {mode}")
+        if fmt is None:
+            fmt = "collapsed" if mode == "sample" else "pstats"
+        if fmt not in ("collapsed", "pstats", "text") or (
+            mode == "cprofile" and fmt == "collapsed"
+        ):
+            raise ValueError(f"Profile mode {mode} has no {fmt} output")
+        if not 0 < seconds <= self._max_seconds:
+            raise ValueError(f"Profile seconds must be in (0, {self._max_seconds}]")
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("Another profile is being taken")
+        try:
+            logger.warning(f"Start {seconds:.1f}s {mode} profile")
+            if mode == "sample":
+                samples = self.sample(seconds)
+                if fmt == "collapsed":
+                    return collapsed(samples), "text/plain; charset=utf-8"
+                stats = sample_stats(samples, self._interval)
+            else:
+                stats = self.cprofile(seconds)
+        finally:
+            self._running.release()
+        if fmt == "pstats":
+            return marshal.dumps(stats), "application/octet-stream"
+        out = io.StringIO()
+        ps = pstats.Stats(stream=out)
+        ps.stats = stats
+        ps.get_top_level_stats()
+        ps.sort_stats("cumulative").print_stats(50)
+        return out.getvalue().encode("utf-8"), "text/plain; charset=utf-8"
+
+    def sample(self, seconds: float) -> Dict[Tuple, int]:
+        """Sample stacks of all other threads
+
+        Returns:
+            Dict[Tuple, int]: (thread name, frames root first) -> samples
+        """
+        samples: Dict[Tuple, int] = {}
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                samples[key] = samples.get(key, 0) + 1
+            time.sleep(self._interval)
+        return samples
+
+    def cprofile(self, seconds: float) -> dict:
+        """cProfile every component update run in the next seconds
+
+        Returns:
+            dict: merged stats, see pstats.Stats.stats
+        """
+        profiles: List[cProfile.Profile] = []
+        self._profiles = profiles
+        try:
+            time.sleep(seconds)
+        finally:
+            self._profiles = None
+        with self._lock:
+            profiles = list(profiles)
+        if not profiles:
+            return {}
+        stats = pstats.Stats(profiles[0])
+        for p in profiles[1:]:
+            stats.add(p)
+        return stats.stats
+
+    def heap(self, limit: int, key: str, baseline: bool) -> str:
+        """Top allocations, and their growth since the baseline
+
+        Args:
+            limit (int): allocation sites to list
+            key (str): lineno, filename or traceback
+            baseline (bool): make the current snapshot the new baseline
+
+        Raises:
+            ValueError: invalid arguments
+
+        Returns:
+            str: report of the current snapshot
+        """
+        if key not in ("lineno", "filename", "traceback"):
+            raise ValueError(f"Unknown heap key {key}")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot()
+            return "Started tracing allocations, this snapshot is the baseline\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced {current} bytes, peak {peak} bytes", "", "Top allocations:"]
+        lines += [str(s) for s in snapshot.statistics(key)[:limit]]
+        if self._baseline is not None:
+            lines += ["", "Growth since the baseline:"]
+            lines += [str(s) for s in snapshot.compare_to(self._baseline, key)[:limit]]
+        if baseline or self._baseline is None:
+            self._baseline = snapshot
+            lines += ["", "The baseline is now this snapshot"]
+        return "\n".join(lines) + "\n"
+
+
+def frame_name(frame: Tuple) -> str:
+    filename, lineno, name = frame
+    return f"{name} ({filename}:{lineno})"
+
+
+def collapsed(samples: Dict[Tuple, int]) -> bytes:
+    """Stacks in the collapsed format of flamegraph.pl and speedscope"""
+    lines = []
+    for (thread, stack), count in sorted(samples.items(), key=lambda i: -i[1]):
+        frames = ";".join([thread] + [frame_name(f) for f in stack])
+        lines.append(f"{frames} {count}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def sample_stats(samples: Dict[Tuple, int], interval: float) -> dict:
+    """Samples as pstats stats, each sample counts as one interval
+
+    Returns:
+        dict: func -> (primitive calls, calls, own time, cumulative time, callers)
+    """
+    stats: Dict[Tuple, list] = {}
+    for (_, stack), count in samples.items():
+        t = count * interval
+        seen = set()
+        caller = None
+        for i, frame in enumerate(stack):
+            entry = stats.setdefault(frame, [0, 0, 0, 0, {}])
+            if frame not in seen:
+                entry[0] += count
+                entry[1] += count
+                entry[3] += t
+                seen.add(frame)
+            if i == len(stack) - 1:
+                entry[2] += t
+            if caller is not None:
+                c = entry[4].get(caller, (0, 0, 0, 0))
+                entry[4][caller] = (c[0] + count, c[1] + count, c[2], c[3] + t)
+            caller = frame
+    return {f: tuple(v) for f, v in stats.items()}
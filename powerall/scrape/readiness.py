@@ -0,0 +1,109 @@
+"""
+Concurrent component setup and per component readiness
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from components.component import Component
+from scrape.instrument import Instrumentation
+from typing import Dict, Tuple
+import threading
+import time
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    def __init__(self) -> None:
+        self._name = "readiness"
+        self._lock = threading.Lock()
+        self._states: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+        self._seconds: Dict[str, float] = {}
+        self._done: Dict[str, threading.Event] = {}
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-wait",
+            type=float,
+            default=0.0,
+            help="Seconds to wait for component setup before serving, 0 serves at once",
+        )
+        return self
+
+    def setup(self, components: Dict[str, Component], instrument: Instrumentation):
+        """Run setup() of every component in its own thread
+
+        Args:
+            components (Dict[str, Component]): components to set up, by name
+            instrument (Instrumentation): counts scrapes that skip a component not ready
+        """
+        self._instrument = instrument
+        for name, c in components.items():
+            self._states[name] = PENDING
+            self._done[name] = threading.Event()
+        for name, c in components.items():
+            threading.Thread(
+                target=self.run,
+                args=(name, c),
+                name=f"{self._name}-{name}",
+                daemon=True,
+            ).start()
+        wait = get_arg(f"{self._name}_wait")
+        if wait > 0:
+            deadline = time.monotonic() + wait
+            for done in self._done.values():
+                done.wait(max(0.0, deadline - time.monotonic()))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def run(self, name: str, c: Component):
+        start = time.monotonic()
+        try:
+            c.setup()
+            state, error = READY, ""
+        except Exception as e:
+            logger.warning(f"Component {name} setup failed: {e}")
+            state, error = FAILED, str(e)
+        with self._lock:
+            self._states[name] = state
+            self._errors[name] = error
+            self._seconds[name] = time.monotonic() - start
+        self._done[name].set()
+        logger.warning(f"Component {name} {state} after {self._seconds[name]:.2f}s")
+
+    def ready(self, name: str) -> bool:
+        return self._states.get(name) == READY
+
+    def done(self, name: str, timeout: float) -> bool:
+        """Wait up to timeout seconds for the setup of a component to finish
+
+        Returns:
+            bool: the setup finished, ready or failed
+        """
+        return self._done[name].wait(timeout)
+
+    def filter(self, names: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Components of names that are ready, the others are counted as skipped"""
+        ready = tuple(n for n in names if self.ready(n))
+        if len(ready) != len(names):
+            for n in names:
+                if n not in ready:
+                    self._instrument.skip(n, "not_ready")
+        return ready
+
+    def status(self) -> Tuple[bool, dict]:
+        """Whether no setup is pending, and state, error and setup seconds of each component"""
+        with self._lock:
+            components = {
+                name: {
+                    "state": state,
+                    "error": self._errors.get(name, ""),
+                    "seconds": self._seconds.get(name),
+                }
+                for name, state in self._states.items()
+            }
+        return all(s["state"] != PENDING for s in components.values()), components
@@ -0,0 +1,377 @@
+"""
+Columnar recording of collected samples to Parquet, Arrow IPC or CSV files
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from components.component import Component
+from scrape.readiness import Readiness
+from scrape.breaker import Breakers
+from typing import Dict, List, Optional
+import csv
+import os
+import socket
+import threading
+import time
+
+columns = ["time", "component", "name", "labels", "value"]
+extensions = {"parquet": "parquet", "arrow": "arrow", "csv": "csv"}
+
+
+def labels_string(labels: Dict[str, str]) -> str:
+    """k="v",... sorted by label name, like the text exposition"""
+    return ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in sorted(labels.items())
+    )
+
+
+class CSVWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "w", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(columns)
+
+    def write(self, batch: Dict[str, list]):
+        self._csv.writerows(zip(*(batch[c] for c in columns)))
+        self._file.flush()
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowWriter:
+    """One record batch per write, Parquet row group or Arrow IPC file batch"""
+
+    def __init__(self, path: str, fmt: str, pa) -> None:
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("time", pa.timestamp("ms", tz="UTC")),
+                ("component", pa.dictionary(pa.int32(), pa.string())),
+                ("name", pa.dictionary(pa.int32(), pa.string())),
+                ("labels", pa.dictionary(pa.int32(), pa.string())),
+                ("value", pa.float64()),
+            ]
+        )
+        self._sink = pa.OSFile(path, "wb")
+        self._parquet = fmt == "parquet"
+        if self._parquet:
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(
+                self._sink, self._schema, compression="zstd"
+            )
+        else:
+            self._writer = pa.ipc.new_file(self._sink, self._schema)
+
+    def write(self, batch: Dict[str, list]):
+        pa = self._pa
+        arrays = [
+            pa.array(
+                [int(t * 1000) for t in batch["time"]], self._schema.field("time").type
+            )
+        ]
+        for c in ("component", "name", "labels"):
+            arrays.append(pa.array(batch[c], pa.string()).dictionary_encode())
+        arrays.append(pa.array(batch["value"], pa.float64()))
+        table = pa.Table.from_arrays(arrays, schema=self._schema)
+        if self._parquet:
+            self._writer.write_table(table)
+        else:
+            self._writer.write(table)
+
+    def size(self) -> int:
+        return self._sink.tell()
+
+    def close(self):
+        self._writer.close()
+        self._sink.close()
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self._name = "recorder"
+        self._lock = threading.Lock()
+        # the writer thread and exit both write
+        self._write_lock = threading.Lock()
+        self._files = 0
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._batch = self.empty()
+        self._writer = None
+        self._path: Optional[str] = None
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-dir",
+            type=str,
+            default="",
+            help="Directory of recorded sample files, empty disables recording",
+        )
+        add_option(
+            f"--{self._name}-format",
+            type=str,
+            default="parquet",
+            choices=list(extensions.keys()),
+            help="File format, parquet and arrow need pyarrow and fall back to csv without it",
+        )
+        add_option(
+            f"--{self._name}-interval",
+            type=float,
+            default=1.0,
+            help="Seconds between two recorded samples of a component",
+        )
+        add_option(
+            f"--{self._name}-flush",
+            type=float,
+            default=60.0,
+            help="Seconds of samples written at once, one row group each",
+        )
+        add_option(
+            f"--{self._name}-roll-mb",
+            type=float,
+            default=256.0,
+            help="Start a new file once a file is this many MiB",
+        )
+        add_option(
+            f"--{self._name}-roll-seconds",
+            type=float,
+            default=3600.0,
+            help="Start a new file once a file is this many seconds old",
+        )
+        return self
+
+    def setup(
+        self,
+        components: Dict[str, Component],
+        readiness: Readiness,
+        breakers: Breakers,
+        refresh: bool,
+    ):
+        """Start one recording thread per component and the writer thread
+
+        Args:
+            components (Dict[str, Component]): components to record, by name
+            readiness (Readiness): a thread starts recording once its component is ready
+            breakers (Breakers): updates go through the component's circuit
+            refresh (bool): update a component no scrape updated since the last sample
+        """
+        self._dir = get_arg(f"{self._name}_dir")
+        if self._dir == "":
+            return
+        self._readiness = readiness
+        self._breakers = breakers
+        self._refresh = refresh
+        self._interval = get_arg(f"{self._name}_interval")
+        self._flush = get_arg(f"{self._name}_flush")
+        self._roll_bytes = get_arg(f"{self._name}_roll_mb") * 2**20
+        self._roll_seconds = get_arg(f"{self._name}_roll_seconds")
+        self._format = get_arg(f"{self._name}_format")
+        self._pa = None
+        if self._format != "csv":
+            # heavy import, only when recording
+            try:
+                import pyarrow
+
+                self._pa = pyarrow
+            except ImportError:
+                logger.warning(
+                    f"pyarrow is not installed, record csv instead of {self._format}"
+                )
+                self._format = "csv"
+        os.makedirs(self._dir, exist_ok=True)
+        self.recover()
+        for name, c in components.items():
+            t = threading.Thread(
+                target=self.run,
+                args=(name, c),
+                name=f"{self._name}-{name}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+        self._writer_thread = threading.Thread(
+            target=self.write_loop, name=f"{self._name}-writer", daemon=True
+        )
+        self._writer_thread.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._threads:
+            return
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._writer_thread.join(timeout=5.0)
+        self.write()
+        with self._write_lock:
+            self.roll()
+
+    def recover(self):
+        """Finish the files a killed recorder left unfinished, or move them aside
+
+        A Parquet file without its footer can't be read, it becomes .broken.
+        """
+        for entry in sorted(os.listdir(self._dir)):
+            if not (entry.startswith("powerall-") and entry.endswith(".part")):
+                continue
+            part = os.path.join(self._dir, entry)
+            path = part[: -len(".part")]
+            try:
+                finished = self.finish(part, path)
+            except Exception as e:
+                logger.warning(f"Could not finish {part}: {e}")
+                finished = False
+            if finished:
+                logger.warning(f"Finished {path} left by an earlier run")
+                continue
+            try:
+                os.replace(part, f"{path}.broken")
+                logger.warning(f"Moved unreadable {part} to {path}.broken")
+            except OSError as e:
+                logger.warning(f"Could not move unreadable {part}: {e}")
+
+    def finish(self, part: str, path: str) -> bool:
+        """Make a left .part file a finished file
+
+        Returns:
+            bool: path is finished, False if part can't be read
+        """
+        ext = path.rsplit(".", 1)[-1]
+        if ext == "csv":
+            # rows are flushed whole
+            os.replace(part, path)
+            return True
+        pa = self._pa
+        if pa is None or ext not in ("parquet", "arrow"):
+            return False
+        if ext == "parquet":
+            import pyarrow.parquet as pq
+
+            try:
+                # killed between close and rename
+                pq.ParquetFile(part).close()
+            except (pa.ArrowInvalid, OSError):
+                return False
+            os.replace(part, path)
+            return True
+        try:
+            pa.ipc.open_file(part)
+            os.replace(part, path)
+            return True
+        except (pa.ArrowInvalid, OSError):
+            pass
+        # an IPC file is a stream after 8 bytes of magic, read it up to the last whole batch
+        batches = []
+        with pa.OSFile(part, "rb") as f:
+            f.seek(8)
+            try:
+                reader = pa.ipc.open_stream(f)
+            except (pa.ArrowInvalid, OSError):
+                return False
+            while True:
+                try:
+                    batches.append(reader.read_next_batch())
+                except (StopIteration, pa.ArrowInvalid, OSError):
+                    break
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, reader.schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        os.remove(part)
+        return True
+
+    def empty(self) -> Dict[str, list]:
+        return {c: [] for c in columns}
+
+    def run(self, name: str, c: Component):
+        """Add the latest samples of a component every interval seconds
+
+        Families no update replaced since the last sample are not added
+        again, see History.run.
+        """
+        while not self._readiness.done(name, 1.0):
+            if self._stop.is_set():
+                return
+        if not self._readiness.ready(name):
+            return
+        last = None
+        while not self._stop.is_set():
+            start = time.monotonic()
+            families = c.collect()
+            if families is last and self._refresh:
+                try:
+                    self._breakers.update(name, c)
+                except Exception as e:
+                    logger.warning(f"Component {name} recorder update failed: {e}")
+                families = c.collect()
+            if families is not last and families:
+                t = time.time()
+                samples = [
+                    (s.name, labels_string(s.labels), s.value)
+                    for f in families
+                    for s in f.samples
+                ]
+                with self._lock:
+                    batch = self._batch
+                    batch["time"] += [t] * len(samples)
+                    batch["component"] += [name] * len(samples)
+                    for sample_name, labels, value in samples:
+                        batch["name"].append(sample_name)
+                        batch["labels"].append(labels)
+                        batch["value"].append(value)
+            last = families
+            self._stop.wait(max(0.0, self._interval - (time.monotonic() - start)))
+
+    def write_loop(self):
+        while not self._stop.wait(self._flush):
+            self.write()
+
+    def write(self):
+        """Write the samples added since the last write, rolling files by size and age"""
+        with self._lock:
+            batch, self._batch = self._batch, self.empty()
+        if not batch["time"]:
+            return
+        with self._write_lock:
+            try:
+                if self._writer is None:
+                    self.open()
+                self._writer.write(batch)
+                if (
+                    self._writer.size() >= self._roll_bytes
+                    or time.monotonic() - self._opened >= self._roll_seconds
+                ):
+                    self.roll()
+            except Exception as e:
+                logger.warning(
+                    f"Could not write {len(batch['time'])} samples to {self._path}: {e}"
+                )
+
+    def open(self):
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self._files += 1
+        self._path = os.path.join(
+            self._dir,
+            f"powerall-{socket.gethostname()}-{stamp}-{self._files}.{extensions[self._format]}",
+        )
+        # readers only see finished files
+        if self._format == "csv":
+            self._writer = CSVWriter(f"{self._path}.part")
+        else:
+            self._writer = ArrowWriter(f"{self._path}.part", self._format, self._pa)
+        self._opened = time.monotonic()
+
+    def roll(self):
+        """Finish the current file"""
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+            os.replace(f"{self._path}.part", self._path)
+        except Exception as e:
+            logger.warning(f"Could not finish {self._path}: {e}")
+        self._writer = None
@@ -0,0 +1,320 @@
+"""
+High frequency sampling of component signals between scrapes
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import CollectorRegistry, Counter, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from components.component import Component, Signal
+from scrape.readiness import Readiness
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+quantiles = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+class Ring:
+    """Last capacity samples of one series, in two preallocated arrays"""
+
+    def __init__(self, capacity: int) -> None:
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.capacity = capacity
+        # samples ever appended, the next one goes to total % capacity
+        self.total = 0
+
+    def append(self, t: float, value: float):
+        i = self.total % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.total += 1
+
+    def window(self, begin: int, end: int) -> Tuple[List[float], int]:
+        """Values of samples begin to end, and how many of them were overwritten"""
+        dropped = max(0, end - self.capacity - begin)
+        begin += dropped
+        i, j = begin % self.capacity, end % self.capacity
+        if begin == end:
+            values = []
+        elif i < j:
+            values = self.values[i:j].tolist()
+        else:
+            values = self.values[i:].tolist() + self.values[:j].tolist()
+        return values, dropped
+
+
+def stats(values: List[float]) -> List[Tuple[str, float]]:
+    """min, max, mean and nearest rank quantiles of a window"""
+    values.sort()
+    n = len(values)
+    ret = [("min", values[0]), ("max", values[-1]), ("mean", math.fsum(values) / n)]
+    for name, q in quantiles:
+        ret.append((name, values[max(0, math.ceil(q * n) - 1)]))
+    return ret
+
+
+class Sampler:
+    def __init__(self) -> None:
+        self._name = "sampler"
+        self._lock = threading.Lock()
+        self._scrape_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        # (component, signal) -> Signal, rings of its series by label value
+        self._signals: Dict[Tuple[str, str], Signal] = {}
+        self._rings: Dict[Tuple[str, str], Dict[str, Ring]] = {}
+        # window -> samples of each ring already reported to it, least recently scraped first
+        self._reported: "OrderedDict[str, Dict[Tuple[str, str, str], int]]" = (
+            OrderedDict()
+        )
+        self._names: Optional[Sequence[str]] = None
+        self._window = ""
+        # component.signal -> called with the signal, time and values of every read
+        self._listeners: Dict[
+            str, List[Callable[[Signal, float, Dict[str, float]], None]]
+        ] = {}
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-signals",
+            type=str,
+            default="",
+            help="Signals to sample between scrapes, e.g. nvgpu.power,bmc.power,cpu.util, empty disables sampling",
+        )
+        add_option(
+            f"--{self._name}-rate",
+            type=float,
+            default=20.0,
+            help="Default samples per second of a signal",
+        )
+        add_option(
+            f"--{self._name}-rates",
+            type=str,
+            default="",
+            help="Per signal samples per second, e.g. nvgpu.power=100,bmc.power=2",
+        )
+        add_option(
+            f"--{self._name}-capacity",
+            type=int,
+            default=4096,
+            help="Samples kept per series, older ones are overwritten",
+        )
+        add_option(
+            f"--{self._name}-windows",
+            type=int,
+            default=16,
+            help="Scrapers with their own window, the least recently seen one is forgotten beyond this",
+        )
+        return self
+
+    def subscribe(
+        self, key: str, listener: Callable[[Signal, float, Dict[str, float]], None]
+    ):
+        """Sample a signal for listener too, call before setup
+
+        Args:
+            key (str): component.signal
+            listener (Callable[[Signal, float, Dict[str, float]], None]): called
+                in the sampling thread with the signal, time and values of every read
+        """
+        self._listeners.setdefault(key, []).append(listener)
+
+    def setup(self, components: Dict[str, Component], readiness: Readiness):
+        """Start one sampling thread per selected or subscribed signal
+
+        Args:
+            components (Dict[str, Component]): components providing the signals, by name
+            readiness (Readiness): a thread starts sampling once its component is ready
+        """
+        self._readiness = readiness
+        self._capacity = max(1, get_arg(f"{self._name}_capacity"))
+        self._windows = max(1, get_arg(f"{self._name}_windows"))
+        self._registry = CollectorRegistry(auto_describe=False)
+        self._registry.register(self)
+        self._errors = Counter(
+            "powerall_exporter_sampler_errors",
+            "Failed reads of a sampled signal.",
+            ["signal"],
+        )
+        self._dropped = Counter(
+            "powerall_exporter_sampler_dropped",
+            "Samples overwritten before a scrape reported them.",
+            ["signal"],
+        )
+        rates = self.parse_rates(get_arg(f"{self._name}_rates"))
+        default_rate = get_arg(f"{self._name}_rate")
+        selected = [k.strip() for k in get_arg(f"{self._name}_signals").split(",")]
+        selected = [k for k in selected if k != ""]
+        for key in selected + [k for k in self._listeners if k not in selected]:
+            name, _, signal = key.partition(".")
+            if name not in components:
+                logger.warning(f"Ignore signal {key} of a component not enabled")
+                continue
+            rate = rates.get(key, default_rate)
+            if rate <= 0:
+                logger.warning(f"Ignore signal {key} with rate {rate}")
+                continue
+            t = threading.Thread(
+                target=self.run,
+                args=(name, signal, components[name], 1.0 / rate, key in selected),
+                name=f"{self._name}-{key}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+
+    def parse_rates(self, rates: str) -> Dict[str, float]:
+        """component.signal=hz,component.signal=hz
+
+        Args:
+            rates (str): rates option value
+
+        Returns:
+            Dict[str, float]: samples per second of each named signal
+        """
+        ret = {}
+        for i in rates.split(","):
+            if i == "":
+                continue
+            try:
+                key, hz = i.split("=")
+                ret[key.strip()] = float(hz)
+            except ValueError:
+                logger.warning(f"Ignore invalid sampler rate: {i}")
+        return ret
+
+    def run(self, name: str, signal: str, c: Component, period: float, report: bool):
+        """Read a signal every period seconds until stopped
+
+        Args:
+            name (str): component name
+            signal (str): signal name
+            c (Component): component providing the signal
+            period (float): seconds between the start of two reads
+            report (bool): keep the samples for window statistics, else only
+                listeners get them
+        """
+        while not self._readiness.done(name, 1.0):
+            if self._stop.is_set():
+                return
+        if not self._readiness.ready(name):
+            return
+        key = f"{name}.{signal}"
+        s = c.signals().get(signal)
+        if s is None:
+            logger.warning(f"Component {name} has no signal {signal}")
+            return
+        rings: Dict[str, Ring] = {}
+        if report:
+            with self._lock:
+                self._signals[(name, signal)] = s
+                self._rings[(name, signal)] = rings
+        listeners = self._listeners.get(key, [])
+        failing = False
+        next_read = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                values = s.read()
+                t = time.monotonic()
+                for listener in listeners:
+                    listener(s, t, values)
+                for label, value in values.items() if report else ():
+                    ring = rings.get(label)
+                    if ring is None:
+                        ring = Ring(self._capacity)
+                        with self._lock:
+                            rings[label] = ring
+                    ring.append(t, value)
+                failing = False
+            except Exception as e:
+                self._errors.labels(signal=key).inc()
+                if not failing:
+                    logger.warning(f"Sampling {key} failed: {e}")
+                failing = True
+            # keep the rate, skip reads that are already late instead of bursting
+            next_read = max(next_read + period, time.monotonic())
+            self._stop.wait(next_read - time.monotonic())
+
+    def cursors(self, window: str) -> Dict[Tuple[str, str, str], int]:
+        """Samples of each ring already reported to a window, call under the scrape lock"""
+        reported = self._reported.get(window)
+        if reported is None:
+            reported = self._reported[window] = {}
+            while len(self._reported) > self._windows:
+                dropped, _ = self._reported.popitem(last=False)
+                logger.warning(
+                    f"Forget sampler window {dropped}, more than {self._windows} windows"
+                )
+        self._reported.move_to_end(window)
+        return reported
+
+    def collect(self):
+        """Window statistics since the previous scrape of the same window, see CollectorRegistry"""
+        families = []
+        reported = self.cursors(self._window)
+        with self._lock:
+            signals = [
+                (name, signal, s, dict(self._rings[(name, signal)]))
+                for (name, signal), s in self._signals.items()
+                if self._names is None or name in self._names
+            ]
+        for name, signal, s, rings in signals:
+            window_f = GaugeMetricFamily(
+                f"{name}_{signal}_window",
+                f"{s.help} Statistics of the samples since the previous scrape.",
+                labels=[s.label, "stat"],
+            )
+            samples_f = GaugeMetricFamily(
+                f"{name}_{signal}_window_samples",
+                f"Samples of {name} {signal} since the previous scrape.",
+                labels=[s.label],
+            )
+            for label, ring in sorted(rings.items()):
+                total = ring.total
+                # a new window starts at the oldest sample kept
+                begin = reported.get(
+                    (name, signal, label), max(0, total - ring.capacity)
+                )
+                values, dropped = ring.window(begin, total)
+                reported[(name, signal, label)] = total
+                if dropped:
+                    self._dropped.labels(signal=f"{name}.{signal}").inc(dropped)
+                samples_f.add_metric([label], len(values))
+                if values:
+                    for stat, value in stats(values):
+                        window_f.add_metric([label, stat], value)
+            families += [window_f, samples_f]
+        return families
+
+    def metrics(self, names: Optional[Sequence[str]] = None, window: str = "") -> bytes:
+        """Window statistics of the sampled signals, and sampler errors
+
+        Every call starts a new window for the same window name, so each of
+        several scrapers, e.g. an HA pair, gets all samples since its own
+        previous scrape. Called per scrape, outside of SingleFlight.
+
+        Args:
+            names (Optional[Sequence[str]]): components to include, None for all
+            window (str): scraper the window belongs to
+
+        Returns:
+            bytes: text exposition of the sampled signals
+        """
+        if not self._threads:
+            return b""
+        # one window at a time
+        with self._scrape_lock:
+            self._names = names
+            self._window = window
+            output = generate_latest(self._registry)
+        return output + generate_latest(self._errors) + generate_latest(self._dropped)
@@ -0,0 +1,170 @@
+"""
+Background collection scheduler
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from prometheus_client import Gauge, generate_latest
+from components.component import Component
+from scrape.instrument import Instrumentation
+from scrape.readiness import Readiness
+from scrape.breaker import Breakers
+from typing import Dict, Iterator, List, Optional, Sequence
+import threading
+import time
+
+
+class Snapshot:
+    """Latest rendered output of one component"""
+
+    def __init__(self, output: bytes) -> None:
+        self.output = output
+        self.timestamp = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.timestamp
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self._name = "scheduler"
+        self._threads: List[threading.Thread] = []
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-interval",
+            type=float,
+            default=5.0,
+            help="Default seconds between two background updates of a component",
+        )
+        add_option(
+            f"--{self._name}-intervals",
+            type=str,
+            default="",
+            help="Per component update intervals in seconds, e.g. bmc=30,cpu=1",
+        )
+        add_option(
+            f"--{self._name}-max-staleness",
+            type=float,
+            default=60.0,
+            help="Snapshots older than this many seconds are not served",
+        )
+        return self
+
+    def setup(
+        self,
+        components: Dict[str, Component],
+        instrument: Instrumentation,
+        readiness: Readiness,
+        breakers: Breakers,
+    ):
+        """Start one update thread per component
+
+        Args:
+            components (Dict[str, Component]): components to sample, by name
+            instrument (Instrumentation): records every update
+            readiness (Readiness): a thread starts updating once its component is ready
+            breakers (Breakers): every update goes through the component's circuit
+        """
+        self._components = components
+        self._instrument = instrument
+        self._readiness = readiness
+        self._breakers = breakers
+        self._max_staleness = get_arg(f"{self._name}_max_staleness")
+        self._intervals = self.parse_intervals(get_arg(f"{self._name}_intervals"))
+        self._snapshot_age = Gauge(
+            "powerall_exporter_snapshot_age_seconds",
+            "Seconds since the served snapshot of a component was collected.",
+            ["component"],
+        )
+        default_interval = get_arg(f"{self._name}_interval")
+        for name, c in components.items():
+            interval = self._intervals.get(name, default_interval)
+            t = threading.Thread(
+                target=self.run,
+                args=(name, c, interval),
+                name=f"{self._name}-{name}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        logger.warning("Scheduler exit")
+
+    def parse_intervals(self, intervals: str) -> Dict[str, float]:
+        """name=seconds,name=seconds
+
+        Args:
+            intervals (str): intervals option value
+
+        Returns:
+            Dict[str, float]: interval of each named component
+        """
+        ret = {}
+        for i in intervals.split(","):
+            if i == "":
+                continue
+            try:
+                name, seconds = i.split("=")
+                ret[name.strip()] = float(seconds)
+            except ValueError:
+                logger.warning(f"Ignore invalid scheduler interval: {i}")
+        return ret
+
+    def run(self, name: str, c: Component, interval: float):
+        """Update a component every interval seconds until stopped
+
+        Args:
+            name (str): component name
+            c (Component): component to update
+            interval (float): seconds between the start of two updates
+        """
+        while not self._readiness.done(name, 1.0):
+            if self._stop.is_set():
+                return
+        if not self._readiness.ready(name):
+            return
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                upds = self._breakers.update(name, c)
+                if upds is not None and isinstance(upds, bytes):
+                    self._snapshots[name] = Snapshot(upds)
+                else:
+                    logger.debug(f"Component {name} didn't capture output of monitor")
+            except Exception as e:
+                logger.warning(f"Component {name} background update failed: {e}")
+            self._stop.wait(max(0.0, interval - (time.monotonic() - start)))
+
+    def collect(self, names: Optional[Sequence[str]] = None) -> bytes:
+        """Concatenate the latest snapshots
+
+        Args:
+            names (Optional[Sequence[str]]): components to include, None for all
+
+        Returns:
+            bytes: snapshots not older than max staleness, plus their ages
+        """
+        return b"".join(self.stream(names))
+
+    def stream(self, names: Optional[Sequence[str]] = None) -> Iterator[bytes]:
+        """Latest snapshots one by one, see collect"""
+        for name in self._components.keys() if names is None else names:
+            snapshot = self._snapshots.get(name)
+            if snapshot is None:
+                continue
+            age = snapshot.age
+            self._snapshot_age.labels(component=name).set(age)
+            if age > self._max_staleness:
+                logger.warning(f"Snapshot of component {name} is stale ({age:.1f}s)")
+                self._instrument.skip(name, "stale")
+                continue
+            yield snapshot.output
+        yield generate_latest(self._snapshot_age)
@@ -0,0 +1,166 @@
+"""
+HTTP serving of the Flask app
+"""
+
+from opts.logopt import *
+from opts.argsopt import *
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+import socket
+import threading
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """HTTP/1.1 handler, idle connections are closed after `timeout` seconds
+
+    Werkzeug closes every connection because it does not drain request
+    bodies. Connections are kept open for requests without a body.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body are separate writes, don't let Nagle hold the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def reusable(self) -> bool:
+        return (
+            not self.close_connection
+            # an idle connection holds a worker, give it up if others are waiting
+            and not self.server.saturated()
+            and self.headers.get("Content-Length", "0") == "0"
+            and "Transfer-Encoding" not in self.headers
+        )
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection" and value.lower() == "close" and self.reusable():
+            return
+        super().send_header(keyword, value)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handing connections to a fixed pool of threads
+
+    The development server started by app.run creates a thread per
+    connection and closes it after every response. Here a bounded pool
+    serves connections that are kept alive between scrapes, as long as
+    there are not more connections than threads.
+    """
+
+    multithread = True
+
+    def __init__(
+        self, host: str, port: int, app, threads: int, keep_alive: float, backlog: int
+    ) -> None:
+        handler = type("Handler", (KeepAliveHandler,), {"timeout": keep_alive})
+        self.request_queue_size = backlog
+        super().__init__(host, port, app, handler)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="powerall-http")
+        self._threads = threads
+        self._connections = 0
+        self._lock = threading.Lock()
+
+    def saturated(self) -> bool:
+        return self._connections > self._threads
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self._connections += 1
+        self._executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self._connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+
+class Server:
+    def __init__(self) -> None:
+        self._name = "serve"
+
+    def __enter__(self):
+        add_option(
+            f"--{self._name}-mode",
+            type=str,
+            default="threaded",
+            choices=["dev", "threaded", "waitress"],
+            help="Serve with the development server (dev), a pooled keep-alive server (threaded) or waitress if installed",
+        )
+        add_option(
+            f"--{self._name}-threads",
+            type=int,
+            default=8,
+            help="Worker threads handling requests, threaded and waitress modes",
+        )
+        add_option(
+            f"--{self._name}-keep-alive",
+            type=float,
+            default=15.0,
+            help="Seconds an idle keep-alive connection is held open, threaded and waitress modes",
+        )
+        add_option(
+            f"--{self._name}-backlog",
+            type=int,
+            default=128,
+            help="Listen backlog of the server socket, threaded and waitress modes",
+        )
+        return self
+
+    def setup(self):
+        self._mode = get_arg(f"{self._name}_mode")
+        self._threads = get_arg(f"{self._name}_threads")
+        self._keep_alive = get_arg(f"{self._name}_keep_alive")
+        self._backlog = get_arg(f"{self._name}_backlog")
+        if self._mode == "waitress" and waitress is None:
+            logger.warning("waitress is not installed, serve with the threaded mode")
+            self._mode = "threaded"
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def serve(self, app, host: str, port: int, debug: bool):
+        """Serve app until interrupted
+
+        Args:
+            app: Flask app
+            host (str): address to listen on
+            port (int): port to listen on
+            debug (bool): debug mode, only used by the development server
+        """
+        logger.warning(f"Running on http://{host}:{port} ({self._mode})")
+        if self._mode == "dev":
+            app.run(host, port, debug)
+        elif self._mode == "waitress":
+            waitress.serve(
+                app,
+                host=host,
+                port=port,
+                threads=self._threads,
+                channel_timeout=self._keep_alive,
+                backlog=self._backlog,
+            )
+        else:
+            server = PooledWSGIServer(
+                host, port, app, self._threads, self._keep_alive, self._backlog
+            )
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
@@ -0,0 +1,38 @@
+"""
+Functional tests of components and scrape helpers on small synthetic trees
+
+    pytest tests
+"""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "powerall"))
+
+from opts import argsopt, pathopt  # noqa: E402
+
+
+@pytest.fixture
+def args():
+    """Set parsed options directly, e.g. args(cpu_enable=True)"""
+    old = getattr(argsopt, "args", None)
+
+    def set_args(**kwargs):
+        argsopt.args = argparse.Namespace(**kwargs)
+
+    yield set_args
+    argsopt.args = old
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Point procfs, sysfs and udev data at an empty tree under tmp_path"""
+    old = (pathopt.procfs, pathopt.sysfs, pathopt.udev_data)
+    pathopt.set_paths(
+        str(tmp_path / "proc"), str(tmp_path / "sys"), str(tmp_path / "run/udev/data")
+    )
+    yield tmp_path
+    pathopt.set_paths(*old)
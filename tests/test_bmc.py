@@ -0,0 +1,90 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+redfish = pytest.importorskip("redfish")
+
+from components.bmc import BMC  # noqa: E402
+
+fan = {
+    "Name": "FAN0",
+    "Status": {"State": "Enabled", "Health": "OK"},
+    "Reading": 3000,
+    "ReadingUnits": "RPM",
+    "Oem": {"Public": {"ControlMode": "Auto", "SpeedRatio": 30}},
+}
+power = {
+    "PowerSupplies": [{"PowerOutputWatts": 300, "PowerInputWatts": 320}],
+    "Oem": {
+        "Public": {
+            "CurrentCPUPowerWatts": 150,
+            "CurrentMemoryPowerWatts": 30,
+            "CurrentFANPowerWatts": 20,
+            "TotalPower": 400,
+        }
+    },
+}
+
+
+class Client:
+    """Redfish client of an Inspur NF5280M6 counting its GETs"""
+
+    def __init__(self) -> None:
+        self.gets = Counter()
+        self.inlet = 22
+
+    def login(self, **kwargs):
+        pass
+
+    def logout(self):
+        pass
+
+    def get(self, path: str):
+        self.gets[path] += 1
+        data = {
+            "/redfish/v1/Chassis/1": {"Manufacturer": "Inspur", "Model": "NF5280M6"},
+            "/redfish/v1/Chassis/1/Thermal": {"Fans": [fan]},
+            "/redfish/v1/Chassis/1/Power": power,
+            "/redfish/v1/Chassis/1/ThresholdSensors": {
+                "Sensors": [
+                    {
+                        "Name": "Inlet_Temp",
+                        "Status": "ok",
+                        "unit": "degrees C",
+                        "ReadingValue": self.inlet,
+                    }
+                ]
+            },
+            "/redfish/v1/Chassis/1/DiscreteSensors": {
+                "Sensors": [{"Name": "PSU0_Status", "Status": "Enable"}]
+            },
+        }[path]
+        return SimpleNamespace(dict=data, status=200)
+
+
+def test_sensor_cadence(args, monkeypatch):
+    args(
+        bmc_enable=True,
+        bmc_host="bmc",
+        bmc_user="admin",
+        bmc_passwd="admin",
+        bmc_config="Inspur-NF5280M6",
+    )
+    client = Client()
+    monkeypatch.setattr(redfish, "redfish_client", lambda **kwargs: client)
+    bmc = BMC()
+    bmc.setup()
+    bmc.update()
+    client.inlet = 25
+    output = bmc.update()
+    # threshold readings are fresh on every update
+    assert (
+        b'bmc_threshold_sensors_values{name="Inlet_Temp",unit="degrees C"} 25.0'
+        in output
+    )
+    assert client.gets["/redfish/v1/Chassis/1/ThresholdSensors"] == 2
+    # discrete sensor states refresh on the slow cadence
+    assert client.gets["/redfish/v1/Chassis/1/DiscreteSensors"] == 1
+    assert b'bmc_discrete_sensors{name="PSU0_Status"} 1.0' in output
+    bmc.__exit__(None, None, None)
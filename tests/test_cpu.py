@@ -0,0 +1,133 @@
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from components.cpu import CPU
+
+
+def write(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def write_stat(root: Path, cpus: Dict[int, List[int]]):
+    """/proc/stat with a line per online CPU, columns user nice system idle iowait ..."""
+    rows = [row + [0] * (10 - len(row)) for row in cpus.values()]
+    total = [sum(col) for col in zip(*rows)]
+    lines = ["cpu  " + " ".join(map(str, total))]
+    lines += [f"cpu{c} " + " ".join(map(str, row)) for c, row in zip(cpus, rows)]
+    lines += ["ctxt 1", "btime 1700000000"]
+    write(root / "proc" / "stat", "\n".join(lines) + "\n")
+
+
+def write_cpufreq(root: Path, cpus: List[int]):
+    for c in cpus:
+        d = root / "sys" / "devices" / "system" / "cpu" / f"cpu{c}" / "cpufreq"
+        write(d / "scaling_driver", "acpi-cpufreq\n")
+        write(d / "scaling_available_governors", "userspace performance\n")
+        write(d / "scaling_cur_freq", f"{(c + 1) * 1000000}\n")
+        write(d / "scaling_min_freq", "800000\n")
+        write(d / "scaling_max_freq", "3000000\n")
+        write(d / "scaling_governor", "performance\n")
+
+
+def samples(output: bytes, name: str) -> Dict[tuple, float]:
+    return {
+        tuple(sorted(s.labels.items())): s.value
+        for f in text_string_to_metric_families(output.decode())
+        for s in f.samples
+        if s.name == name
+    }
+
+
+@pytest.fixture
+def cpu(args, tree):
+    args(cpu_enable=True)
+    write(tree / "proc" / "loadavg", "0.52 0.58 0.59 1/467 12345\n")
+    c = CPU()
+    yield c
+    c.__exit__(None, None, None)
+
+
+def test_utils_between_updates(cpu, tree):
+    write_cpufreq(tree, [0, 1])
+    write_stat(tree, {0: [100, 0, 100, 800], 1: [0, 0, 0, 1000]})
+    cpu.setup()
+    first = samples(cpu.update(), "cpu_utils")
+    assert first == {(("cpu", "0"),): 0.0, (("cpu", "1"),): 0.0}
+    # cpu0: 150 busy of 200 ticks, cpu1: 20 busy and 20 iowait of 100 ticks
+    write_stat(tree, {0: [200, 0, 150, 850], 1: [10, 0, 10, 1060, 20]})
+    second = samples(cpu.update(), "cpu_utils")
+    assert second == {(("cpu", "0"),): 75.0, (("cpu", "1"),): 20.0}
+
+
+def test_offline_cpus(cpu, tree):
+    # cpu1 is offline, it has neither a /proc/stat line nor cpufreq
+    write_cpufreq(tree, [0, 2])
+    write_stat(tree, {0: [0, 0, 0, 100], 2: [0, 0, 0, 100]})
+    cpu.setup()
+    assert cpu.get_attrs(["cpufreqs"])["cpufreqs"]["cpunums"] == 2
+    cpu.update()
+    write_stat(tree, {0: [50, 0, 0, 150], 2: [0, 0, 0, 200]})
+    output = cpu.update()
+    assert samples(output, "cpu_utils") == {(("cpu", "0"),): 50.0, (("cpu", "2"),): 0.0}
+    freqs = samples(output, "cpu_freqs")
+    assert freqs[(("cpu", "2"), ("mode", "current"))] == 3000000.0
+    assert freqs[(("cpu", "2"), ("mode", "max"))] == 3000.0
+    # cpu1 comes back online
+    write_cpufreq(tree, [1])
+    write_stat(tree, {0: [50, 0, 0, 250], 1: [5, 0, 0, 5], 2: [0, 0, 0, 300]})
+    utils = samples(cpu.update(), "cpu_utils")
+    assert utils == {
+        (("cpu", "0"),): 0.0,
+        (("cpu", "1"),): 0.0,
+        (("cpu", "2"),): 0.0,
+    }
+
+
+def test_cpuinfo_without_cpufreq(cpu, tree):
+    write_stat(tree, {0: [0, 0, 0, 100], 2: [0, 0, 0, 100]})
+    write(
+        tree / "proc" / "cpuinfo",
+        "processor\t: 0\nmodel name\t: Test CPU\ncpu MHz\t\t: 2100.000\n\n"
+        "processor\t: 2\nmodel name\t: Test CPU\ncpu MHz\t\t: 3500.500\n\n",
+    )
+    cpu.setup()
+    freqs = samples(cpu.update(), "cpu_freqs")
+    assert freqs == {
+        (("cpu", "0"), ("mode", "current")): 2100.0,
+        (("cpu", "0"), ("mode", "max")): 0.0,
+        (("cpu", "0"), ("mode", "min")): 0.0,
+        (("cpu", "2"), ("mode", "current")): 3500.5,
+        (("cpu", "2"), ("mode", "max")): 0.0,
+        (("cpu", "2"), ("mode", "min")): 0.0,
+    }
+
+
+def write_rapl(root: Path, package: int, uj: int, energy_range: int = 262143328850):
+    d = root / "sys" / "class" / "powercap" / f"intel-rapl:{package}"
+    write(d / "name", f"package-{package}\n")
+    write(d / "energy_uj", f"{uj}\n")
+    write(d / "max_energy_range_uj", f"{energy_range}\n")
+
+
+def test_rapl_energy(cpu, tree):
+    write_stat(tree, {0: [0, 0, 0, 100]})
+    write_rapl(tree, 0, 10_000_000)
+    write_rapl(tree, 1, 262_000_000_000)
+    # a subzone of package 0, not a package
+    write(tree / "sys" / "class" / "powercap" / "intel-rapl:0:0" / "energy_uj", "1\n")
+    cpu.setup()
+    assert cpu.energy() == {"0": 10.0, "1": 262000.0}
+    write_rapl(tree, 0, 15_000_000)
+    # package 1 wrapped around max_energy_range_uj
+    write_rapl(tree, 1, 856_671_150)
+    assert cpu.energy() == {"0": 15.0, "1": pytest.approx(263000.0)}
+
+
+def test_no_rapl(cpu, tree):
+    write_stat(tree, {0: [0, 0, 0, 100]})
+    cpu.setup()
+    assert cpu.energy() == {}
@@ -0,0 +1,75 @@
+import gzip
+import threading
+
+import pytest
+from prometheus_client import REGISTRY
+
+from scrape import encoding, formats
+from scrape.encoding import Compression
+from scrape.formats import OPENMETRICS, Formats
+
+
+@pytest.fixture
+def compression(args):
+    args(compression_enable=True, compression_level=6, compression_zstd_level=3)
+    c = Compression()
+    c.setup()
+    yield c
+    REGISTRY.unregister(c._seconds)
+    REGISTRY.unregister(c._ratio)
+
+
+def scrape(window: str) -> bytes:
+    """Shared collection followed by the sampler window of one scraper"""
+    return b"mem_bytes 1.0\n" + f"cpu_util_window_samples {len(window)}.0\n".encode()
+
+
+def count_calls(monkeypatch, module, name: str) -> list:
+    calls = []
+    fn = getattr(module, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return fn(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+
+def test_scrapers_do_not_evict_each_other(compression, monkeypatch):
+    calls = count_calls(monkeypatch, encoding.gzip, "compress")
+    for _ in range(3):
+        for window in ("a", "bb"):
+            output = scrape(window)
+            assert gzip.decompress(compression.compress(output, "gzip")) == output
+    assert calls == [scrape("a"), scrape("bb")]
+
+
+def test_compress_outside_the_lock(compression, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    compress = gzip.compress
+
+    def slow(output, **kwargs):
+        if output == scrape("slow"):
+            started.set()
+            release.wait(5.0)
+        return compress(output, **kwargs)
+
+    monkeypatch.setattr(encoding.gzip, "compress", slow)
+    t = threading.Thread(target=compression.compress, args=(scrape("slow"), "gzip"))
+    t.start()
+    assert started.wait(5.0)
+    # another scraper is not held behind the slow compression
+    assert gzip.decompress(compression.compress(scrape("a"), "gzip")) == scrape("a")
+    release.set()
+    t.join(5.0)
+
+
+def test_formats_per_output(monkeypatch):
+    calls = count_calls(monkeypatch, formats, "parse")
+    f = Formats()
+    for _ in range(3):
+        for window in ("a", "bb"):
+            output = f.render(scrape(window), OPENMETRICS)
+            assert output.endswith(b"# EOF\n")
+    assert calls == [scrape("a"), scrape("bb")]
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from components.component import Signal
+from scrape.energy import Energy
+
+ready = SimpleNamespace(done=lambda name, timeout: True, ready=lambda name: True)
+
+
+class Node:
+    """A GPU with a hardware energy counter and a BMC with only power readings"""
+
+    def __init__(self, gpu_joules: float) -> None:
+        self.gpu_joules = gpu_joules
+
+    def energy(self):
+        return {"0": self.gpu_joules}
+
+
+class Listeners:
+    """Sampler stand-in, the tests feed the power samples"""
+
+    def __init__(self) -> None:
+        self.listeners = {}
+
+    def subscribe(self, key, listener):
+        self.listeners[key] = listener
+
+
+power = Signal("index", "Power.", lambda: {}, watts=1.0)
+
+
+@pytest.fixture
+def energy(args, tmp_path):
+    """Start an Energy on the state file of tmp_path"""
+    started = []
+
+    def start(node: Node, checkpoint: float = 3600.0):
+        args(
+            energy_file=str(tmp_path / "energy.json"),
+            energy_signals="bmc.power",
+            energy_checkpoint=checkpoint,
+            energy_interval=checkpoint,
+        )
+        e = Energy()
+        sampler = Listeners()
+        e.setup({"nvgpu": node, "bmc": SimpleNamespace(energy=dict)}, ready, sampler)
+        started.append(e)
+        return e, sampler.listeners["bmc.power"]
+
+    yield start
+    for e in started:
+        e._stop.set()
+
+
+def test_restore_after_stop(energy):
+    node = Node(1000.0)
+    e, bmc = energy(node)
+    e.read_counters()
+    node.gpu_joules = 1500.0
+    bmc(power, 10.0, {"0": 100.0})
+    bmc(power, 20.0, {"0": 300.0})
+    e.__exit__(None, None, None)
+    assert e.totals() == {"nvgpu": 500.0, "bmc": 2000.0}
+    # the GPU kept using energy while the agent was down
+    node.gpu_joules = 1700.0
+    e, bmc = energy(node)
+    e.read_counters()
+    assert e.totals() == {"nvgpu": 700.0, "bmc": 2000.0}
+    # the first sample after a restart starts a new integral
+    bmc(power, 30.0, {"0": 100.0})
+    bmc(power, 31.0, {"0": 100.0})
+    assert e.totals()["bmc"] == 2100.0
+
+
+def test_restore_checkpoint_after_kill(energy, tmp_path):
+    node = Node(1000.0)
+    e, bmc = energy(node, checkpoint=0.05)
+    e.read_counters()
+    node.gpu_joules = 1200.0
+    bmc(power, 10.0, {"0": 100.0})
+    bmc(power, 11.0, {"0": 100.0})
+    state = tmp_path / "energy.json"
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        if state.exists():
+            saved = json.loads(state.read_text())
+            if saved.get("bmc", {}).get("0", {}).get("joules") == 100.0:
+                break
+        time.sleep(0.05)
+    # killed without __exit__, the last checkpoint is restored
+    e._stop.set()
+    e._thread.join()
+    node.gpu_joules = 1300.0
+    e, bmc = energy(node)
+    e.read_counters()
+    assert e.totals() == {"nvgpu": 300.0, "bmc": 100.0}
+
+
+def test_slow_counters_do_not_stall_scrapes(energy):
+    class Slow(Node):
+        def energy(self):
+            if self.gpu_joules > 1000.0:
+                released.wait(5.0)
+            return super().energy()
+
+    released = threading.Event()
+    node = Slow(1000.0)
+    e, bmc = energy(node, checkpoint=0.01)
+    deadline = time.monotonic() + 5.0
+    while e.totals().get("nvgpu") is None:
+        assert time.monotonic() < deadline, "counters were not read"
+        time.sleep(0.01)
+    # the checkpoint thread is stuck in the driver, scrapes serve the last read
+    node.gpu_joules = 1500.0
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert b'nvgpu_energy_joules_total{index="0"} 0.0' in e.metrics()
+    assert e.totals()["nvgpu"] == 0.0
+    assert time.monotonic() - start < 1.0
+    released.set()
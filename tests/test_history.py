@@ -0,0 +1,96 @@
+import json
+import math
+from array import array
+
+import pytest
+
+from scrape.history import (
+    Store,
+    decode_times,
+    decode_values,
+    encode_times,
+    encode_values,
+)
+
+memtotal = ("mem_memtotal", ())
+counter = ("cpu_seconds_total", (("cpu", "0"), ("mode", "user")))
+
+
+def values(store: Store, name: str) -> list:
+    (series,) = store.query([(name, {})], 0, 2**32, 0)
+    return [v for _, v in series["values"]]
+
+
+def test_values_are_exact(tmp_path):
+    store = Store(str(tmp_path / "mem"), 8, 16)
+    t = store._base
+    store.record(t + 1, {memtotal: 928451644416.0, counter: 123456789.01})
+    store.record(t + 2, {memtotal: 928451644416.0, counter: 123456789.02})
+    assert values(store, "mem_memtotal") == ["928451644416.0", "928451644416.0"]
+    # an increment far below float32 precision is kept
+    assert values(store, "cpu_seconds_total") == ["123456789.01", "123456789.02"]
+    store.close()
+    store = Store(str(tmp_path / "mem"), 8, 16)
+    assert values(store, "cpu_seconds_total") == ["123456789.01", "123456789.02"]
+    store.close()
+
+
+def test_float32_files_are_recreated(tmp_path):
+    store = Store(str(tmp_path / "mem"), 8, 16)
+    store.record(store._base + 1, {memtotal: 1.0})
+    store.close()
+    meta_path = tmp_path / "mem.json"
+    meta = json.loads(meta_path.read_text())
+    del meta["value"]
+    meta_path.write_text(json.dumps(meta))
+    store = Store(str(tmp_path / "mem"), 8, 16)
+    assert store.query([("mem_memtotal", {})], 0, 2**32, 0) == []
+    store.close()
+
+
+def test_encodings_round_trip():
+    times = [0, 1500, 3000, 4500, 6001, 7499, 9000, 2**32 - 2]
+    assert decode_times(encode_times(times), len(times)) == times
+    vals = array(
+        "d", [0.0, 0.0, 1.5, -1.5, math.nan, 1e300, 5e-324, 123456789.01, math.inf]
+    )
+    decoded = decode_values(encode_values(vals), len(vals))
+    assert vals.tobytes() == decoded.tobytes()
+
+
+def test_blocks_seal_and_wrap(tmp_path):
+    # 128 slots are 2 blocks of 64, plus the head
+    store = Store(str(tmp_path / "cpu"), 128, 16)
+    t = store._base
+    for n in range(300):
+        store.record(t + 15 * n, {counter: 1000.0 + n, memtotal: 64.0})
+    points = store.query([("cpu_seconds_total", {})], 0, 2**32, 0)[0]["values"]
+    # the oldest blocks were overwritten, the last 128 slots at least are kept
+    kept = [float(v) for _, v in points]
+    assert kept == [1000.0 + n for n in range(300 - len(kept), 300)]
+    assert len(kept) >= 128
+    assert points[-1][0] == pytest.approx(t + 15 * 299, abs=0.01)
+    # a query of a range only gets its points
+    middle = store.query([("cpu_seconds_total", {})], t + 15 * 250, t + 15 * 259, 0)
+    assert [float(v) for _, v in middle[0]["values"]] == [1250.0 + n for n in range(10)]
+    store.close()
+    # sealed blocks and the head survive a restart
+    store = Store(str(tmp_path / "cpu"), 128, 16)
+    assert [float(v) for v in values(store, "cpu_seconds_total")] == kept
+    store.record(t + 15 * 300, {counter: 1300.0})
+    assert values(store, "cpu_seconds_total")[-1] == "1300.0"
+    store.close()
+
+
+def test_sealed_blocks_are_compressed(tmp_path):
+    store = Store(str(tmp_path / "cpu"), 64, 16)
+    t = store._base
+    for n in range(64):
+        store.record(t + 15 * n, {counter: 1000.0 + n * 0.25, memtotal: 64.0})
+    store.close()
+    (block,) = tmp_path.glob("cpu.*.blk")
+    # raw columns would take 64 * (4 + 8 + 8) bytes
+    assert block.stat().st_size < 64 * (4 + 8 + 8) / 3
+    store = Store(str(tmp_path / "cpu"), 64, 16)
+    assert values(store, "mem_memtotal") == ["64.0"] * 64
+    store.close()
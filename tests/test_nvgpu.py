@@ -0,0 +1,95 @@
+from collections import namedtuple
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+pynvml = pytest.importorskip("pynvml")
+
+from components.nvgpu import NVGPU  # noqa: E402
+
+Utilization = namedtuple("Utilization", "gpu memory")
+Memory = namedtuple("Memory", "total free used")
+
+
+def not_supported(*args):
+    raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+
+def gpu_lost(*args):
+    raise pynvml.NVMLError(pynvml.NVML_ERROR_GPU_IS_LOST)
+
+
+@pytest.fixture
+def nvml(monkeypatch):
+    """One GPU with one fan, stubbed pynvml functions can be replaced per test"""
+    stubs = {
+        "nvmlInit": lambda: None,
+        "nvmlShutdown": lambda: None,
+        "nvmlDeviceGetCount": lambda: 1,
+        "nvmlDeviceGetHandleByIndex": lambda i: i,
+        "nvmlSystemGetCudaDriverVersion_v2": lambda: 12020,
+        "nvmlSystemGetDriverVersion": lambda: "535.104",
+        "nvmlSystemGetNVMLVersion": lambda: "12.535.104",
+        "nvmlDeviceGetNumFans": lambda d: 1,
+        "nvmlDeviceGetMinMaxFanSpeed": lambda d, low, high: None,
+        "nvmlDeviceGetPowerManagementLimitConstraints": lambda d: (100000, 300000),
+        "nvmlDeviceGetUUID": lambda d: f"GPU-{d}",
+        "nvmlDeviceGetName": lambda d: "Test GPU",
+        "nvmlDeviceGetBusType": lambda d: pynvml.NVML_BUS_TYPE_PCIE,
+        "nvmlDeviceGetFanSpeed_v2": lambda d, f: 40,
+        "nvmlDeviceGetApplicationsClock": lambda d, t: 1000,
+        "nvmlDeviceGetClock": lambda d, t, tt: 1400,
+        "nvmlDeviceGetComputeMode": lambda d: 0,
+        "nvmlDeviceGetPerformanceState": lambda d: 2,
+        "nvmlDeviceGetPersistenceMode": lambda d: 1,
+        "nvmlDeviceGetUtilizationRates": lambda d: Utilization(50, 20),
+        "nvmlDeviceGetTemperature": lambda d, t: 60,
+        "nvmlDeviceGetPowerUsage": lambda d: 150000,
+        "nvmlDeviceGetEnforcedPowerLimit": lambda d: 250000,
+        "nvmlDeviceGetMemoryInfo": lambda d: Memory(80, 30, 50),
+    }
+    for name, fn in stubs.items():
+        monkeypatch.setattr(pynvml, name, fn)
+    return lambda name, fn: monkeypatch.setattr(pynvml, name, fn)
+
+
+@pytest.fixture
+def gpu(args, nvml):
+    args(nvgpu_enable=True, nvgpu_config="nvml")
+    g = NVGPU()
+    yield g
+    g.__exit__(None, None, None)
+
+
+def sample_names(output: bytes) -> set:
+    return {
+        s.name
+        for f in text_string_to_metric_families(output.decode())
+        for s in f.samples
+    }
+
+
+def test_fan_speed_not_supported(gpu, nvml):
+    nvml("nvmlDeviceGetFanSpeed_v2", not_supported)
+    gpu.setup()
+    output = gpu.update()
+    assert b'nvgpu_fan_speed{fan="0",index="0",mode="current"}' not in output
+    assert "nvgpu_power" in sample_names(output)
+    # the fan is not queried again
+    nvml("nvmlDeviceGetFanSpeed_v2", gpu_lost)
+    gpu.update()
+
+
+def test_gpuinfo_not_supported(gpu, nvml):
+    nvml("nvmlDeviceGetBusType", not_supported)
+    gpu.setup()
+    names = sample_names(gpu.update())
+    assert "nvgpu_gpuinfo_info" not in names
+    assert "nvgpu_fan_speed" in names
+
+
+def test_fatal_error_fails_update(gpu, nvml):
+    gpu.setup()
+    nvml("nvmlDeviceGetFanSpeed_v2", gpu_lost)
+    with pytest.raises(pynvml.NVMLError):
+        gpu.update()
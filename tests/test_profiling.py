@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from scrape import profiling
+from scrape.profiling import Profiling
+
+
+@pytest.fixture
+def prof(args):
+    args(
+        profiling_enable=True,
+        profiling_max_seconds=60.0,
+        profiling_interval=0.005,
+        profiling_tracemalloc_frames=0,
+    )
+    p = Profiling()
+    p.setup()
+    yield p
+    p.__exit__(None, None, None)
+
+
+def capture(p: Profiling, seconds: float) -> dict:
+    """Start a cProfile profile in a thread, its text report is put in the result"""
+    result = {}
+
+    def run():
+        result["text"] = p.profile(seconds, "cprofile", "text")[0].decode()
+
+    t = threading.Thread(target=run)
+    t.start()
+    deadline = time.monotonic() + 5.0
+    while p._profiles is None:
+        assert time.monotonic() < deadline, "profile did not start"
+        time.sleep(0.01)
+    result["thread"] = t
+    return result
+
+
+def test_concurrent_updates(prof):
+    both = threading.Barrier(2, timeout=5.0)
+
+    def update():
+        # both updates are running at once
+        both.wait()
+        return threading.get_ident()
+
+    report = capture(prof, 0.5)
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(prof.call(update))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5.0)
+    report["thread"].join(timeout=5.0)
+    assert errors == []
+    assert len(set(results)) == 2
+    assert "update" in report["text"]
+
+
+def test_other_profiler_active(prof, monkeypatch):
+    class Active:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling.cProfile, "Profile", Active)
+    report = capture(prof, 0.2)
+    assert prof.call(lambda: 42) == 42
+    report["thread"].join(timeout=5.0)
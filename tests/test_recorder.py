@@ -0,0 +1,137 @@
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from scrape.recorder import ArrowWriter, Recorder  # noqa: E402
+
+# recording threads return at once, rows are added to the batch by the tests
+never_ready = SimpleNamespace(done=lambda name, timeout: True, ready=lambda name: False)
+
+
+def batch(n: int, t: float = 1700000000.5) -> dict:
+    return {
+        "time": [t + i for i in range(n)],
+        "component": ["cpu"] * n,
+        "name": ["cpu_utils", "cpu_loadavg"] * (n // 2) + ["cpu_utils"] * (n % 2),
+        "labels": [f'cpu="{i % 2}"' for i in range(n)],
+        "value": [float(i) for i in range(n)],
+    }
+
+
+def read(path: str):
+    if path.endswith(".parquet"):
+        return pq.read_table(path)
+    with pa.OSFile(path, "rb") as f:
+        return pa.ipc.open_file(f).read_all()
+
+
+@pytest.fixture
+def recorder(args, tmp_path):
+    """Recorder of tmp_path/rec in a format, with options overridden by keyword"""
+    recorders = []
+
+    def make(fmt: str, **options) -> Recorder:
+        opts = dict(
+            recorder_dir=str(tmp_path / "rec"),
+            recorder_format=fmt,
+            recorder_interval=1.0,
+            recorder_flush=3600.0,
+            recorder_roll_mb=256.0,
+            recorder_roll_seconds=3600.0,
+        )
+        opts.update(options)
+        args(**opts)
+        r = Recorder()
+        r.setup({"cpu": None}, never_ready, None, False)
+        recorders.append(r)
+        return r
+
+    yield make
+    for r in recorders:
+        r.__exit__(None, None, None)
+
+
+def add(r: Recorder, rows: dict):
+    with r._lock:
+        for c, values in rows.items():
+            r._batch[c] += values
+
+
+def files(tmp_path, suffix: str) -> list:
+    return sorted(str(p) for p in (tmp_path / "rec").glob(f"*{suffix}"))
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_schema(tmp_path, fmt):
+    path = str(tmp_path / f"out.{fmt}")
+    w = ArrowWriter(path, fmt, pa)
+    w.write(batch(4))
+    w.write(batch(2, 1700000010.0))
+    w.close()
+    table = read(path)
+    assert table.schema.field("time").type == pa.timestamp("ms", tz="UTC")
+    for c in ("component", "name", "labels"):
+        assert table.schema.field(c).type == pa.dictionary(pa.int32(), pa.string())
+    assert table.schema.field("value").type == pa.float64()
+    assert table.num_rows == 6
+    assert table.column("name").to_pylist()[:2] == ["cpu_utils", "cpu_loadavg"]
+    assert table.column("value").to_pylist() == [0.0, 1.0, 2.0, 3.0, 0.0, 1.0]
+    assert table.column("time")[0].as_py().timestamp() == 1700000000.5
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_roll_by_size(tmp_path, recorder, fmt):
+    r = recorder(fmt, recorder_roll_mb=1 / 2**20)
+    for _ in range(3):
+        add(r, batch(4))
+        r.write()
+    finished = files(tmp_path, f".{fmt}")
+    assert len(finished) == 3
+    assert not files(tmp_path, ".part")
+    assert [read(p).num_rows for p in finished] == [4, 4, 4]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_roll_by_age(tmp_path, recorder, fmt):
+    r = recorder(fmt)
+    add(r, batch(4))
+    r.write()
+    add(r, batch(2))
+    r.write()
+    # one file still being written
+    assert len(files(tmp_path, ".part")) == 1
+    assert not files(tmp_path, f".{fmt}")
+    r._opened -= 3600.0
+    add(r, batch(2))
+    r.write()
+    (finished,) = files(tmp_path, f".{fmt}")
+    assert not files(tmp_path, ".part")
+    assert read(finished).num_rows == 8
+
+
+def test_recover(tmp_path, recorder):
+    rec = tmp_path / "rec"
+    rec.mkdir()
+    # writers killed before close, their files have no footer
+    for fmt in ("arrow", "parquet"):
+        w = ArrowWriter(str(tmp_path / f"killed.{fmt}"), fmt, pa)
+        w.write(batch(4))
+        w.write(batch(2))
+        w._sink.flush()
+        shutil.copy(tmp_path / f"killed.{fmt}", rec / f"powerall-h-1-1.{fmt}.part")
+        w.close()
+    # killed between close and rename
+    w = ArrowWriter(str(rec / "powerall-h-1-2.parquet.part"), "parquet", pa)
+    w.write(batch(3))
+    w.close()
+    (rec / "powerall-h-1-3.csv.part").write_text("time,component,name,labels,value\n")
+    recorder("parquet")
+    assert read(str(rec / "powerall-h-1-1.arrow")).num_rows == 6
+    assert (rec / "powerall-h-1-1.parquet.broken").exists()
+    assert read(str(rec / "powerall-h-1-2.parquet")).num_rows == 3
+    assert (rec / "powerall-h-1-3.csv").exists()
+    assert not files(tmp_path, ".part")
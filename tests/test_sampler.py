@@ -0,0 +1,75 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+from components.component import Signal
+from scrape.sampler import Sampler
+
+
+class Power:
+    """Component with one power signal counting its reads"""
+
+    def __init__(self) -> None:
+        self.reads = 0
+
+    def signals(self):
+        return {"power": Signal("index", "Power.", self.read)}
+
+    def read(self):
+        self.reads += 1
+        return {"0": float(self.reads)}
+
+
+ready = SimpleNamespace(done=lambda name, timeout: True, ready=lambda name: True)
+
+
+@pytest.fixture
+def sampler(args):
+    args(
+        sampler_signals="gpu.power",
+        sampler_rate=1000.0,
+        sampler_rates="",
+        sampler_capacity=4096,
+        sampler_windows=2,
+    )
+    s = Sampler()
+    yield s
+    s.__exit__(None, None, None)
+    REGISTRY.unregister(s._errors)
+    REGISTRY.unregister(s._dropped)
+
+
+def window_samples(output: bytes) -> float:
+    for f in text_string_to_metric_families(output.decode()):
+        for s in f.samples:
+            if s.name == "gpu_power_window_samples":
+                return s.value
+    return 0.0
+
+
+def wait_reads(gpu: Power, reads: int, timeout: float = 5.0):
+    """Wait until gpu was read at least reads more times"""
+    target = gpu.reads + reads
+    deadline = time.monotonic() + timeout
+    while gpu.reads < target:
+        assert time.monotonic() < deadline, f"{gpu.reads} of {target} reads"
+        time.sleep(0.01)
+
+
+def test_windows_per_scraper(sampler):
+    gpu = Power()
+    sampler.setup({"gpu": gpu}, ready)
+    wait_reads(gpu, 10)
+    sampler.__exit__(None, None, None)
+    total = gpu.reads
+    # each scraper gets every sample, not the part another one left
+    assert window_samples(sampler.metrics(None, "a")) == total
+    assert window_samples(sampler.metrics(None, "b")) == total
+    assert window_samples(sampler.metrics(None, "a")) == 0
+    # beyond sampler_windows the least recently scraped window starts over
+    assert window_samples(sampler.metrics(None, "c")) == total
+    assert window_samples(sampler.metrics(None, "a")) == 0
+    assert window_samples(sampler.metrics(None, "b")) == total